@@ -15,6 +15,13 @@ from starlette.middleware.cors import CORSMiddleware
 from starlette.routing import Router
 from apistar.exceptions import ValidationError
 from dplaapi.responses import JSONResponse
+from dplaapi.admission import Overloaded
+from dplaapi.rate_limit import RateLimited
+from dplaapi.metrics import MetricsMiddleware
+from dplaapi.event_hooks import TimingMiddleware
+from dplaapi.tracing import TracingMiddleware
+from dplaapi.memory import MemoryMiddleware
+from dplaapi.models import start_pool
 from . import routes
 
 log_levels = {
@@ -42,6 +49,36 @@ if not NECRO_BASE:
                 'necropolis will not work!')
 
 
+def base_urls(value):
+    """Return a list of the URLs in a comma-separated list"""
+    return [u.strip() for u in value.split(',')] if value else [None]
+
+
+# ES_BASE and NECRO_BASE may be comma-separated lists of equivalent
+# endpoints; for example, the same index alias on different Elasticsearch
+# coordinating nodes. Requests are balanced over them.
+ES_BASES = base_urls(ES_BASE)
+ES_BASE = ES_BASES[0]
+NECRO_BASES = base_urls(NECRO_BASE)
+NECRO_BASE = NECRO_BASES[0]
+
+
+def timeouts_from_env(prefix, connect, read):
+    """Return a (connect, read) timeout tuple, as taken by `requests'"""
+    return (float(os.getenv('%s_CONNECT_TIMEOUT' % prefix, connect)),
+            float(os.getenv('%s_READ_TIMEOUT' % prefix, read)))
+
+
+# Connect and read timeouts for the HTTP requests, and the time limit that
+# Elasticsearch is given for executing the search (in Elasticsearch's time
+# units).  The read timeout should be longer than the search time limit so
+# that Elasticsearch gets the chance to respond with partial results.
+ES_TIMEOUT = timeouts_from_env('ES', 3.05, 6)
+ES_SEARCH_TIMEOUT = os.getenv('ES_SEARCH_TIMEOUT', '5s')
+NECRO_TIMEOUT = timeouts_from_env('NECRO', 3.05, 6)
+NECRO_SEARCH_TIMEOUT = os.getenv('NECRO_SEARCH_TIMEOUT', '5s')
+
+
 def http_exception_handler(request, exc):
     # We assume that an HTTPException, which has been raised by our code,
     # has already been logged.
@@ -52,16 +89,55 @@ def validation_exception_handler(request, exc):
     return JSONResponse(exc.messages, status_code=400)
 
 
+def overloaded_exception_handler(request, exc):
+    response = JSONResponse(str(exc), status_code=503)
+    response.headers['Retry-After'] = str(exc.retry_after)
+    return response
+
+
+def rate_limited_exception_handler(request, exc):
+    response = JSONResponse(str(exc), status_code=429)
+    for k, v in exc.headers.items():
+        response.headers[k] = v
+    return response
+
+
 def misc_exception_handler(request, exc):
     log.exception(exc)
     return JSONResponse('Unexpected error', status_code=500)
 
 
-app = Starlette(debug=False)
+class Application(Starlette):
+    """Starlette application that can have middleware around its exception
+    handling
+
+    Starlette's add_middleware() puts middleware inside of the exception
+    handling, where it does not see the responses for errors, and replaces
+    any middleware that was added before.
+    """
+    def __init__(self, debug=False):
+        super(Application, self).__init__(debug=debug)
+        self.outer_app = super(Application, self).__call__
+
+    def add_outer_middleware(self, middleware_class, **kwargs):
+        self.outer_app = middleware_class(self.outer_app, **kwargs)
+
+    def __call__(self, scope):
+        return self.outer_app(scope)
+
+
+app = Application(debug=False)
 app.mount('', Router(routes.routes))
+app.add_event_handler('startup', start_pool)
 app.add_exception_handler(HTTPException, http_exception_handler)
 app.add_exception_handler(ValidationError, validation_exception_handler)
+app.add_exception_handler(Overloaded, overloaded_exception_handler)
+app.add_exception_handler(RateLimited, rate_limited_exception_handler)
 app.add_exception_handler(Exception, misc_exception_handler)
 app.add_middleware(CORSMiddleware,
                    allow_origins=['*'],
                    allow_methods=['GET', 'POST'])
+app.add_outer_middleware(MemoryMiddleware)
+app.add_outer_middleware(TimingMiddleware)
+app.add_outer_middleware(MetricsMiddleware)
+app.add_outer_middleware(TracingMiddleware)
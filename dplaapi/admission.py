@@ -0,0 +1,90 @@
+"""
+admission.py
+~~~~~~~~~~~~
+
+Admission control for requests that go to the search backends.
+
+Each worker admits a limited amount of backend search work at a time. Each
+search is weighed by its estimated cost (see search_query.query_cost()), so a
+few expensive searches fill up the capacity that would otherwise serve many
+cheap ones. When a worker is at its limit, further searches are rejected right
+away, and the client is told to retry after a short while, rather than being
+queued behind everyone else while latency grows for all. The handlers make
+their searches in threads (see dplaapi/tasks.py), so a worker has as many
+searches in flight as it has concurrent requests. Requests that do not
+reach a backend, such as cache hits and redirects, are never counted or
+rejected.
+"""
+
+import os
+import logging
+import threading
+from contextlib import contextmanager
+from dplaapi import metrics
+
+
+log = logging.getLogger(__name__)
+
+
+class Overloaded(Exception):
+    """Raised when a request is not admitted"""
+    def __init__(self, retry_after):
+        """
+        Arguments:
+
+        retry_after:  Number of seconds after which the client may retry
+        """
+        super(Overloaded, self).__init__('Service overloaded')
+        self.retry_after = retry_after
+
+
+class AdmissionController():
+    def __init__(self, capacity, retry_after=1):
+        """
+        Arguments:
+
+        capacity:     Total cost of the backend searches allowed at a time
+        retry_after:  Number of seconds after which a rejected client should
+                      retry
+        """
+        self.capacity = capacity
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def admit(self, cost=1):
+        """Context manager for a backend search
+
+        A search that costs more than the whole capacity is counted as
+        costing the whole capacity, so that it is admitted only when nothing
+        else is in flight.
+
+        Raises Overloaded if the search can not be admitted.
+
+        Arguments:
+        cost:  Estimated cost of the search
+        """
+        charge = min(cost, self.capacity)
+        with self.lock:
+            if self.in_flight + charge > self.capacity:
+                log.warning('Rejecting request costing %g with %g in flight'
+                            % (cost, self.in_flight))
+                raise Overloaded(self.retry_after)
+            self.in_flight += charge
+            metrics.searches_in_flight.set(self.in_flight)
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.in_flight -= charge
+                # Don't let floating point error leave a little cost behind
+                # when nothing is in flight.
+                if self.in_flight < 1e-9:
+                    self.in_flight = 0
+                metrics.searches_in_flight.set(self.in_flight)
+
+
+controller = AdmissionController(
+    int(os.getenv('MAX_SEARCHES_IN_FLIGHT', 8)),
+    int(os.getenv('OVERLOAD_RETRY_AFTER', 1)))
@@ -2,6 +2,7 @@ import os
 import requests
 import logging
 from urllib.parse import urlparse, quote_plus
+from dplaapi import metrics
 
 
 """
@@ -17,6 +18,9 @@ See https://developers.google.com/analytics/devguides/collection/protocol/v1/ref
 
 single_url = 'https://www.google-analytics.com/collect'
 batch_url = 'http://www.google-analytics.com/batch'
+# (connect, read) timeouts, in seconds
+timeout = (float(os.getenv('GA_CONNECT_TIMEOUT', 3.05)),
+           float(os.getenv('GA_READ_TIMEOUT', 5)))
 
 log = logging.getLogger(__name__)
 
@@ -103,7 +107,8 @@ async def track(request, results, api_key, title):
 
 def post(url, body):
     try:
-        resp = requests.post(url, data=body)
+        with metrics.backend_seconds.time(backend='google_analytics'):
+            resp = requests.post(url, data=body, timeout=timeout)
         resp.raise_for_status()
     except Exception:
         log.exception('Failed to post to Google Analytics')
@@ -0,0 +1,189 @@
+"""
+circuit_breaker.py
+~~~~~~~~~~~~~~~~~~
+
+Circuit breakers for the search backends (ES_BASE and NECRO_BASE).
+
+A breaker "trips" (opens) when too many recent calls to its backend have
+failed or have been too slow. While it is open, calls fail fast instead of
+tying up workers on a backend that is in trouble. After a cool-down period it
+lets a small number of trial calls through ("half-open"), and closes again if
+all of them succeed.
+
+allow_request() returns a Permit for each call that it allows, which is passed
+to record_success() or record_failure() when the call ends, and to release()
+in any case, so that a trial call that ends without an outcome, for example
+with an unexpected exception, frees its place for another. Only the outcomes
+of the trial calls count while the breaker is half-open, and the outcomes of
+calls that were already being made when it opened do not count.
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+
+
+log = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class Permit():
+    """Permission for one call to the backend; see allow_request()"""
+
+    def __init__(self, trial_period=None):
+        # The half-open period in which this is a trial call, or None
+        self.trial_period = trial_period
+        self.ended = False
+
+
+class CircuitBreaker():
+    def __init__(self, name, error_threshold=0.5, slow_call_seconds=5.0,
+                 min_calls=10, window=30, recovery_timeout=30,
+                 trial_calls=3):
+        """
+        Arguments:
+
+        name:               Name of the backend, for logging
+        error_threshold:    Fraction (0 - 1) of failed calls within the window
+                            at or above which the breaker trips
+        slow_call_seconds:  Duration after which a successful call is counted
+                            as a failure
+        min_calls:          Number of calls that must be in the window before
+                            the error rate is considered
+        window:             Number of seconds of call history to consider
+        recovery_timeout:   Number of seconds to stay open before allowing
+                            trial calls
+        trial_calls:        Number of trial calls allowed when half-open. All
+                            of them have to succeed for the breaker to close.
+        """
+        self.name = name
+        self.error_threshold = error_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.min_calls = min_calls
+        self.window = window
+        self.recovery_timeout = recovery_timeout
+        self.trial_calls = trial_calls
+        self.lock = threading.Lock()
+        # Number of times that the breaker has been half-open, to tell the
+        # trial calls of one period from those of an earlier one
+        self.period = 0
+        self.reset()
+
+    def reset(self):
+        """Close the breaker and forget all call history"""
+        self.state = CLOSED
+        self.calls = deque()    # (timestamp, succeeded) tuples
+        self.opened_at = None
+        self.trials_started = 0
+        self.trials_succeeded = 0
+
+    def allow_request(self):
+        """Return a Permit if a call to the backend may be made now, or None
+        """
+        with self.lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.recovery_timeout:
+                    return None
+                log.info('Circuit breaker for %s is half-open' % self.name)
+                self.state = HALF_OPEN
+                self.period += 1
+                self.trials_started = 0
+                self.trials_succeeded = 0
+            if self.state == HALF_OPEN:
+                if self.trials_started >= self.trial_calls:
+                    return None
+                self.trials_started += 1
+                return Permit(self.period)
+            return Permit()
+
+    def is_trial(self, permit):
+        # Called with self.lock held
+        return self.state == HALF_OPEN and permit.trial_period == self.period
+
+    def record_success(self, permit, duration=0):
+        """Record a call that got a response
+
+        Arguments:
+
+        permit:    The call's Permit
+        duration:  Number of seconds that the call took
+        """
+        if duration > self.slow_call_seconds:
+            self.record_failure(permit)
+            return
+        with self.lock:
+            permit.ended = True
+            if self.is_trial(permit):
+                self.trials_succeeded += 1
+                if self.trials_succeeded >= self.trial_calls:
+                    log.info('Circuit breaker for %s is closed' % self.name)
+                    self.reset()
+            elif self.state == CLOSED:
+                self.add_call(True)
+
+    def record_failure(self, permit):
+        """Record a call that failed or was too slow
+
+        Arguments:
+
+        permit:  The call's Permit
+        """
+        with self.lock:
+            permit.ended = True
+            if self.is_trial(permit):
+                self.trip()
+                return
+            if self.state != CLOSED:
+                return
+            self.add_call(False)
+            failures = len([c for c in self.calls if not c[1]])
+            if len(self.calls) >= self.min_calls \
+                    and failures / len(self.calls) >= self.error_threshold:
+                self.trip()
+
+    def release(self, permit):
+        """End a call, freeing its place if it is a trial call whose outcome
+        has not been recorded"""
+        with self.lock:
+            if not permit.ended:
+                permit.ended = True
+                if self.is_trial(permit):
+                    self.trials_started -= 1
+
+    def add_call(self, succeeded):
+        now = time.monotonic()
+        self.calls.append((now, succeeded))
+        while self.calls and self.calls[0][0] < now - self.window:
+            self.calls.popleft()
+
+    def trip(self):
+        log.error('Circuit breaker for %s is open' % self.name)
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.calls.clear()
+
+
+def breaker_from_env(name, prefix):
+    """Return a CircuitBreaker configured by environment variables
+
+    The variables are named with the given prefix; for example, with the
+    prefix 'ES', ES_BREAKER_ERROR_THRESHOLD, ES_BREAKER_SLOW_CALL_SECONDS,
+    ES_BREAKER_MIN_CALLS, ES_BREAKER_WINDOW, ES_BREAKER_RECOVERY_TIMEOUT, and
+    ES_BREAKER_TRIAL_CALLS.
+    """
+    def setting(suffix, default, cast=float):
+        return cast(os.getenv('%s_BREAKER_%s' % (prefix, suffix), default))
+
+    return CircuitBreaker(
+        name,
+        error_threshold=setting('ERROR_THRESHOLD', 0.5),
+        slow_call_seconds=setting('SLOW_CALL_SECONDS', 5.0),
+        min_calls=setting('MIN_CALLS', 10, int),
+        window=setting('WINDOW', 30),
+        recovery_timeout=setting('RECOVERY_TIMEOUT', 30),
+        trial_calls=setting('TRIAL_CALLS', 3, int))
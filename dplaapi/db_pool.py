@@ -0,0 +1,162 @@
+"""
+db_pool.py
+~~~~~~~~~~
+
+A PostgreSQL connection pool that is kept ready for requests.
+
+Peewee's pool opens connections when requests ask for them, so the first
+requests of a new worker, or the first after the database has failed over,
+wait for TCP, TLS and authentication; and a connection that the server or a
+firewall has dropped while it was idle is only found out when a request fails
+with it.
+
+This pool opens `min_connections' when the worker starts, and a thread checks
+the idle connections every `check_seconds', closing those that fail or are
+stale, and opening new ones to keep the minimum. A connection that is being
+checked is out of the pool, so a request never waits for a check.
+
+The connections in the pool, the connections opened, and the outcomes of the
+checks are recorded in the metrics.
+"""
+
+import os
+import time
+import heapq
+import logging
+import threading
+from playhouse.pool import PooledDatabase, PooledPostgresqlExtDatabase
+from dplaapi import metrics
+
+
+log = logging.getLogger(__name__)
+
+
+class ManagedPool(PooledPostgresqlExtDatabase):
+    def __init__(self, database, min_connections=0, check_seconds=30,
+                 **kwargs):
+        """
+        Arguments:
+
+        database:         Database name
+        min_connections:  Connections to keep open
+        check_seconds:    Seconds between checks of the idle connections, or
+                          0 not to check them
+
+        Other keyword arguments are those of PooledPostgresqlExtDatabase.
+        """
+        self.min_connections = int(min_connections)
+        self.check_seconds = float(check_seconds)
+        self.checker_pid = None
+        super(ManagedPool, self).__init__(database, **kwargs)
+
+    def _connect(self):
+        # Called with self._lock held, by connect()
+        idle = {self.conn_key(c) for _, c in self._connections}
+        conn = super(ManagedPool, self)._connect()
+        if self.conn_key(conn) not in idle:
+            metrics.db_connections_opened.inc(reason='demand')
+        return conn
+
+    def _open(self):
+        """Return a new connection, bypassing the pool"""
+        return super(PooledDatabase, self)._connect()
+
+    def _discard(self, conn):
+        """Close a connection that has been taken out of the pool"""
+        try:
+            super(PooledDatabase, self)._close(conn)
+        except Exception:
+            log.debug('Error closing database connection', exc_info=True)
+
+    def close_all(self):
+        with self._lock:
+            super(ManagedPool, self).close_all()
+
+    def warm_up(self):
+        """Open connections until there are `min_connections'"""
+        while True:
+            with self._lock:
+                if len(self._connections) + len(self._in_use) \
+                        >= self.min_connections:
+                    return
+            try:
+                conn = self._open()
+            except Exception:
+                log.exception('Failed to open a database connection')
+                return
+            metrics.db_connections_opened.inc(reason='warm_up')
+            with self._lock:
+                heapq.heappush(self._connections, (time.time(), conn))
+
+    def is_usable(self, conn):
+        """Return True if a query on the connection succeeds"""
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except Exception:
+            log.warning('Idle database connection failed a check',
+                        exc_info=True)
+            return False
+
+    def check_idle(self):
+        """Check the connections that are idle, and close those that fail"""
+        with self._lock:
+            idle = list(self._connections)
+        for entry in idle:
+            ts, conn = entry
+            with self._lock:
+                if entry not in self._connections:
+                    # It has been checked out since.
+                    continue
+                self._connections.remove(entry)
+                heapq.heapify(self._connections)
+                closed = self._is_closed(self.conn_key(conn), conn)
+                if closed:
+                    self._closed.discard(self.conn_key(conn))
+            if closed or self._stale_timeout and self._is_stale(ts):
+                self._discard(conn)
+                continue
+            if self.is_usable(conn):
+                metrics.db_checks.inc(outcome='ok')
+                with self._lock:
+                    heapq.heappush(self._connections, entry)
+            else:
+                metrics.db_checks.inc(outcome='failed')
+                self._discard(conn)
+
+    def stats(self):
+        with self._lock:
+            return {'idle': len(self._connections),
+                    'in_use': len(self._in_use),
+                    'min': self.min_connections,
+                    'max': self._max_connections}
+
+    def collect(self):
+        """Update the pool metrics; a collector for metrics.registry"""
+        stats = self.stats()
+        metrics.db_connections.set(stats['idle'], state='idle')
+        metrics.db_connections.set(stats['in_use'], state='in_use')
+
+    def start(self):
+        """Open the minimum connections, and start checking the idle ones
+
+        To be called in each worker process, since neither connections nor
+        threads survive a fork.
+        """
+        self.warm_up()
+        if self.check_seconds > 0 and self.checker_pid != os.getpid():
+            self.checker_pid = os.getpid()
+            thread = threading.Thread(target=self.run, name='db_pool',
+                                      daemon=True)
+            thread.start()
+
+    def run(self):
+        while True:
+            time.sleep(self.check_seconds)
+            try:
+                self.check_idle()
+                self.warm_up()
+            except Exception:
+                log.exception('Failed to check database connections')
@@ -0,0 +1,141 @@
+"""
+es_pool.py
+~~~~~~~~~~
+
+Pools of equivalent Elasticsearch endpoints, with load balancing and passive
+health checking.
+
+Each request goes to one endpoint of the pool, chosen in rotation or by the
+smallest number of outstanding requests. An endpoint that fails several times
+in a row (with a connection error, a timeout, or a 5xx response) is ejected
+from the pool for a while, so that requests go to the other endpoints until it
+has had time to recover.
+"""
+
+import os
+import time
+import logging
+import threading
+import requests
+
+
+log = logging.getLogger(__name__)
+
+ROUND_ROBIN = 'round_robin'
+LEAST_OUTSTANDING = 'least_outstanding'
+
+
+class Endpoint():
+    def __init__(self, url):
+        self.url = url
+        self.outstanding = 0
+        self.failures = 0           # consecutive failures
+        self.ejected_until = 0      # time.monotonic() value
+
+    def __repr__(self):
+        return '<Endpoint %s>' % self.url
+
+    def is_ejected(self, now):
+        return self.ejected_until > now
+
+
+class EndpointPool():
+    def __init__(self, urls, strategy=ROUND_ROBIN, max_failures=3,
+                 ejection_seconds=30):
+        """
+        Arguments:
+
+        urls:              Base URLs of the endpoints
+        strategy:          ROUND_ROBIN or LEAST_OUTSTANDING
+        max_failures:      Number of consecutive failures after which an
+                           endpoint is ejected
+        ejection_seconds:  Number of seconds for which an endpoint is ejected
+        """
+        if strategy not in (ROUND_ROBIN, LEAST_OUTSTANDING):
+            raise ValueError('Unknown load balancing strategy %s' % strategy)
+        self.endpoints = [Endpoint(u) for u in urls]
+        self.strategy = strategy
+        self.max_failures = max_failures
+        self.ejection_seconds = ejection_seconds
+        self.counter = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    def choose(self, exclude=None):
+        """Return the endpoint that should get the next request
+
+        If every endpoint is ejected, return the one that will be back
+        soonest, so that requests are still attempted; unless `exclude' is
+        given, in which case return None if there is no other healthy
+        endpoint.
+
+        Arguments:
+
+        exclude:  An endpoint not to choose; e.g. for a hedged request
+        """
+        now = time.monotonic()
+        with self.lock:
+            self.counter += 1
+            candidates = [e for e in self.endpoints
+                          if e is not exclude and not e.is_ejected(now)]
+            if not candidates:
+                if exclude is not None:
+                    return None
+                return min(self.endpoints, key=lambda e: e.ejected_until)
+            # Rotate the list so that ties are broken in rotation
+            start = self.counter % len(candidates)
+            candidates = candidates[start:] + candidates[:start]
+            if self.strategy == LEAST_OUTSTANDING:
+                return min(candidates, key=lambda e: e.outstanding)
+            return candidates[0]
+
+    def post(self, path, endpoint=None, exclude=None, **kwargs):
+        """POST to the given path of an endpoint and return the response
+
+        Arguments:
+
+        path:      Path to append to the endpoint's base URL
+        endpoint:  The endpoint to use. One is chosen if this is None.
+        exclude:   Passed to choose()
+        kwargs:    Keyword arguments for `requests.post()'
+        """
+        if endpoint is None:
+            endpoint = self.choose(exclude)
+        with self.lock:
+            endpoint.outstanding += 1
+        try:
+            resp = requests.post('%s%s' % (endpoint.url, path), **kwargs)
+        except requests.exceptions.RequestException:
+            self.record(endpoint, False)
+            raise
+        finally:
+            with self.lock:
+                endpoint.outstanding -= 1
+        self.record(endpoint, resp.status_code < 500)
+        return resp
+
+    def record(self, endpoint, succeeded):
+        """Record the outcome of a request to an endpoint"""
+        with self.lock:
+            if succeeded:
+                endpoint.failures = 0
+                return
+            endpoint.failures += 1
+            if endpoint.failures >= self.max_failures:
+                log.error('Ejecting %s for %d seconds after %d failures'
+                          % (endpoint.url, self.ejection_seconds,
+                             endpoint.failures))
+                endpoint.ejected_until = \
+                    time.monotonic() + self.ejection_seconds
+                endpoint.failures = 0
+
+
+def pool_from_env(urls):
+    """Return an EndpointPool configured by environment variables"""
+    return EndpointPool(
+        urls,
+        strategy=os.getenv('ES_BALANCE', ROUND_ROBIN),
+        max_failures=int(os.getenv('ES_EJECT_AFTER_FAILURES', 3)),
+        ejection_seconds=float(os.getenv('ES_EJECT_SECONDS', 30)))
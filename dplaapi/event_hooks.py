@@ -1,49 +1,129 @@
 """
-Event hooks
+event_hooks.py
+~~~~~~~~~~~~~~
 
-As of apistar version 0.5.40, these event hooks interfere with the delivery of
-404 Not Found errors. You can inspect the exception in an on_response or
-on_error handler and find that its `status_code` is 404, but API Star serves
-up a 500 Server Error.
+Request timing.
+
+The time spent in each phase of handling a request (authentication,
+validation, query building, backend search, response shaping and
+serialization) is measured with `phase()', and reported in a Server-Timing
+response header and in a structured access log line by TimingMiddleware.
+
+Phases are recorded for the asyncio task that is handling the request.
+Outside of a request, `phase()' does nothing.
 """
 
-# import logging
-# import time
-# from apistar import http
+import json
+import time
+import logging
+import functools
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.parse import parse_qsl, urlencode
+from dplaapi.metrics import route_name
+from dplaapi import tracing, memory
+from dplaapi.tasks import current_task
+
+
+log = logging.getLogger(__name__)
+access_log = logging.getLogger('dplaapi.access')
+
+# Phase timings of the requests in progress, by asyncio task
+timings = weakref.WeakKeyDictionary()
+
+
+def current_timings():
+    """Return the phase timings of the current request, or None"""
+    task = current_task()
+    return timings.get(task) if task else None
+
+
+@contextmanager
+def phase(name):
+    """Context manager or decorator that times a phase of the request
+
+    The time spent in a phase is added up if it is entered more than once.
+    Each phase is also a trace span, and a checkpoint of the request's peak
+    memory allocation.
+    """
+    request_timings = current_timings()
+    if request_timings is None:
+        with tracing.span(name):
+            yield
+        memory.checkpoint()
+        return
+    start = time.perf_counter()
+    try:
+        with tracing.span(name):
+            yield
+    finally:
+        request_timings[name] = request_timings.get(name, 0) \
+                                + time.perf_counter() - start
+        memory.checkpoint()
 
 
-# log = logging.getLogger(__name__)
+def server_timing(request_timings, total):
+    """Return the value of a Server-Timing header, with durations in ms"""
+    entries = ['%s;dur=%.2f' % (name, seconds * 1000)
+               for name, seconds in request_timings.items()]
+    entries.append('total;dur=%.2f' % (total * 1000))
+    return ', '.join(entries)
 
 
-# class TimingHook:
-#     """Log internal processing time"""
-#     def on_request(self, request: http.Request):
-#         self.started = time.time()
+def loggable_query(query_string):
+    """Return the query string without the API key"""
+    params = [(k, v) for k, v in parse_qsl(query_string.decode('latin-1'))
+              if k != 'api_key']
+    return urlencode(params)
 
-#     def on_response(self):
-#         duration = time.time() - self.started
-#         log.debug("Time: %0.6f seconds" % duration)
 
+class TimingMiddleware():
+    """ASGI middleware that reports the phase timings of each request"""
 
-# class ResponseHeadersHook:
-#     def on_response(self, response: http.Response, exc: Exception):
-#         response.headers['x-test'] = 'ok'
+    def __init__(self, app):
+        self.app = app
 
+    def __call__(self, scope):
+        if scope['type'] != 'http':
+            return self.app(scope)
+        return functools.partial(self.asgi, scope=scope)
 
-# class ErrorWrapupHook:
-#     """
-#     Cleanup or messaging after an exception has been handled
-#     """
-#     def on_response(self, response: http.Response, exc: Exception):
-#         """Document the response given back to the user"""
-#         if exc is not None:
-#             log.error("Responded with %s" % exc.__class__)
-#             log.error(response.status_code)
-#             return True
+    async def asgi(self, receive, send, scope):
+        path = scope['path']
+        request_timings = OrderedDict()
+        task = current_task()
+        timings[task] = request_timings
+        start = time.perf_counter()
+        status = None
+        total = None
 
+        async def sender(message):
+            nonlocal status, total
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                total = time.perf_counter() - start
+                message['headers'] = list(message.get('headers', [])) + [
+                    (b'server-timing',
+                     server_timing(request_timings, total).encode('latin-1'))
+                ]
+            await send(message)
 
-# event_hooks = [
-#     TimingHook,
-#     ResponseHeadersHook,
-#     ErrorWrapupHook
-# ]
+        try:
+            await self.app(scope)(receive, sender)
+        finally:
+            del timings[task]
+            if total is None:
+                total = time.perf_counter() - start
+            access_log.info(json.dumps(OrderedDict([
+                ('method', scope['method']),
+                ('path', path),
+                ('query', loggable_query(scope.get('query_string', b''))),
+                ('route', route_name(scope)),
+                ('trace_id', tracing.current_trace_id()),
+                ('status', status or 500),
+                ('duration_ms', round(total * 1000, 2)),
+                ('phases_ms', OrderedDict(
+                    (name, round(seconds * 1000, 2))
+                    for name, seconds in request_timings.items()))
+            ])))
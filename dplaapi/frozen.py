@@ -0,0 +1,68 @@
+"""
+frozen.py
+~~~~~~~~~
+
+Read-only dicts and lists, for the parts of Elasticsearch queries that are the
+same in every request and are built once, when the modules are imported.
+
+They are subclasses of dict and list, so that they are serialized to JSON, and
+compare equal to, like the dicts and lists that they stand for. The methods
+that would change them raise TypeError, so that a query that is being built
+can not change a part that other queries share. To change a part of a query,
+replace it in the query with a new dict or list, or build the query from a
+frozen template with set_in().
+"""
+
+
+def immutable(self, *args, **kwargs):
+    raise TypeError('%s is read-only' % type(self).__name__)
+
+
+class FrozenDict(dict):
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = \
+        update = immutable
+
+    def __reduce__(self):
+        return (type(self), (dict(self),))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class FrozenList(list):
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = append = clear = \
+        extend = insert = pop = remove = reverse = sort = immutable
+
+    def __reduce__(self):
+        return (type(self), (list(self),))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+def freeze(obj):
+    """Return a frozen copy of nested dicts and lists"""
+    if isinstance(obj, dict):
+        return FrozenDict((k, freeze(v)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return FrozenList(freeze(v) for v in obj)
+    return obj
+
+
+def set_in(template, path, value):
+    """Return a copy of a dict with `value' at `path', a tuple of keys
+
+    Only the dicts on the path are copied, into plain dicts that may be
+    changed. Everything else is shared with the template.
+    """
+    if not path:
+        return value
+    rv = dict(template)
+    rv[path[0]] = set_in(template.get(path[0], {}), path[1:], value)
+    return rv
@@ -0,0 +1,104 @@
+"""
+Handlers for administrative requests, which require a staff API key
+"""
+
+import os
+import asyncio
+import logging
+import tracemalloc
+from starlette.exceptions import HTTPException
+from starlette.responses import PlainTextResponse
+from dplaapi import profiler
+from dplaapi import metrics as app_metrics
+from dplaapi import memory as app_memory
+from dplaapi.responses import JSONResponse
+from dplaapi.handlers import v2 as v2_handlers
+
+
+log = logging.getLogger(__name__)
+max_profile_seconds = float(os.getenv('PROFILE_MAX_SECONDS', 60))
+# The allocation snapshot of the last /admin/memory request, for comparison
+last_snapshot = None
+
+
+def require_staff(request):
+    """Raise HTTP 403 Forbidden unless the API key is a staff member's
+
+    Any request is allowed if authentication is disabled.
+    """
+    account = v2_handlers.account_from_params(request.query_params)
+    if account and not account.staff:
+        raise HTTPException(403, 'Staff API key required')
+
+
+def float_param(request, name, default, minimum, maximum):
+    try:
+        value = float(request.query_params.get(name, default))
+    except ValueError:
+        raise HTTPException(400, '%s must be a number' % name)
+    if not minimum <= value <= maximum:
+        raise HTTPException(400, '%s must be from %g to %g'
+                                 % (name, minimum, maximum))
+    return value
+
+
+async def metrics(request):
+    """Application metrics, in the Prometheus text format"""
+    require_staff(request)
+    return PlainTextResponse(app_metrics.registry.exposition(),
+                             media_type='text/plain; version=0.0.4')
+
+
+async def profile(request):
+    """Profile this worker for some seconds, and return the stacks seen
+
+    The stacks are in the collapsed stack format of flame graph tools. The
+    worker goes on serving other requests while it is being profiled.
+    """
+    require_staff(request)
+    seconds = float_param(request, 'seconds', 10, 0.01, max_profile_seconds)
+    interval = float_param(request, 'interval', 0.005, 0.001, 1)
+
+    if not profiler.lock.acquire(blocking=False):
+        raise HTTPException(409, 'A profile is already being taken')
+    try:
+        log.info('Profiling for %g seconds' % seconds)
+        sampler = profiler.SamplingProfiler(interval)
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            sampler.stop()
+    finally:
+        profiler.lock.release()
+
+    return PlainTextResponse(sampler.collapsed())
+
+
+async def memory(request):
+    """Report this worker's memory use
+
+    The report has the resident set size, and the entries in each cache. If
+    MEMORY_PROFILE is defined, it also has the memory allocated in all, the
+    estimated memory used by each cache, and the `top' lines of code that
+    allocated the most memory that is still in use; or, with `compare=true',
+    the lines whose allocations grew the most since the last report.
+    """
+    global last_snapshot
+    require_staff(request)
+    limit = int(float_param(request, 'top', 20, 1, 1000))
+    compare = request.query_params.get('compare') == 'true'
+
+    rv = {
+        'resident_bytes': app_memory.resident_bytes(),
+        'tracing': tracemalloc.is_tracing(),
+        'caches': app_memory.cache_stats()
+    }
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        rv['allocated_bytes'] = current
+        rv['peak_allocated_bytes'] = peak
+        rv['top_allocations'], snapshot = app_memory.top_allocations(
+            limit, last_snapshot if compare else None)
+        last_snapshot = snapshot
+    return JSONResponse(rv)
@@ -5,26 +5,73 @@ import dplaapi
 import re
 import json
 import os
-import boto3
+import time
+import functools
+import operator
 import secrets
+from concurrent.futures import ThreadPoolExecutor
 from starlette.exceptions import HTTPException
 from starlette.background import BackgroundTask
-from cachetools import cached, TTLCache
+from dplaapi import admission, rate_limit, metrics, tracing
+from dplaapi.circuit_breaker import breaker_from_env
+from dplaapi.es_pool import pool_from_env
+from dplaapi.hedging import hedger_from_env
 from dplaapi.types import ItemsQueryType, MLTQueryType, NecropolisQueryType
-from dplaapi.queries.search_query import SearchQuery
+from dplaapi.queries.search_query import SearchQuery, FacetsQuery, \
+    query_cost, split_facet_params
 from dplaapi.queries.mlt_query import MLTQuery
 from dplaapi.queries.necropolis_query import NecropolisQuery
+from dplaapi.queries.compiled import compile_search
 from dplaapi.facets import facets
 from dplaapi.models import db, Account
 from dplaapi.analytics import track
+from dplaapi.outbox import outbox_from_env, OutboxFull
+from dplaapi.event_hooks import phase
+from dplaapi.tasks import run_in_thread, call_for_task, current_task
 from dplaapi.responses import JSONResponse, JavascriptResponse
 from peewee import OperationalError, DoesNotExist
 
 log = logging.getLogger(__name__)
 ok_email_pat = re.compile(r'^[^@]+@[^@]+\.[^@]+$')
-search_cache = TTLCache(maxsize=100, ttl=20)
-mlt_cache = TTLCache(maxsize=50, ttl=20)
-necropolis_cache = TTLCache(maxsize=50, ttl=20)
+id_pat = re.compile(r'[a-f0-9]{32}$')
+max_ids = int(os.getenv('MAX_IDS', 500))
+
+
+def cache_from_env(name, prefix, maxsize, ttl):
+    """Return a MeteredTTLCache sized by <PREFIX>_CACHE_SIZE and _CACHE_TTL"""
+    return metrics.MeteredTTLCache(
+        name,
+        maxsize=int(os.getenv('%s_CACHE_SIZE' % prefix, maxsize)),
+        ttl=int(os.getenv('%s_CACHE_TTL' % prefix, ttl)))
+
+
+search_cache = cache_from_env('search', 'SEARCH', 100, 20)
+mlt_cache = cache_from_env('mlt', 'MLT', 50, 20)
+necropolis_cache = cache_from_env('necropolis', 'NECROPOLIS', 50, 20)
+# Facets of item searches, when they are requested separately from the
+# records; see search_items()
+split_facets = bool(os.getenv('SPLIT_FACETS'))
+facet_cache = cache_from_env('facets', 'FACET', 100, 3600)
+# Threads in which the facets are requested while the records are, one for
+# each search that a worker admits at a time
+facet_executor = ThreadPoolExecutor(
+    max_workers=admission.controller.capacity)
+# Results to serve when a backend is unavailable, as (size, result) tuples,
+# where size is the length of the result's JSON. The caches are limited by the
+# total size of their results rather than by their number, because a page of
+# 500 items is hundreds of times bigger than a page of 10.
+stale_cache_bytes = int(os.getenv('STALE_CACHE_BYTES', 20000000))
+stale_cache_ttl = int(os.getenv('STALE_CACHE_TTL', 3600))
+es_stale_cache = metrics.MeteredTTLCache('es_stale',
+                                         maxsize=stale_cache_bytes,
+                                         ttl=stale_cache_ttl,
+                                         getsizeof=operator.itemgetter(0))
+necro_stale_cache = metrics.MeteredTTLCache('necropolis_stale',
+                                            maxsize=stale_cache_bytes,
+                                            ttl=stale_cache_ttl,
+                                            getsizeof=operator.itemgetter(0))
+es_breaker = breaker_from_env('ES_BASE', 'ES')
+necro_breaker = breaker_from_env('NECRO_BASE', 'NECRO')
 
 
 def items_key(params):
@@ -46,84 +93,273 @@ def items_key(params):
     return tuple(sorted(items)) + ('v2_items',)
 
 
+def parse_ids(id_or_ids):
+    """Return the list of IDs in a comma-separated path parameter
+
+    Duplicate IDs are removed, keeping the order of the first of each.
+
+    Raises HTTPException 400 for an ID that is badly formatted, or for more
+    than `max_ids' IDs.
+    """
+    ids = []
+    seen = set()
+    for the_id in id_or_ids.split(','):
+        if the_id in seen:
+            continue
+        if not id_pat.match(the_id):
+            raise HTTPException(400, "Bad ID: %s" % the_id)
+        if len(ids) == max_ids:
+            raise HTTPException(400, 'Too many IDs; the maximum is %d'
+                                % max_ids)
+        seen.add(the_id)
+        ids.append(the_id)
+    return ids
+
+
+def cached_complete(cache):
+    """Decorator like cachetools.cached(cache, key=items_key), except that
+    results that timed out are not kept
+
+    A search that times out returns partial results, which should not be
+    served again as though they were complete.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(params, *args, **kwargs):
+            key = items_key(params)
+            try:
+                return cache[key]
+            except KeyError:
+                pass
+            result = func(params, *args, **kwargs)
+            if not result.get('timed_out'):
+                try:
+                    cache[key] = result
+                except ValueError:
+                    pass    # The result is too large for the cache.
+            return result
+        return wrapper
+    return decorator
+
+
+@phase('backend')
 def items(query):
     """Return "item" records from a search query
 
-    The search query could either be a typical SearchQuery or a MLTQuery
-    ("More Like This" query)
+    The search query could either be a typical SearchQuery, a CompiledQuery,
+    or a MLTQuery ("More Like This" query)
 
     Arguments:
-    - query:  instance of SearchQuery or MLTQuery, which has a `query'
-              property.
+    - query:  instance of SearchQuery, CompiledQuery or MLTQuery, which has
+              `body' and `cost' properties.
     """
-    try:
-        resp = requests.post("%s/_search" % dplaapi.ES_BASE, json=query.query)
-        resp.raise_for_status()
-    except requests.exceptions.HTTPError:
-        if resp.status_code == 400:
-            # Assume that a Bad Request is the user's fault and we're getting
-            # this because the query doesn't parse due to a bad search term
-            # parameter.  For example "this AND AND that".
-            raise HTTPException(400, 'Invalid query')
-        else:
-            log.exception('Error querying Elasticsearch')
-            raise HTTPException(503, 'Backend search operation failed')
-    result = resp.json()
-    return result
+    with metrics.backend_seconds.time(backend='elasticsearch'):
+        return backend_search(es_pool(), query.body, es_breaker,
+                              es_stale_cache, dplaapi.ES_TIMEOUT,
+                              dplaapi.ES_SEARCH_TIMEOUT, es_hedger(),
+                              query.cost)
+
+
+@functools.lru_cache(maxsize=None)
+def es_pool():
+    """Return the EndpointPool for ES_BASE"""
+    return pool_from_env(dplaapi.ES_BASES)
+
+
+@functools.lru_cache(maxsize=None)
+def necro_pool():
+    """Return the EndpointPool for NECRO_BASE"""
+    return pool_from_env(dplaapi.NECRO_BASES)
 
 
+@functools.lru_cache(maxsize=None)
+def es_hedger():
+    """Return the Hedger for ES_BASE, or None if hedging is not enabled"""
+    return hedger_from_env(es_pool())
+
+
+@phase('backend')
 def necropolis_items(query):
     """Return records from a necropolis search query
 
     Arguments:
-    - query:  instance of NecropolisQuery, which has a `query' property.
+    - query:  instance of NecropolisQuery, which has a `body' property.
+    """
+    with metrics.backend_seconds.time(backend='necropolis'):
+        return backend_search(necro_pool(), query.body, necro_breaker,
+                              necro_stale_cache, dplaapi.NECRO_TIMEOUT,
+                              dplaapi.NECRO_SEARCH_TIMEOUT, cost=query.cost)
+
+
+def backend_search(pool, body, breaker, stale_cache, timeout,
+                   search_timeout, hedger=None, cost=1):
+    """Return the result of an Elasticsearch _search request
+
+    Calls are subject to admission control, and are made through the
+    backend's circuit breaker. If the breaker is open, or the call fails, a
+    stale result for the same query is returned if there is one.
+
+    Arguments:
+    - pool:            EndpointPool of the Elasticsearch index
+    - body:            JSON of the query
+    - breaker:         CircuitBreaker for the backend
+    - stale_cache:     Cache of results to fall back upon
+    - timeout:         (connect, read) tuple of HTTP timeouts, in seconds
+    - search_timeout:  Time limit for Elasticsearch to execute the search,
+                       e.g. '5s'
+    - hedger:          Hedger for making hedged requests, or None
+    - cost:            Estimated cost of the search, for admission control
     """
+    with admission.controller.admit(cost):
+        return admitted_backend_search(pool, body, breaker, stale_cache,
+                                       timeout, search_timeout, hedger)
+
+
+def admitted_backend_search(pool, body, breaker, stale_cache, timeout,
+                            search_timeout, hedger):
+    permit = breaker.allow_request()
+    if not permit:
+        log.warning('Circuit breaker for %s is open' % breaker.name)
+        return stale_result(stale_cache, body)
+    try:
+        return permitted_backend_search(pool, body, breaker, permit,
+                                        stale_cache, timeout, search_timeout,
+                                        hedger)
+    finally:
+        breaker.release(permit)
+
+
+def permitted_backend_search(pool, body, breaker, permit, stale_cache,
+                             timeout, search_timeout, hedger):
+    stale_key = body
+    started = time.monotonic()
     try:
-        resp = requests.post("%s/_search" % dplaapi.NECRO_BASE,
-                             json=query.query)
-        resp.raise_for_status()
+        headers = {'Content-Type': 'application/json'}
+        kwargs = {'data': body,
+                  'headers': headers,
+                  'params': {'timeout': search_timeout},
+                  'timeout': timeout}
+        with tracing.span('elasticsearch', backend=breaker.name):
+            headers.update(tracing.propagation_headers())
+            if hedger:
+                resp = hedger.post('/_search', **kwargs)
+            else:
+                resp = pool.post('/_search', **kwargs)
+            resp.raise_for_status()
     except requests.exceptions.HTTPError:
         if resp.status_code == 400:
             # Assume that a Bad Request is the user's fault and we're getting
             # this because the query doesn't parse due to a bad search term
             # parameter.  For example "this AND AND that".
+            breaker.record_success(permit, time.monotonic() - started)
             raise HTTPException(400, 'Invalid query')
         else:
+            breaker.record_failure(permit)
             log.exception('Error querying Elasticsearch')
-            raise HTTPException(503, 'Backend search operation failed')
+            return stale_result(stale_cache, stale_key)
+    except requests.exceptions.RequestException:
+        # For example, a ConnectionError or a Timeout
+        breaker.record_failure(permit)
+        log.exception('Error querying Elasticsearch')
+        return stale_result(stale_cache, stale_key)
+    breaker.record_success(permit, time.monotonic() - started)
     result = resp.json()
+    if result.get('timed_out'):
+        # Partial results, which are better than nothing, but which should
+        # not be served again when the backend is unavailable.
+        log.warning('Elasticsearch search timed out after %s' % search_timeout)
+    elif len(resp.content) <= stale_cache.maxsize / 10:
+        # A bigger result would push too many others out.
+        stale_cache[stale_key] = (len(resp.content), result)
     return result
 
 
-@cached(search_cache, key=items_key)
-def search_items(params):
+def stale_result(stale_cache, key):
+    """Return a stale result for the given key, or raise HTTP 503"""
+    try:
+        size, result = stale_cache[key]
+        log.warning('Serving stale search result')
+        return result
+    except KeyError:
+        raise HTTPException(503, 'Backend search operation failed')
+
+
+def search_items(params, cost=None):
     """Get "item" records
 
+    If SPLIT_FACETS is set, the facets of a search are requested separately
+    from its records, at the same time, and are kept in facet_cache, since
+    they are the same for every page of the search and change only when the
+    index does. If the facets can not be had on their own, the records and
+    facets are requested together.
+
     Arguments:
     - params: Dict of querystring or path parameters
+    - cost:   query_cost() of the parameters, if it is known
     """
-    sq = SearchQuery(params)
-    log.debug("Elasticsearch QUERY (Python dict):\n%s" % sq.query)
-    return items(sq)
+    if split_facets and 'facets' in params:
+        hits_params, facets_params = split_facet_params(params)
+        facets_future = facet_executor.submit(
+            call_for_task, current_task(), search_facets, facets_params)
+        result = dict(search_hits(hits_params, cost))
+        try:
+            facets_result = facets_future.result()
+        except (HTTPException, admission.Overloaded):
+            log.warning('Facets search failed; searching with the records')
+            return search_hits(params, cost)
+        result['aggregations'] = facets_result.get('aggregations', {})
+        return result
+    return search_hits(params, cost)
+
 
+@cached_complete(search_cache)
+def search_hits(params, cost=None):
+    """Get "item" records, and the facets in `params', if any
 
-def random(request):
+    Arguments:
+    - params: Dict of querystring or path parameters
+    - cost:   query_cost() of the parameters, if it is known
+    """
+    with phase('query'):
+        cq = compile_search(params, cost)
+    log.debug("Elasticsearch QUERY (JSON):\n%s" % cq.body)
+    return items(cq)
+
+
+@cached_complete(facet_cache)
+def search_facets(params):
+    """Get the facets of an item search
+
+    Arguments:
+    - params: Dict of facet parameters; see split_facet_params()
+    """
+    with phase('query'):
+        fq = FacetsQuery(params)
+    log.debug("Elasticsearch QUERY (JSON):\n%s" % fq.body)
+    return items(fq)
+
+
+async def random(request):
     account = account_from_params(request.query_params)
 
-    goodparams = ItemsQueryType({k: v for [k, v]
-                                 in request.query_params.items()})
+    with phase('validation'):
+        goodparams = ItemsQueryType({k: v for [k, v]
+                                     in request.query_params.items()})
 
     goodparams.update({'random': 'true'})
 
-    sq = SearchQuery(goodparams)
+    with phase('query'):
+        sq = SearchQuery(goodparams)
     log.debug("Elasticsearch QUERY (Python dict):\n%s" % sq.query)
 
-    result = items(sq)
+    limit_headers = limit_rate(account, sq.cost)
+    result = await run_in_thread(items, sq)
 
-    rv = {
-        'count': hit_count(result),
-        'docs': [hit['_source'] for hit in result['hits']['hits']]
-    }
+    with phase('shaping'):
+        rv = {
+            'count': hit_count(result),
+            'docs': [hit['_source'] for hit in result['hits']['hits']]
+        }
 
     if account and not account.staff:
         task = BackgroundTask(track,
@@ -134,29 +370,32 @@ def random(request):
     else:
         task = None
 
-    return response_object(rv, goodparams, task)
+    return response_object(rv, goodparams, task, limit_headers)
 
 
-@cached(mlt_cache, key=items_key)
-def mlt_items(params):
+@cached_complete(mlt_cache)
+def mlt_items(params, cost=None):
     """Get more-like-this "item" records
 
     Arguments:
     - params: Dict of querystring or path parameters
+    - cost:   query_cost() of the parameters, if it is known
     """
-    mltq = MLTQuery(params)
+    with phase('query'):
+        mltq = MLTQuery(params, cost)
     log.debug("Elasticsearch QUERY (Python dict):\n%s" % mltq.query)
     return items(mltq)
 
 
-@cached(necropolis_cache, key=items_key)
+@cached_complete(necropolis_cache)
 def search_necropolis_items(params):
     """Get "necropolis" records
 
     Arguments:
     - params: Dict of querystring or path parameters
     """
-    nq = NecropolisQuery(params)
+    with phase('query'):
+        nq = NecropolisQuery(params)
     log.debug("Elasticsearch QUERY (Python dict):\n%s" % nq.query)
     return necropolis_items(nq)
 
@@ -314,25 +553,62 @@ def compact(doc, params):
     return rv
 
 
-def response_object(data, params, task=None):
-    if 'callback' in params:
-        content = "%s(%s)" % (params['callback'], json.dumps(data))
-        return JavascriptResponse(content, background=task)
-    else:
-        return JSONResponse(data, background=task)
+@phase('serialization')
+def response_object(data, params, task=None, headers=None):
+    with metrics.serialization_seconds.time():
+        if 'callback' in params:
+            content = "%s(%s)" % (params['callback'], json.dumps(data))
+            response = JavascriptResponse(content, background=task)
+        else:
+            response = JSONResponse(data, background=task)
+    # Starlette drops the Content-Type if headers are given to the
+    # constructor.
+    for k, v in (headers or {}).items():
+        response.headers[k] = v
+    return response
 
 
-def send_email(message, destination):
-    """Send email to the given destination, with the given message"""
+@functools.lru_cache(maxsize=None)
+def ses_client():
+    """Return the client for Amazon SES, which is shared by all threads
+
+    boto3 is imported here rather than with this module, because it is slow
+    to import and takes a lot of memory, and it is only needed to send email.
+    """
+    import boto3
+    return boto3.client('ses')
 
+
+def email_source():
+    """Return the address that email is sent from"""
     source = os.getenv('EMAIL_FROM')
     if not source:
-        log.exception('EMAIL_FROM is undefined in environment')
+        log.error('EMAIL_FROM is undefined in environment')
         raise HTTPException(500, 'Can not send email')
+    return source
+
+
+def send_email(message, destination):
+    """Send email to the given destination, with the given message"""
+
+    source = email_source()
     destination = {'ToAddresses': [destination]}
-    client = boto3.client('ses')
-    client.send_email(
-        Source=source, Destination=destination, Message=message)
+    client = ses_client()
+    with metrics.backend_seconds.time(backend='ses'):
+        client.send_email(
+            Source=source, Destination=destination, Message=message)
+
+
+outbox = outbox_from_env(send_email)
+
+
+def queue_email(message, destination):
+    """Send email in the background, or now if the outbox is full"""
+    try:
+        outbox.send(message, destination)
+    except OutboxFull:
+        log.warning('Email outbox is full; sending to %s now' % destination)
+        send_email(message, destination)
 
 
 def send_api_key_email(email, api_key):
@@ -345,7 +621,7 @@ def send_api_key_email(email, api_key):
         'Subject': {'Data': 'Your new DPLA API key'}
     }
     try:
-        send_email(message, email)
+        queue_email(message, email)
     except HTTPException:
         raise
     except Exception:
@@ -364,7 +640,7 @@ def send_reminder_email(email, api_key):
         'Subject': {'Data': 'Your existing DPLA API key'}
     }
     try:
-        send_email(message, email)
+        queue_email(message, email)
     except HTTPException:
         raise
     except Exception:
@@ -374,6 +650,7 @@ def send_reminder_email(email, api_key):
                                  'api_key for that email)')
 
 
+@phase('auth')
 def account_from_params(params):
     """Return an account for the API key extracted from the given parameters
 
@@ -382,8 +659,10 @@ def account_from_params(params):
     if not os.getenv('DISABLE_AUTH'):
         account = None
         try:
-            db.connect()
-            account = Account.get(Account.key == params.get('api_key', ''))
+            with metrics.backend_seconds.time(backend='postgres'):
+                db.connect()
+                account = Account.get(
+                    Account.key == params.get('api_key', ''))
         except (OperationalError, ValueError):
             # OperationalError indicates a problem connecting, such as when
             # the database is unavailable.
@@ -405,32 +684,53 @@ def account_from_params(params):
     return None
 
 
+@phase('auth')
+def limit_rate(account, cost=1):
+    """Count a request against the account's rate limit
+
+    Return the rate limit headers for the response. Raise
+    rate_limit.RateLimited if the limit has been exceeded.
+
+    Arguments:
+    - account:  The Account, or None if authentication is disabled
+    - cost:     The estimated cost of the request, in tokens
+    """
+    if not account:
+        return {}
+    key_class = 'staff' if account.staff else 'public'
+    return rate_limit.limiter.check(account.key, key_class, cost)
+
+
 async def multiple_items(request):
     account = account_from_params(request.query_params)
-    goodparams = {}
-    for (k, v) in request.query_params.items():
-        if v == '*':
-            continue
-        if k == "filter":
-            if 'filter' not in goodparams:
-                goodparams['filter'] = []
-            goodparams['filter'].append(v)
-        else:
-            goodparams[k] = v
-    item_query = ItemsQueryType(goodparams)
-    result = search_items(item_query)
+    with phase('validation'):
+        goodparams = {}
+        for (k, v) in request.query_params.items():
+            if v == '*':
+                continue
+            if k == "filter":
+                if 'filter' not in goodparams:
+                    goodparams['filter'] = []
+                goodparams['filter'].append(v)
+            else:
+                goodparams[k] = v
+        item_query = ItemsQueryType(goodparams)
+    cost = query_cost(item_query)
+    limit_headers = limit_rate(account, cost)
+    result = await run_in_thread(search_items, item_query, cost)
     log.debug('cache size: %d' % search_cache.currsize)
 
-    rv = {
-        'count': hit_count(result),
-        'start': (int(item_query['page']) - 1)
-                  * int(item_query['page_size'])               # noqa: E131
-                  + 1,                                         # noqa: E131
-        'limit': int(item_query['page_size']),
-        'docs': [compact(hit['_source'], item_query)
-                 for hit in result['hits']['hits']],
-        'facets': formatted_facets(result.get('aggregations', {}))
-    }
+    with phase('shaping'):
+        rv = {
+            'count': hit_count(result),
+            'start': (int(item_query['page']) - 1)
+                      * int(item_query['page_size'])           # noqa: E131
+                      + 1,                                     # noqa: E131
+            'limit': int(item_query['page_size']),
+            'docs': [compact(hit['_source'], item_query)
+                     for hit in result['hits']['hits']],
+            'facets': formatted_facets(result.get('aggregations', {}))
+        }
 
     if account and not account.staff:
         task = BackgroundTask(track,
@@ -441,7 +741,7 @@ async def multiple_items(request):
     else:
         task = None
 
-    return response_object(rv, item_query, task)
+    return response_object(rv, item_query, task, limit_headers)
 
 
 async def specific_item(request):
@@ -452,25 +752,26 @@ async def specific_item(request):
 
     id_or_ids = request.path_params['id_or_ids']
     account = account_from_params(request.query_params)
-    goodparams = ItemsQueryType({k: v for [k, v]
-                                 in request.query_params.items()})
-    ids = id_or_ids.split(',')
-    for the_id in ids:
-        if not re.match(r'[a-f0-9]{32}$', the_id):
-            raise HTTPException(400, "Bad ID: %s" % the_id)
+    with phase('validation'):
+        goodparams = ItemsQueryType({k: v for [k, v]
+                                     in request.query_params.items()})
+        ids = parse_ids(id_or_ids)
     goodparams.update({'ids': ids})
     goodparams['page_size'] = len(ids)
 
-    result = search_items(goodparams)
+    cost = query_cost(goodparams)
+    limit_headers = limit_rate(account, cost)
+    result = await run_in_thread(search_items, goodparams, cost)
     log.debug('cache size: %d' % search_cache.currsize)
 
     if hit_count(result) == 0:
         raise HTTPException(404)
 
-    rv = {
-        'count': hit_count(result),
-        'docs': [hit['_source'] for hit in result['hits']['hits']]
-    }
+    with phase('shaping'):
+        rv = {
+            'count': hit_count(result),
+            'docs': [hit['_source'] for hit in result['hits']['hits']]
+        }
 
     if account and not account.staff:
         task = BackgroundTask(track,
@@ -481,7 +782,7 @@ async def specific_item(request):
     else:
         task = None
 
-    return response_object(rv, goodparams, task)
+    return response_object(rv, goodparams, task, limit_headers)
 
 
 async def mlt(request):
@@ -489,32 +790,32 @@ async def mlt(request):
 
     id_or_ids = request.path_params['id_or_ids']
     account = account_from_params(request.query_params)
-    goodparams = MLTQueryType({k: v for [k, v]
-                               in request.query_params.items()})
-    ids = id_or_ids.split(',')
-
-    for the_id in ids:
-        if not re.match(r'[a-f0-9]{32}$', the_id):
-            raise HTTPException(400, "Bad ID: %s" % the_id)
+    with phase('validation'):
+        goodparams = MLTQueryType({k: v for [k, v]
+                                   in request.query_params.items()})
+        ids = parse_ids(id_or_ids)
     goodparams.update({'ids': ids})
 
-    result = mlt_items(goodparams)
+    cost = query_cost(goodparams)
+    limit_headers = limit_rate(account, cost)
+    result = await run_in_thread(mlt_items, goodparams, cost)
     log.debug('cache size: %d' % mlt_cache.currsize)
 
-    rv = {
-        'count': hit_count(result),
-        'start': (int(goodparams['page']) - 1)
-                  * int(goodparams['page_size'])               # noqa: E131
-                  + 1,                                         # noqa: E131
-        'limit': int(goodparams['page_size']),
-        'docs': [compact(hit['_source'], goodparams)
-                 for hit in result['hits']['hits']]
-    }
+    with phase('shaping'):
+        rv = {
+            'count': hit_count(result),
+            'start': (int(goodparams['page']) - 1)
+                      * int(goodparams['page_size'])           # noqa: E131
+                      + 1,                                     # noqa: E131
+            'limit': int(goodparams['page_size']),
+            'docs': [compact(hit['_source'], goodparams)
+                     for hit in result['hits']['hits']]
+        }
 
     if account and not account.staff:
         track(request, rv, account.key, 'More-Like-This search results')
 
-    return response_object(rv, goodparams)
+    return response_object(rv, goodparams, headers=limit_headers)
 
 
 async def specific_necropolis_item(request):
@@ -526,23 +827,27 @@ async def specific_necropolis_item(request):
 
     single_id = request.path_params['single_id']
     account = account_from_params(request.query_params)
-    goodparams = NecropolisQueryType({k: v for [k, v]
-                                     in request.query_params.items()})
+    with phase('validation'):
+        goodparams = NecropolisQueryType({k: v for [k, v]
+                                         in request.query_params.items()})
 
-    if not re.match(r'[a-f0-9]{32}$', single_id):
-        raise HTTPException(400, "Bad ID: %s" % single_id)
+        if not id_pat.match(single_id):
+            raise HTTPException(400, "Bad ID: %s" % single_id)
     goodparams.update({'id': single_id})
 
-    result = search_necropolis_items(goodparams)
+    limit_headers = limit_rate(account)
+
+    result = await run_in_thread(search_necropolis_items, goodparams)
     log.debug('cache size: %d' % necropolis_cache.currsize)
 
     if hit_count(result) == 0:
         raise HTTPException(404)
 
-    rv = {
-        'count': hit_count(result),
-        'docs': [hit['_source'] for hit in result['hits']['hits']]
-    }
+    with phase('shaping'):
+        rv = {
+            'count': hit_count(result),
+            'docs': [hit['_source'] for hit in result['hits']['hits']]
+        }
 
     if account and not account.staff:
         task = BackgroundTask(track,
@@ -553,7 +858,7 @@ async def specific_necropolis_item(request):
     else:
         task = None
 
-    return response_object(rv, goodparams, task)
+    return response_object(rv, goodparams, task, limit_headers)
 
 
 async def api_key(request):
@@ -563,6 +868,9 @@ async def api_key(request):
 
     if not re.match(ok_email_pat, email):
         raise HTTPException(400, 'Bad email address')
+    # Email is sent after the account is saved, so check first that it can
+    # be.
+    email_source()
 
     try:
         db.connect()
@@ -574,8 +882,8 @@ async def api_key(request):
     try:
         old_acct = Account.get(
             Account.email == email, Account.enabled == True)  # noqa: E712
-        send_reminder_email(email, old_acct.key)
         db.close()
+        send_reminder_email(email, old_acct.key)
         raise HTTPException(409, 'There is already an API key for %s.  We have'
                                  ' sent a reminder message to that address.'
                                  % email)
@@ -588,13 +896,13 @@ async def api_key(request):
     try:
         with db.atomic():
             Account(key=new_key, email=email, enabled=True).save()
-            # This is not a BackgroundTask() because we don't want to claim
-            # success to the user unless we know that the email was sent
-            # without error.
-            send_api_key_email(email, new_key)
     finally:
         db.close()
 
+    # The email is sent by the outbox, which tries again if SES fails, after
+    # the database connection has been returned to the pool.
+    send_api_key_email(email, new_key)
+
     return JSONResponse('API key created and sent to %s' % email)
 
 
@@ -0,0 +1,215 @@
+"""
+hedging.py
+~~~~~~~~~~
+
+Hedged requests to Elasticsearch.
+
+A hedged request is sent to one endpoint, and if it has not been answered
+after a delay, a duplicate is sent to another endpoint. The first response to
+arrive is used and the other is abandoned. The delay is a high percentile of
+recent response times, so that only the slowest few requests are duplicated.
+The share of requests that may be hedged is capped as well, so that a backend
+that slows down across the board does not get twice the requests.
+
+A request that may be hedged is made in the executor, so that the calling
+thread is free to take the response of its hedge if that comes first. Other
+requests are made in the calling thread. The executor has two threads for each
+search that a worker admits at a time (see admission.py), one for the request
+and one for its hedge.
+
+This is only suitable for idempotent requests, like searches.
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import (ThreadPoolExecutor, TimeoutError, wait,
+                                FIRST_COMPLETED)
+from dplaapi import admission
+
+
+log = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(max_workers=2 * admission.controller.capacity)
+
+
+class LatencyTracker():
+    """Recent response times, from which the hedging delay is derived"""
+
+    def __init__(self, percentile=95, size=200, min_samples=20,
+                 initial_delay=0.5, min_delay=0.05):
+        """
+        Arguments:
+
+        percentile:     Percentile of recent response times to use as the
+                        delay
+        size:           Number of recent response times to keep
+        min_samples:    Number of response times needed before the
+                        percentile is used instead of initial_delay
+        initial_delay:  Delay to use until there are enough samples
+        min_delay:      Smallest delay to use
+        """
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.samples = deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def delay(self):
+        """Return the number of seconds to wait before hedging a request"""
+        with self.lock:
+            if len(self.samples) < self.min_samples:
+                return self.initial_delay
+            ordered = sorted(self.samples)
+        index = min(len(ordered) - 1,
+                    int(len(ordered) * self.percentile / 100))
+        return max(self.min_delay, ordered[index])
+
+
+class Hedger():
+    """Sends hedged requests to the endpoints of an EndpointPool"""
+
+    def __init__(self, pool, tracker, max_fraction=0.1, size=200):
+        """
+        Arguments:
+
+        pool:          EndpointPool of endpoints, any of which can answer a
+                       request that would go to any other
+        tracker:       LatencyTracker for the endpoints
+        max_fraction:  Largest fraction (0 - 1) of recent requests that may
+                       be hedged
+        size:          Number of recent requests to consider
+        """
+        self.pool = pool
+        self.tracker = tracker
+        self.max_fraction = max_fraction
+        self.recent = deque(maxlen=size)    # whether each request was hedged
+        self.hedged = 0                     # number of True in self.recent
+        self.lock = threading.Lock()
+
+    def may_hedge(self):
+        """Return whether fewer than max_fraction of recent requests have
+        been hedged"""
+        with self.lock:
+            return self.hedged < self.max_fraction * (len(self.recent) + 1)
+
+    def add_request(self, hedged):
+        with self.lock:
+            if len(self.recent) == self.recent.maxlen:
+                self.hedged -= self.recent[0]
+            self.recent.append(hedged)
+            self.hedged += hedged
+
+    def post(self, path, **kwargs):
+        """Make a hedged POST request to the given path of the pool
+
+        Return the `requests.Response'.
+
+        Arguments:
+
+        path:    Path to append to the endpoint's base URL
+        kwargs:  Keyword arguments for `requests.post()'
+        """
+        endpoint = self.pool.choose()
+        hedges = []
+
+        def first():
+            # The tracker gets the response times of the endpoints, not of
+            # hedged calls, which would bring the delay down over time.
+            started = time.monotonic()
+            resp = self.pool.post(path, endpoint=endpoint, **kwargs)
+            self.tracker.record(time.monotonic() - started)
+            return resp
+
+        def second():
+            if not self.may_hedge():
+                return None
+            hedge_endpoint = self.pool.choose(exclude=endpoint)
+            if hedge_endpoint is None:
+                return None
+            log.debug('Hedging request to %s with %s'
+                      % (endpoint.url, hedge_endpoint.url))
+            hedges.append(hedge_endpoint)
+            return executor.submit(self.pool.post, path,
+                                   endpoint=hedge_endpoint, **kwargs)
+
+        try:
+            if self.may_hedge():
+                return hedged_call(first, second, self.tracker.delay())
+            return first()
+        finally:
+            self.add_request(bool(hedges))
+
+
+def hedged_call(first, second, delay):
+    """Call `first', hedged after `delay' seconds with `second'
+
+    Return the first result received. An exception raised by `first' before
+    the delay is not hedged; it is raised. After the delay, an exception is
+    raised only if both calls fail.
+
+    Arguments:
+
+    first:   Function making the request, which returns a `requests.Response'
+    second:  Function that starts the duplicate request and returns its
+             Future, or None if no duplicate can be made
+    delay:   Seconds to wait before calling `second'
+    """
+    first_future = executor.submit(first)
+    try:
+        return first_future.result(timeout=delay)
+    except TimeoutError:
+        pass
+
+    second_future = second()
+    if second_future is None:
+        return first_future.result()
+    pending = {first_future, second_future}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        succeeded = [f for f in done if f.exception() is None]
+        if succeeded:
+            winner = succeeded[0]
+            for loser in (done | pending) - {winner}:
+                abandon(loser)
+            return winner.result()
+    # Both failed; raise the exception of the one that failed last.
+    return done.pop().result()
+
+
+def abandon(future):
+    """Cancel a request, or discard its response when it arrives
+
+    A request that is already in progress can not be interrupted, but its
+    response is closed so that the connection is released.
+    """
+    if not future.cancel():
+        future.add_done_callback(close_response)
+
+
+def close_response(future):
+    if future.exception() is None:
+        future.result().close()
+
+
+def hedger_from_env(pool):
+    """Return a Hedger configured by environment variables, or None
+
+    Hedging is enabled by defining ES_HEDGE, and requires a pool of more than
+    one endpoint.
+    """
+    if not os.getenv('ES_HEDGE') or len(pool) < 2:
+        return None
+    tracker = LatencyTracker(
+        percentile=float(os.getenv('ES_HEDGE_PERCENTILE', 95)),
+        initial_delay=float(os.getenv('ES_HEDGE_INITIAL_DELAY', 0.5)),
+        min_delay=float(os.getenv('ES_HEDGE_MIN_DELAY', 0.05)))
+    return Hedger(pool, tracker,
+                  float(os.getenv('ES_HEDGE_MAX_FRACTION', 0.1)))
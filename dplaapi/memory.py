@@ -0,0 +1,193 @@
+"""
+memory.py
+~~~~~~~~~
+
+Memory accounting, for setting worker counts and cache budgets.
+
+The resident set size of each worker and the number of values in each cache
+are always recorded in the metrics. If MEMORY_PROFILE is defined, allocations
+are also traced with tracemalloc, which slows the worker down and adds to its
+memory use, and:
+
+- The peak memory allocated by each request, above what was allocated when it
+  started, is recorded in the dplaapi_request_peak_bytes histogram. The peak
+  is taken at the end of each phase of the request (see event_hooks.phase()),
+  because tracemalloc's own peak can not be reset per request.
+- The memory used by the values in each cache is estimated whenever metrics
+  are collected.
+- /admin/memory reports the lines of code that allocated the most memory that
+  is still in use.
+
+MEMORY_PROFILE_FRAMES is the number of stack frames that tracemalloc keeps for
+each allocation; it defaults to 1.
+"""
+
+import os
+import sys
+import logging
+import functools
+import tracemalloc
+import weakref
+from dplaapi import metrics
+from dplaapi.tasks import current_task
+
+
+log = logging.getLogger(__name__)
+
+enabled = bool(os.getenv('MEMORY_PROFILE'))
+frames = int(os.getenv('MEMORY_PROFILE_FRAMES', 1))
+
+# [allocated at start, peak allocated] of the requests in progress, by asyncio
+# task
+usage = weakref.WeakKeyDictionary()
+
+# Highest estimate of each cache's size, by cache name
+cache_peaks = {}
+
+
+def start():
+    if enabled and not tracemalloc.is_tracing():
+        log.info('Tracing memory allocations')
+        tracemalloc.start(frames)
+
+
+def checkpoint():
+    """Note the memory allocated now, in the peak of the current request"""
+    if not enabled:
+        return
+    task = current_task()
+    request_usage = usage.get(task) if task else None
+    if request_usage is not None:
+        allocated = tracemalloc.get_traced_memory()[0]
+        request_usage[1] = max(request_usage[1], allocated)
+
+
+def deep_size(obj, seen=None):
+    """Return the bytes used by an object and the objects that it contains
+
+    Only containers of the kinds in decoded JSON are followed. Objects in
+    `seen', a set of object IDs, are not counted again.
+    """
+    if seen is None:
+        seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        size += sys.getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(o)
+    return size
+
+
+def cache_size(cache):
+    """Return an estimate of the bytes used by a cache's values"""
+    seen = set()
+    return sum(deep_size(v, seen) for v in cache.unmetered_values())
+
+
+def resident_bytes():
+    """Return the resident set size of this process, or None if unknown"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE')
+
+
+def cache_stats():
+    """Return a dict of statistics by cache name"""
+    rv = {}
+    for cache in list(metrics.caches.values()):
+        stats = {'entries': len(cache), 'maxsize': cache.maxsize,
+                 'ttl': getattr(cache, 'ttl', None)}
+        if enabled:
+            try:
+                size = cache_size(cache)
+            except RuntimeError:
+                # The cache was changed by another thread.
+                size = None
+            if size is not None:
+                cache_peaks[cache.name] = max(cache_peaks.get(cache.name, 0),
+                                              size)
+                stats['bytes'] = size
+            stats['peak_bytes'] = cache_peaks.get(cache.name)
+        rv[cache.name] = stats
+    return rv
+
+
+def collect():
+    """Update the memory metrics; a collector for metrics.registry"""
+    rss = resident_bytes()
+    if rss is not None:
+        metrics.resident_bytes.set(rss)
+    for name, stats in cache_stats().items():
+        metrics.cache_entries.set(stats['entries'], cache=name)
+        if 'bytes' in stats:
+            metrics.cache_bytes.set(stats['bytes'], cache=name)
+        if stats.get('peak_bytes') is not None:
+            metrics.cache_peak_bytes.set(stats['peak_bytes'], cache=name)
+
+
+def top_allocations(limit, previous=None):
+    """Return the lines that allocated the most memory still in use
+
+    Return a tuple of (list of dicts, tracemalloc.Snapshot). If a previous
+    Snapshot is given, the list is of the lines whose allocations grew the
+    most since then.
+    """
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<unknown>')
+    ])
+    if previous is None:
+        stats = snapshot.statistics('lineno')
+    else:
+        stats = snapshot.compare_to(previous, 'lineno')
+    rv = []
+    for stat in stats[:limit]:
+        frame = stat.traceback[0]
+        entry = {'location': '%s:%d' % (frame.filename, frame.lineno),
+                 'bytes': stat.size,
+                 'count': stat.count}
+        if previous is not None:
+            entry['bytes_diff'] = stat.size_diff
+            entry['count_diff'] = stat.count_diff
+        rv.append(entry)
+    return (rv, snapshot)
+
+
+class MemoryMiddleware():
+    """ASGI middleware that records the peak memory allocated by requests"""
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, scope):
+        if scope['type'] != 'http' or not enabled:
+            return self.app(scope)
+        return functools.partial(self.asgi, scope=scope)
+
+    async def asgi(self, receive, send, scope):
+        task = current_task()
+        allocated = tracemalloc.get_traced_memory()[0]
+        usage[task] = [allocated, allocated]
+        try:
+            await self.app(scope)(receive, send)
+        finally:
+            checkpoint()
+            start, peak = usage.pop(task)
+            metrics.request_peak_bytes.observe(
+                peak - start, route=metrics.route_name(scope))
+
+
+start()
+metrics.registry.add_collector(collect)
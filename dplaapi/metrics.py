@@ -0,0 +1,520 @@
+"""
+metrics.py
+~~~~~~~~~~
+
+Application metrics, exposed in the Prometheus text format.
+
+Each worker keeps its own counters, gauges and histograms. If METRICS_DIR is
+defined, each worker also writes a snapshot of its metrics to a file in that
+directory every METRICS_WRITE_INTERVAL seconds, and the worker that serves
+/metrics adds up the snapshots of the workers that are running. The snapshot
+of a worker is removed when it exits (see gunicorn.conf.py), so that a new
+worker with the same process ID does not take its place; the counters and
+histograms go down then, which Prometheus takes as a reset.
+
+See https://prometheus.io/docs/instrumenting/exposition_formats/
+"""
+
+import os
+import json
+import time
+import logging
+import functools
+import threading
+import weakref
+from contextlib import contextmanager
+from cachetools import LRUCache, TTLCache
+
+
+log = logging.getLogger(__name__)
+
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Registry():
+    """The collection of metrics of a worker"""
+
+    def __init__(self, directory=None, write_interval=5):
+        """
+        Arguments:
+
+        directory:       Directory in which to share snapshots with the other
+                         workers, or None
+        write_interval:  Seconds between writes of this worker's snapshot
+        """
+        self.metrics = []
+        self.collectors = []
+        self.directory = directory
+        self.write_interval = write_interval
+        self.writer_pid = None
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def add_collector(self, collector):
+        """Add a function that updates metrics before each snapshot"""
+        self.collectors.append(collector)
+
+    def snapshot(self):
+        """Return a JSON-serializable dict of this worker's metrics"""
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception:
+                log.exception('Metrics collector failed')
+        return {m.name: m.snapshot() for m in self.metrics}
+
+    def snapshot_path(self, pid):
+        return os.path.join(self.directory, '%d.json' % pid)
+
+    def write_snapshot(self):
+        path = self.snapshot_path(os.getpid())
+        temp_path = '%s.tmp' % path
+        with open(temp_path, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(temp_path, path)
+
+    def reset(self):
+        """Forget all values, e.g. those inherited from a parent process"""
+        for metric in self.metrics:
+            with metric.lock:
+                metric.values.clear()
+
+    def ensure_writer(self):
+        """Start writing snapshots in this worker, if it has not started
+
+        Threads do not survive a fork, so this checks for a new process.
+        """
+        if not self.directory or self.writer_pid == os.getpid():
+            return
+        with self.lock:
+            if self.writer_pid != os.getpid():
+                self.writer_pid = os.getpid()
+                thread = threading.Thread(target=self.write_periodically,
+                                          name='metrics-writer', daemon=True)
+                thread.start()
+
+    def write_periodically(self):
+        while True:
+            try:
+                self.write_snapshot()
+            except Exception:
+                log.exception('Failed to write metrics snapshot')
+            time.sleep(self.write_interval)
+
+    def snapshots(self):
+        """Return a list of the snapshots of the running workers"""
+        if not self.directory:
+            return [self.snapshot()]
+        self.write_snapshot()
+        rv = []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith('.json'):
+                continue
+            pid = int(filename[:-5])
+            if not process_is_live(pid):
+                # Its worker was not removed when it exited.
+                continue
+            try:
+                with open(os.path.join(self.directory, filename)) as f:
+                    rv.append(json.load(f))
+            except (OSError, ValueError):
+                log.exception('Failed to read metrics snapshot %s'
+                              % filename)
+        return rv
+
+    def exposition(self):
+        """Return the metrics of all workers in the Prometheus text format"""
+        snapshots = self.snapshots()
+        lines = []
+        for metric in self.metrics:
+            samples = {}
+            for snapshot in snapshots:
+                for labels, value in snapshot.get(metric.name, []):
+                    key = tuple(labels)
+                    if key in samples:
+                        samples[key] = metric.merge(samples[key], value)
+                    else:
+                        samples[key] = value
+            lines.append('# HELP %s %s' % (metric.name, metric.documentation))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type))
+            for key in sorted(samples):
+                lines.extend(metric.exposition_lines(key, samples[key]))
+        return '\n'.join(lines) + '\n'
+
+
+def default_registry():
+    return registry
+
+
+def process_is_live(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n') \
+                     .replace('"', r'\"')
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ['%s="%s"' % (n, escape(v)) for n, v in zip(names, values)]
+    return '{%s}' % ','.join(pairs)
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric():
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        """
+        Arguments:
+
+        name:           Metric name, e.g. 'dplaapi_requests_total'
+        documentation:  Help text
+        labelnames:     Names of the labels that each value is recorded with
+        registry:       The Registry; defaults to the module's `registry'
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+        (registry or default_registry()).register(self)
+
+    def key(self, labels):
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def snapshot(self):
+        with self.lock:
+            return [[list(k), v] for k, v in self.values.items()]
+
+    def merge(self, a, b):
+        return a + b
+
+    def exposition_lines(self, key, value):
+        return ['%s%s %s' % (self.name, format_labels(self.labelnames, key),
+                             format_value(value))]
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), registry=None,
+                 buckets=default_buckets):
+        super(Histogram, self).__init__(name, documentation, labelnames,
+                                        registry)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            if key not in self.values:
+                self.values[key] = {
+                    'buckets': [0] * (len(self.buckets) + 1),
+                    'sum': 0,
+                    'count': 0
+                }
+            hist = self.values[key]
+            i = 0
+            while i < len(self.buckets) and value > self.buckets[i]:
+                i += 1
+            hist['buckets'][i] += 1
+            hist['sum'] += value
+            hist['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Context manager that observes the time taken by its block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        with self.lock:
+            return [[list(k), dict(v, buckets=list(v['buckets']))]
+                    for k, v in self.values.items()]
+
+    def merge(self, a, b):
+        return {
+            'buckets': [x + y for x, y in zip(a['buckets'], b['buckets'])],
+            'sum': a['sum'] + b['sum'],
+            'count': a['count'] + b['count']
+        }
+
+    def exposition_lines(self, key, value):
+        lines = []
+        cumulative = 0
+        names = self.labelnames + ('le',)
+        for bound, count in zip(self.buckets + (float('inf'),),
+                                value['buckets']):
+            cumulative += count
+            lines.append('%s_bucket%s %s' % (
+                self.name, format_labels(names, key + (format_value(bound),)),
+                format_value(cumulative)))
+        labels = format_labels(self.labelnames, key)
+        lines.append('%s_sum%s %s' % (self.name, labels,
+                                      format_value(value['sum'])))
+        lines.append('%s_count%s %s' % (self.name, labels,
+                                        format_value(value['count'])))
+        return lines
+
+
+registry = Registry(os.getenv('METRICS_DIR'),
+                    float(os.getenv('METRICS_WRITE_INTERVAL', 5)))
+
+request_seconds = Histogram(
+    'dplaapi_request_seconds',
+    'Time taken to respond to requests',
+    ['route', 'method', 'status'])
+requests_in_flight = Gauge(
+    'dplaapi_requests_in_flight',
+    'Requests being handled')
+backend_seconds = Histogram(
+    'dplaapi_backend_seconds',
+    'Time taken by calls to backend services',
+    ['backend'])
+searches_in_flight = Gauge(
+    'dplaapi_searches_in_flight_cost',
+    'Total estimated cost of the backend searches in flight')
+cache_hits = Counter(
+    'dplaapi_cache_hits_total',
+    'Cache lookups that found a value',
+    ['cache'])
+cache_misses = Counter(
+    'dplaapi_cache_misses_total',
+    'Cache lookups that did not find a value',
+    ['cache'])
+cache_evictions = Counter(
+    'dplaapi_cache_evictions_total',
+    'Values removed from a full cache to make room for another',
+    ['cache'])
+serialization_seconds = Histogram(
+    'dplaapi_serialization_seconds',
+    'Time taken to serialize response bodies',
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25))
+resident_bytes = Gauge(
+    'dplaapi_resident_memory_bytes',
+    'Resident set size of the workers')
+cache_entries = Gauge(
+    'dplaapi_cache_entries',
+    'Values in a cache',
+    ['cache'])
+cache_bytes = Gauge(
+    'dplaapi_cache_bytes',
+    'Estimated memory used by the values in a cache, if MEMORY_PROFILE is '
+    'defined',
+    ['cache'])
+cache_peak_bytes = Gauge(
+    'dplaapi_cache_peak_bytes',
+    'Highest estimate of dplaapi_cache_bytes, if MEMORY_PROFILE is defined',
+    ['cache'])
+request_peak_bytes = Histogram(
+    'dplaapi_request_peak_bytes',
+    'Peak memory allocated while handling requests, if MEMORY_PROFILE is '
+    'defined',
+    ['route'],
+    buckets=(2 ** 16, 2 ** 18, 2 ** 20, 2 ** 22, 2 ** 24, 2 ** 26, 2 ** 28))
+emails = Counter(
+    'dplaapi_emails_total',
+    'Attempts to send email, by outcome: sent, retried or failed',
+    ['outcome'])
+outbox_pending = Gauge(
+    'dplaapi_outbox_pending',
+    'Email messages waiting to be sent')
+db_connections = Gauge(
+    'dplaapi_db_connections',
+    'PostgreSQL connections in the pool, by state: idle or in_use',
+    ['state'])
+db_connections_opened = Counter(
+    'dplaapi_db_connections_opened_total',
+    'PostgreSQL connections opened, by reason: warm_up or demand',
+    ['reason'])
+db_checks = Counter(
+    'dplaapi_db_checks_total',
+    'Checks of idle PostgreSQL connections, by outcome: ok or failed',
+    ['outcome'])
+
+# The metered caches that exist, by id(), for memory accounting. (Caches are
+# mappings, which are not hashable.)
+caches = weakref.WeakValueDictionary()
+
+
+class MeteredCache():
+    """Mixin for a cachetools cache that counts its hits, misses and
+    evictions
+
+    Searches run in threads (see dplaapi/tasks.py), so each operation on the
+    cache holds its lock.
+    """
+
+    def __init__(self, name, *args, **kwargs):
+        super(MeteredCache, self).__init__(*args, **kwargs)
+        self.name = name
+        self.evicting = False
+        self.lock = threading.RLock()
+        caches[id(self)] = self
+
+    def __getitem__(self, key):
+        with self.lock:
+            # popitem() gets the value of the item that it evicts, which is
+            # not a lookup.
+            if self.evicting:
+                return super(MeteredCache, self).__getitem__(key)
+            try:
+                value = super(MeteredCache, self).__getitem__(key)
+            except KeyError:
+                cache_misses.inc(cache=self.name)
+                raise
+        cache_hits.inc(cache=self.name)
+        return value
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            super(MeteredCache, self).__setitem__(key, value)
+
+    def __delitem__(self, key):
+        with self.lock:
+            super(MeteredCache, self).__delitem__(key)
+
+    def __contains__(self, key):
+        with self.lock:
+            return super(MeteredCache, self).__contains__(key)
+
+    def __len__(self):
+        with self.lock:
+            return super(MeteredCache, self).__len__()
+
+    def unmetered_values(self):
+        """Return a list of the values, without counting lookups"""
+        rv = []
+        with self.lock:
+            for key in list(self):
+                try:
+                    rv.append(super(MeteredCache, self).__getitem__(key))
+                except KeyError:
+                    # It expired.
+                    pass
+        return rv
+
+    def popitem(self):
+        with self.lock:
+            self.evicting = True
+            try:
+                item = super(MeteredCache, self).popitem()
+            finally:
+                self.evicting = False
+        cache_evictions.inc(cache=self.name)
+        return item
+
+    def clear(self):
+        with self.lock:
+            super(MeteredCache, self).clear()
+
+
+class MeteredTTLCache(MeteredCache, TTLCache):
+    """TTLCache that counts its hits, misses and evictions"""
+
+    def __init__(self, name, maxsize, ttl, **kwargs):
+        super(MeteredTTLCache, self).__init__(name, maxsize, ttl, **kwargs)
+
+
+class MeteredLRUCache(MeteredCache, LRUCache):
+    """LRUCache that counts its hits, misses and evictions"""
+
+    def __init__(self, name, maxsize, **kwargs):
+        super(MeteredLRUCache, self).__init__(name, maxsize, **kwargs)
+
+
+def route_name(scope):
+    """Return the name of the endpoint that the router chose, for a label"""
+    return getattr(scope.get('endpoint'), '__name__', 'unmatched')
+
+
+class MetricsMiddleware():
+    """ASGI middleware that records request latency and requests in flight
+
+    The latency is measured until the response body has been sent, and does
+    not include background tasks.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, scope):
+        if scope['type'] != 'http':
+            return self.app(scope)
+        return functools.partial(self.asgi, scope=scope)
+
+    async def asgi(self, receive, send, scope):
+        registry.ensure_writer()
+        start = time.perf_counter()
+        status = None
+        observed = False
+
+        def observe(status):
+            nonlocal observed
+            if not observed:
+                observed = True
+                request_seconds.observe(time.perf_counter() - start,
+                                        route=route_name(scope),
+                                        method=scope['method'],
+                                        status=status)
+
+        async def sender(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+            if message['type'] == 'http.response.body' \
+                    and not message.get('more_body', False):
+                observe(status)
+                requests_in_flight.dec()
+
+        requests_in_flight.inc()
+        try:
+            await self.app(scope)(receive, sender)
+        finally:
+            if not observed:
+                observe(status or 500)
+                requests_in_flight.dec()
@@ -1,7 +1,8 @@
 
 import os
 import peewee
-from playhouse.pool import PooledPostgresqlExtDatabase
+from dplaapi import metrics
+from dplaapi.db_pool import ManagedPool
 
 
 db_name = os.getenv('POSTGRES_DATABASE')
@@ -13,14 +14,31 @@ db_pw = os.getenv('POSTGRES_PASSWORD')
 db_max_conn = os.getenv('POSTGRES_MAX_CONN', 20)
 db_timeout = os.getenv('POSTGRES_TIMEOUT')
 db_stale_timeout = os.getenv('POSTGRES_STALE_TIMEOUT')
+# Connections opened when a worker starts, and kept open; and seconds between
+# checks of the idle connections. See dplaapi/db_pool.py.
+db_min_conn = os.getenv('POSTGRES_MIN_CONN', 2)
+db_check_interval = os.getenv('POSTGRES_CHECK_INTERVAL', 30)
 
-db = PooledPostgresqlExtDatabase(
+db = ManagedPool(
     db_name,
+    min_connections=db_min_conn,
+    check_seconds=db_check_interval,
     host=db_host,
     user=db_user,
     password=db_pw,
     max_connections=db_max_conn,
     stale_timeout=db_stale_timeout)
+metrics.registry.add_collector(db.collect)
+
+
+def start_pool():
+    """Prepare the connection pool in a worker that is starting
+
+    Without authentication, the database is only needed to create API keys,
+    and might not exist, so no connections are opened in advance.
+    """
+    if not os.getenv('DISABLE_AUTH'):
+        db.start()
 
 
 class Account(peewee.Model):
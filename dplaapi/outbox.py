@@ -0,0 +1,160 @@
+"""
+outbox.py
+~~~~~~~~~
+
+Email delivery in the background.
+
+Messages are queued in memory, and sent by a thread in each worker. A message
+that can not be sent is tried again after a delay that doubles each time,
+starting at OUTBOX_RETRY_SECONDS (default 1), until it has been tried
+OUTBOX_MAX_ATTEMPTS times (default 5), after which it is logged and dropped.
+
+The queue holds up to OUTBOX_SIZE messages (default 1000). A worker that is
+shutting down waits up to OUTBOX_SHUTDOWN_SECONDS (default 10) for its queue
+to be sent. Messages that are still queued after that are lost.
+"""
+
+import os
+import time
+import heapq
+import atexit
+import logging
+import itertools
+import threading
+from collections import namedtuple
+from dplaapi import metrics
+
+
+log = logging.getLogger(__name__)
+
+Envelope = namedtuple('Envelope', ['message', 'destination', 'attempts'])
+
+
+class OutboxFull(Exception):
+    """Raised when a message is sent to an outbox that is full"""
+    def __init__(self):
+        super(OutboxFull, self).__init__('Email outbox is full')
+
+
+class Outbox():
+    def __init__(self, deliver, maxsize=1000, max_attempts=5,
+                 retry_seconds=1, shutdown_seconds=10):
+        """
+        Arguments:
+
+        deliver:           Function of (message, destination) that sends a
+                           message, raising an exception if it fails
+        maxsize:           Most messages that may be queued
+        max_attempts:      Times to try sending a message
+        retry_seconds:     Delay before the first retry, which doubles for
+                           each further retry
+        shutdown_seconds:  Most seconds to wait for the queue to be sent when
+                           the process exits
+        """
+        self.deliver = deliver
+        self.maxsize = maxsize
+        self.max_attempts = max_attempts
+        self.retry_seconds = retry_seconds
+        self.shutdown_seconds = shutdown_seconds
+        self.pending = []    # Heap of (due time, sequence, Envelope)
+        self.sending = 0
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.worker_pid = None
+
+    def send(self, message, destination):
+        """Queue a message, raising OutboxFull if the queue is full"""
+        with self.condition:
+            if len(self.pending) + self.sending >= self.maxsize:
+                raise OutboxFull()
+            self.push(time.monotonic(), Envelope(message, destination, 0))
+        self.ensure_worker()
+
+    def push(self, due, envelope):
+        heapq.heappush(self.pending, (due, next(self.sequence), envelope))
+        metrics.outbox_pending.set(len(self.pending))
+        self.condition.notify_all()
+
+    def ensure_worker(self):
+        """Start the sending thread in this process, if it has not started
+
+        Threads do not survive a fork, so this checks for a new process.
+        """
+        if self.worker_pid == os.getpid():
+            return
+        with self.condition:
+            if self.worker_pid != os.getpid():
+                self.worker_pid = os.getpid()
+                thread = threading.Thread(target=self.run, name='outbox',
+                                          daemon=True)
+                thread.start()
+                atexit.register(self.flush, self.shutdown_seconds)
+
+    def run(self):
+        while True:
+            self.attempt(self.next_due())
+
+    def next_due(self):
+        """Wait for a message that is due to be sent, and return it"""
+        with self.condition:
+            while True:
+                timeout = None
+                if self.pending:
+                    timeout = self.pending[0][0] - time.monotonic()
+                    if timeout <= 0:
+                        envelope = heapq.heappop(self.pending)[2]
+                        metrics.outbox_pending.set(len(self.pending))
+                        self.sending += 1
+                        return envelope
+                self.condition.wait(timeout)
+
+    def attempt(self, envelope):
+        attempts = envelope.attempts + 1
+        try:
+            self.deliver(envelope.message, envelope.destination)
+        except Exception:
+            if attempts >= self.max_attempts:
+                log.exception('Giving up sending email to %s after %d '
+                              'attempts' % (envelope.destination, attempts))
+                metrics.emails.inc(outcome='failed')
+                due = None
+            else:
+                log.warning('Failed to send email to %s; will try again'
+                            % envelope.destination, exc_info=True)
+                metrics.emails.inc(outcome='retried')
+                due = time.monotonic() \
+                    + self.retry_seconds * 2 ** (attempts - 1)
+        else:
+            metrics.emails.inc(outcome='sent')
+            due = None
+        with self.condition:
+            self.sending -= 1
+            if due is not None:
+                self.push(due, envelope._replace(attempts=attempts))
+            self.condition.notify_all()
+
+    def flush(self, timeout):
+        """Wait up to `timeout' seconds for the queue to be sent
+
+        Return True if it was, and False otherwise.
+        """
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while self.pending or self.sending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    log.warning('%d email messages were not sent'
+                                % (len(self.pending) + self.sending))
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+
+def outbox_from_env(deliver):
+    """Return an Outbox configured by environment variables"""
+    return Outbox(deliver,
+                  maxsize=int(os.getenv('OUTBOX_SIZE', 1000)),
+                  max_attempts=int(os.getenv('OUTBOX_MAX_ATTEMPTS', 5)),
+                  retry_seconds=float(os.getenv('OUTBOX_RETRY_SECONDS', 1)),
+                  shutdown_seconds=float(
+                      os.getenv('OUTBOX_SHUTDOWN_SECONDS', 10)))
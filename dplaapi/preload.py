@@ -0,0 +1,78 @@
+"""
+preload.py
+~~~~~~~~~~
+
+Support for loading the application once in the gunicorn master process, and
+forking the workers from it (gunicorn's `preload_app'; see gunicorn.conf.py).
+
+The modules, the validators and facet tables, and the compiled regular
+expressions are then built once, and the workers share the memory pages that
+they are in until they write to them. To keep the garbage collector from
+writing to them, the objects that exist at fork are moved out of its reach
+with gc.freeze() on Python 3.7 and later. On Python 3.6, they are collected
+into the oldest generation, which is rarely collected, because a full
+collection only happens when the number of objects that have survived since
+the last one is more than a quarter of the number of long-lived objects.
+
+Nothing that is done in the master may open a connection or start a thread,
+since neither survives a fork. after_fork() resets the state that each worker
+must have for itself.
+"""
+
+import gc
+import random
+import logging
+from dplaapi import metrics, models
+from dplaapi.handlers import v2 as v2_handlers
+from dplaapi.types import ItemsQueryType
+from dplaapi.queries.search_query import SearchQuery
+
+
+log = logging.getLogger(__name__)
+
+# Parameters of the requests that warm_up() prepares
+warm_up_params = [
+    {'q': 'warm up'},
+    {'sourceResource.title': 'warm up', 'sourceResource.date.after': '1900',
+     'facets': 'provider.name,sourceResource.date.begin.year',
+     'fields': 'id,sourceResource.title', 'sort_by': 'sourceResource.title'}
+]
+
+
+def warm_up():
+    """Validate parameters and build queries, without sending them
+
+    This fills the caches of compiled regular expressions and the like, so
+    that the workers do not each fill their own.
+    """
+    for params in warm_up_params:
+        SearchQuery(ItemsQueryType(params))
+
+
+def freeze():
+    """Keep the garbage collector from touching the objects that exist now"""
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+        log.info('Froze %d objects before forking workers'
+                 % gc.get_freeze_count())
+    else:
+        log.info('Collected garbage before forking workers')
+
+
+def before_fork():
+    """Prepare the master process for forking workers"""
+    warm_up()
+    freeze()
+
+
+def after_fork():
+    """Reset the state that each worker must have for itself"""
+    # Otherwise, the workers would all generate the same trace IDs.
+    random.seed()
+    # Connections and metrics from the master are not the worker's.
+    models.db.close_all()
+    metrics.registry.reset()
+    for memoized in [v2_handlers.es_pool, v2_handlers.necro_pool,
+                     v2_handlers.es_hedger, v2_handlers.ses_client]:
+        memoized.cache_clear()
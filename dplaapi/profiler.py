@@ -0,0 +1,84 @@
+"""
+profiler.py
+~~~~~~~~~~~
+
+A sampling profiler for live workers.
+
+A background thread takes the stacks of all of the worker's other threads at
+a fixed interval, and counts how often each stack is seen. The result is in
+the "collapsed stack" format that flame graph tools take
+(https://github.com/brendangregg/FlameGraph); each line is a stack, from the
+thread name and the outermost frame inwards, separated by semicolons,
+followed by a space and the number of samples.
+
+The overhead is that of the sampling thread, which holds the GIL briefly at
+each interval, and is only paid while a profile is being taken.
+"""
+
+import sys
+import time
+import logging
+import threading
+from collections import Counter
+
+
+log = logging.getLogger(__name__)
+
+
+def frame_name(frame):
+    return '%s:%s' % (frame.f_globals.get('__name__', '?'),
+                      frame.f_code.co_name)
+
+
+def collapsed_stack(thread_name, frame):
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    names.append(thread_name)
+    return ';'.join(reversed(names))
+
+
+class SamplingProfiler():
+
+    def __init__(self, interval=0.005):
+        """
+        Arguments:
+
+        interval:  Seconds between samples
+        """
+        self.interval = interval
+        self.samples = Counter()
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='profiler',
+                                       daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+
+    def run(self):
+        own_id = threading.get_ident()
+        while not self.stopping.is_set():
+            self.sample(own_id)
+            time.sleep(self.interval)
+
+    def sample(self, own_id):
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id != own_id:
+                name = names.get(thread_id, str(thread_id))
+                self.samples[collapsed_stack(name, frame)] += 1
+
+    def collapsed(self):
+        """Return the samples in the collapsed stack format"""
+        return ''.join('%s %d\n' % (stack, count)
+                       for stack, count in sorted(self.samples.items()))
+
+
+# Only one profile may be taken at a time in a worker.
+lock = threading.Lock()
@@ -4,11 +4,21 @@ base_query
 
 Base class that other query classes extend
 """
+import json
 from dplaapi.field_or_subfield import field_or_subfield
 
 
 class BaseQuery():
 
+    # Estimated cost of executing the query, where a simple search costs 1.
+    # See search_query.query_cost().
+    cost = 1
+
+    @property
+    def body(self):
+        """The JSON of the query, for the request to Elasticsearch"""
+        return json.dumps(self.query)
+
     def add_sort_clause(self, params):
         actual_field = field_or_subfield[params['sort_by']]
         if actual_field == 'sourceResource.spatial.coordinates':
@@ -0,0 +1,81 @@
+"""
+dplaapi.compiled
+~~~~~~~~~~~~~~~~
+
+Search queries that have been serialized to JSON, and are kept for requests
+with the same parameters.
+
+Requests for different pages of the same search, or for a search whose
+results have expired from the search cache, have the same query but for its
+'from' and 'size'. The JSON of the rest of the query is kept in an LRU cache
+whose key is the parameters other than `page', `page_size' and those that do
+not change the query, such as `api_key', and the 'from' and 'size' of each
+request are put in front of it, so that those requests do not build the query
+or serialize it again. Searches for specific IDs are not kept, because few of
+them are made again.
+
+The size of the cache is QUERY_BODY_CACHE_SIZE (default 1000).
+"""
+
+import os
+import json
+from collections import namedtuple
+from dplaapi import metrics
+from .search_query import SearchQuery, page_clause, query_cost
+
+# body:  The JSON of the query
+# cost:  The estimated cost of executing the query; see query_cost()
+CompiledQuery = namedtuple('CompiledQuery', ['body', 'cost'])
+
+# (JSON of the query without 'from' and 'size', or of the whole query if it
+# is not paged; whether it is paged), by shape_key()
+body_cache = metrics.MeteredLRUCache(
+    'query_bodies',
+    maxsize=int(os.getenv('QUERY_BODY_CACHE_SIZE', 1000)))
+
+# The page, and parameters that change the response but not the query
+unshaped_params = frozenset(['page', 'page_size', 'callback', 'api_key'])
+
+
+def shape_key(params):
+    """Return a cache key for the parameters that shape the query, other than
+    the page"""
+    return tuple(sorted(
+        (k, tuple(v) if isinstance(v, list) else v)
+        for k, v in params.items() if k not in unshaped_params))
+
+
+def with_page(body, params):
+    """Return the JSON of a query with the 'from' and 'size' of the page
+    put in front of the JSON of the rest of the query"""
+    page = json.dumps(page_clause(params))
+    if body == '{}':
+        return page
+    return page[:-1] + ', ' + body[1:]
+
+
+def compile_search(params, cost=None):
+    """Return a CompiledQuery for the given search parameters
+
+    Arguments:
+    - params: The request's validated querystring parameters
+    - cost:   query_cost() of the parameters, if it is known
+    """
+    if cost is None:
+        cost = query_cost(params)
+    if 'ids' in params:
+        return CompiledQuery(SearchQuery(params, cost).body, cost)
+    key = shape_key(params)
+    try:
+        body, paged = body_cache[key]
+    except KeyError:
+        sq = SearchQuery(params, cost)
+        query = sq.query
+        if sq.paged:
+            query = {k: v for k, v in query.items()
+                     if k not in ('from', 'size')}
+        body, paged = json.dumps(query), sq.paged
+        body_cache[key] = (body, paged)
+    if paged:
+        body = with_page(body, params)
+    return CompiledQuery(body, cost)
@@ -5,10 +5,13 @@ dplaapi.mlt_query
 Elasticsearch "More Like This" query
 """
 
+from dplaapi.frozen import freeze, set_in
 from .base_query import BaseQuery
+from .search_query import query_cost
 
 
-query_skel = {
+# Shared by all queries; see dplaapi/frozen.py
+query_skel = freeze({
     'query': {
         'more_like_this': {
             'fields': [
@@ -24,7 +27,7 @@ query_skel = {
         {'_score': {'order': 'desc'}},
         {'id': {'order': 'asc'}}
     ]
-}
+})
 
 
 class MLTQuery(BaseQuery):
@@ -36,16 +39,19 @@ class MLTQuery(BaseQuery):
 
     Instance attributes:
     - query: The dict that will be serialized to JSON for the query.
+    - cost:  The estimated cost of executing the query.
     """
-    def __init__(self, params: dict):
+    def __init__(self, params: dict, cost=None):
         """
         Arguments:
         - params: The request's querystring parameters
+        - cost:   query_cost() of the parameters, if it is known
         """
-        self.query = query_skel.copy()
+        self.cost = query_cost(params) if cost is None else cost
         like_list = [{'_type': 'item', '_id': x}
                      for x in params['ids']]
-        self.query['query']['more_like_this']['like'] = like_list
+        self.query = set_in(query_skel, ('query', 'more_like_this', 'like'),
+                            like_list)
 
         if 'fields' in params:
             self.query['_source'] = params['fields'].split(',')
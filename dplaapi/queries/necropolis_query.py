@@ -5,13 +5,15 @@ dplaapi.necropolis_query
 Elasticsearch Search Necropolis query
 """
 
+from dplaapi.frozen import freeze
 from .base_query import BaseQuery
 
-query_skel_specific_id = {
+# Shared by all queries; see dplaapi/frozen.py
+query_skel_specific_id = freeze({
     'sort': {'id': {'order': 'asc'}},
     'from': 0,
     'size': 1
-}
+})
 
 
 class NecropolisQuery(BaseQuery):
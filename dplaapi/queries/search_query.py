@@ -9,21 +9,24 @@ import re
 from apistar.exceptions import ValidationError
 from dplaapi.facets import facets
 from dplaapi.field_or_subfield import field_or_subfield
+from dplaapi.frozen import freeze, FrozenList
 from .base_query import BaseQuery
 
-query_skel_search = {
+# The parts of queries that are the same in every request are built once, and
+# are frozen (see dplaapi/frozen.py) because queries share them.
+
+query_skel_search = freeze({
     'sort': [
         {'_score': {'order': 'desc'}},
         {'id': {'order': 'asc'}}
     ],
     'track_total_hits': 'true'
-}
+})
 
-query_skel_specific_ids = {
+query_skel_specific_ids = freeze({
     'sort': {'id': {'order': 'asc'}},
-    'from': 0,
-    'size': 50
-}
+    'from': 0
+})
 
 # Fields available to query in a 'query_string' clause.
 #
@@ -94,6 +97,28 @@ object_wildcards = {
 
 temporal_search_field_pat = re.compile(r'(?P<field>.*)?\.(?P<modifier>.*)$')
 
+# Operators that make a 'query_string' query more expensive to execute:
+# wildcards, fuzzy and proximity searches, and regular expressions.
+expensive_operator_pat = re.compile(r'[*?~/]')
+boolean_operator_pat = re.compile(r'\b(AND|OR|NOT)\b')
+
+# Distance ranges of geo_distance facets, in miles
+geo_distance_ranges = freeze(
+    [{'from': i, 'to': i + 99} for i in range(0, 2100, 100)]
+    + [{'from': 2100}])
+
+# The minimum date in the filter 'range' of date histogram facets keeps us
+# from getting HTTP 503 errors from Elasticsearch due to using too many
+# aggregation buckets (more than 5000).
+min_date_filter = {
+    'month': 'now-416y',
+    'year': 'now-2000y'
+}
+date_key_format = {
+    'month': 'yyyy-MM',
+    'year': 'yyyy'
+}
+
 
 def q_fields_clause_items(d: dict):
     """Generator over items for a 'query_string' fields clause"""
@@ -119,6 +144,19 @@ def single_field_fields_clause(field, boost, constraints):
         return [field_to_use]
 
 
+# The 'fields' of a "simple search" query
+q_fields = FrozenList(q_fields_clause(fields_to_query))
+
+# The 'fields' of the 'query_string' clause for each field, without and with
+# 'exact_field_match'
+single_field_clauses = {
+    exact: {field: FrozenList(single_field_fields_clause(
+                field, boost, {'exact_field_match': exact}))
+            for field, boost in fields_to_query.items()}
+    for exact in ('false', 'true')
+}
+
+
 def is_field_related(param_name):
     return param_name in fields_to_query or param_name == 'q' \
            or param_name == 'ids' or param_name.endswith('.before') \
@@ -151,15 +189,12 @@ def facets_for(field_name, size):
         parts = field_name.partition(':')
         field, coords_part = parts[0], parts[2]
         origin = coords_part.replace(':', ',')
-        ranges = \
-            [{'from': i, 'to': i + 99} for i in range(0, 2100, 100)] \
-            + [{'from': 2100}]
         return {
             'geo_distance': {
                 'field': field,
                 'origin': origin,
                 'unit': 'mi',
-                'ranges': ranges
+                'ranges': geo_distance_ranges
             }
         }
 
@@ -180,17 +215,6 @@ def facets_for(field_name, size):
 
 
 def date_histogram_agg(facet_name, actual_field, interval, size):
-    # The minimum date in the filter 'range' below keeps us from getting
-    # HTTP 503 errors from Elasticsearch due to using too many aggregation
-    # buckets (more than 5000).
-    min_date_filter = {
-        'month': 'now-416y',
-        'year': 'now-2000y'
-    }
-    key_format = {
-        'month': 'yyyy-MM',
-        'year': 'yyyy'
-    }
     return {
         'filter': {
             'range': {
@@ -205,7 +229,7 @@ def date_histogram_agg(facet_name, actual_field, interval, size):
                 'date_histogram': {
                     'field': actual_field,
                     'interval': interval,
-                    'format': key_format[interval],
+                    'format': date_key_format[interval],
                     'min_doc_count': 1,
                     'order': {'_key': 'desc'}
                 }
@@ -233,6 +257,58 @@ def facets_clause(facets_string, size):
     return {clean_facet_name(name): facets_for(name, size) for name in names}
 
 
+def query_string_cost(field, term):
+    """Return the cost of one 'query_string' clause; see query_cost()"""
+    cost = 0.0
+    if field == 'q':
+        # A "simple search" queries dozens of fields.
+        cost += 0.5
+    cost += len(expensive_operator_pat.findall(term))
+    cost += 0.25 * len(boolean_operator_pat.findall(term))
+    return cost
+
+
+def query_cost(params: dict):
+    """Return an estimate of the cost of executing a search
+
+    The cost is relative to a search for the first page of ten records, with
+    no facets, which costs 1. Larger and deeper pages, facets, geo distance
+    sorting, and complicated 'query_string' terms cost more.
+
+    Arguments:
+    - params: The request's validated querystring parameters
+    """
+    fields, constraints = fields_and_constraints(params)
+    return shape_cost(fields, constraints) + page_cost(constraints)
+
+
+def page_cost(constraints):
+    """Return the part of query_cost() that depends on the page"""
+    page_size = int(constraints.get('page_size', 10))
+    page = int(constraints.get('page', 1))
+    # Elasticsearch has to collect and sort all of the preceding records.
+    return max(page_size - 10, 0) / 50 + (page - 1) * page_size / 1000
+
+
+def shape_cost(fields, constraints):
+    """Return the part of query_cost() that does not depend on the page"""
+    cost = 1.0
+
+    if 'facets' in constraints:
+        count = len(constraints['facets'].split(','))
+        cost += count * (0.5 + facet_size(constraints) / 500)
+
+    if constraints.get('sort_by') == 'sourceResource.spatial.coordinates':
+        cost += 2
+
+    for field, term in fields.items():
+        if field != 'ids' and not field.endswith('.before') \
+                and not field.endswith('.after'):
+            cost += query_string_cost(field, str(term))
+
+    return cost
+
+
 def facet_size(constraints):
     size = int(constraints.get('facet_size', 50))
     # The old API app truncated the size like this, and we do so here for
@@ -242,6 +318,30 @@ def facet_size(constraints):
     return size
 
 
+def page_clause(constraints):
+    """Return the 'from' and 'size' of a query for the requested page"""
+    return {'from': (constraints['page'] - 1) * constraints['page_size'],
+            'size': constraints['page_size']}
+
+
+# Parameters of a search that change its records, but not its facets
+hits_only_params = frozenset(['page', 'page_size', 'fields', 'sort_by',
+                              'sort_order', 'sort_by_pin', 'callback',
+                              'api_key'])
+facet_params = frozenset(['facets', 'facet_size'])
+
+
+def split_facet_params(params):
+    """Return a tuple of the parameters of a search for its records, without
+    its facets, and of the parameters of a FacetsQuery for its facets
+
+    Every page of a search, in any order, has the same parameters for its
+    facets.
+    """
+    return ({k: v for k, v in params.items() if k not in facet_params},
+            {k: v for k, v in params.items() if k not in hits_only_params})
+
+
 class SearchQuery(BaseQuery):
     """Elasticsearch Search API query
 
@@ -251,15 +351,22 @@ class SearchQuery(BaseQuery):
 
     Instance attributes:
     - query: The dict that will be serialized to JSON for the query.
+    - cost:  The estimated cost of executing the query; see query_cost().
+    - paged: Whether the 'from' and 'size' of the query are those of the
+             `page' and `page_size' parameters; see page_clause().
     """
 
-    def __init__(self, params: dict):
+    paged = False
+
+    def __init__(self, params: dict, cost=None):
         """Initialize the SearchQuery
 
         Arguments:
         - params: The request's querystring parameters
+        - cost:   query_cost() of the parameters, if it is known
         """
         fields, constraints = fields_and_constraints(params)
+        self.cost = query_cost(params) if cost is None else cost
 
         if 'op' in params and params['op'] == 'OR':
             self.bool_type = 'should'
@@ -286,6 +393,8 @@ class SearchQuery(BaseQuery):
         elif 'ids' in fields:
             self.query = query_skel_specific_ids.copy()
             self.query['query'] = {'terms': {'id': fields['ids']}}
+            # Every record requested; see MAX_IDS in handlers/v2.py
+            self.query['size'] = len(fields['ids'])
 
         else:
             self.query = query_skel_search.copy()
@@ -300,9 +409,8 @@ class SearchQuery(BaseQuery):
             self.query['_source'] = constraints['fields'].split(',')
 
         if 'from' not in self.query:
-            self.query['from'] = \
-                (constraints['page'] - 1) * constraints['page_size']
-            self.query['size'] = constraints['page_size']
+            self.query.update(page_clause(constraints))
+            self.paged = True
 
         if 'sort_by' in constraints:
             self.add_sort_clause(constraints)
@@ -322,6 +430,7 @@ class SearchQuery(BaseQuery):
                 }
             }
             self.query["size"] = 1
+            self.paged = False
 
     def filter_clause(self, filters):
         terms = []
@@ -340,14 +449,14 @@ class SearchQuery(BaseQuery):
         }
 
         if field == 'q':
-            clause['query_string']['fields'] = \
-                q_fields_clause(fields_to_query)
+            clause['query_string']['fields'] = q_fields
         elif field == 'random':
             pass  # do nothing
         else:
-            boost = fields_to_query[field]
+            exact = 'true' if constraints.get('exact_field_match') == 'true' \
+                else 'false'
             clause['query_string']['fields'] = \
-                single_field_fields_clause(field, boost, constraints)
+                single_field_clauses[exact][field]
 
         self.query['query']['bool'][self.bool_type].append(clause)
 
@@ -370,3 +479,23 @@ class SearchQuery(BaseQuery):
                 }
             }
         self.query['query']['bool'][self.bool_type].append(clause)
+
+
+class FacetsQuery(SearchQuery):
+    """Elasticsearch Search API query for only the facets of a search
+
+    The query has the 'query' and 'aggs' of the SearchQuery for the same
+    parameters, and no records. See split_facet_params().
+    """
+
+    def __init__(self, params: dict):
+        """Initialize the FacetsQuery
+
+        Arguments:
+        - params: The facet parameters of a search; see split_facet_params()
+        """
+        super(FacetsQuery, self).__init__(dict(params, page=1, page_size=0))
+        self.query = {'query': self.query['query'],
+                      'size': 0,
+                      'aggs': self.query['aggs']}
+        self.paged = False
@@ -0,0 +1,198 @@
+"""
+rate_limit.py
+~~~~~~~~~~~~~
+
+Per-API-key rate limiting with token buckets.
+
+Each API key has a bucket that holds up to `burst' tokens and is refilled at
+`rate' tokens per second. Each request takes tokens from the bucket, and is
+refused with HTTP 429 if there are not enough. The rate and burst depend on
+the class of the key ('staff' or 'public').
+
+The buckets are kept in memory, per worker, or in an SQLite database file
+that is shared by all of the workers on a host (see RATE_LIMIT_STORE). The
+database is in WAL mode and is not synced to disk for each request, since the
+buckets need not survive a crash. If the database can not be used, for
+example because it is locked for too long, requests are allowed.
+"""
+
+import os
+import math
+import time
+import logging
+import threading
+from cachetools import TTLCache
+
+
+log = logging.getLogger(__name__)
+
+
+class RateLimited(Exception):
+    """Raised when a request exceeds its key's rate limit"""
+    def __init__(self, headers):
+        """
+        Arguments:
+
+        headers:  dict of rate limit response headers, including Retry-After
+        """
+        super(RateLimited, self).__init__('Rate limit exceeded')
+        self.headers = headers
+
+
+def refill(tokens, updated, now, rate, burst):
+    """Return the number of tokens in a bucket, refilled up to `now'"""
+    return min(burst, tokens + (now - updated) * rate)
+
+
+class MemoryStore():
+    """Buckets kept in the memory of one worker"""
+
+    def __init__(self, maxsize=10000, ttl=3600):
+        # A bucket that has not been touched for `ttl' seconds is forgotten,
+        # which is the same as its being full, as long as `ttl' is longer
+        # than it takes to refill a bucket.
+        self.buckets = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.lock = threading.Lock()
+
+    def take(self, key, cost, rate, burst, now):
+        """Take `cost' tokens from the bucket for `key' if there are enough
+
+        Return a tuple of (allowed, tokens remaining).
+        """
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (burst, now))
+            tokens = refill(tokens, updated, now, rate, burst)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self.buckets[key] = (tokens, now)
+        return (allowed, tokens)
+
+
+class SQLiteStore():
+    """Buckets kept in an SQLite database shared by the workers on a host"""
+
+    def __init__(self, path):
+        self.path = path
+        self.pid = None
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def connection(self):
+        # Connections must not be shared with forked worker processes.
+        if self.pid != os.getpid():
+            # sqlite3 is imported here, since most deployments do not use
+            # this store.
+            import sqlite3
+            self.conn = sqlite3.connect(self.path, timeout=1,
+                                        isolation_level=None,
+                                        check_same_thread=False)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=OFF')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS buckets '
+                              '(key TEXT PRIMARY KEY, tokens REAL, '
+                              'updated REAL)')
+            self.pid = os.getpid()
+        return self.conn
+
+    def take(self, key, cost, rate, burst, now):
+        """See MemoryStore.take()
+
+        If the database fails, the request is allowed, as though the bucket
+        were full.
+        """
+        import sqlite3
+        try:
+            return self.take_from_db(key, cost, rate, burst, now)
+        except sqlite3.Error:
+            log.exception('Rate limit store failed; allowing the request')
+            return (True, burst)
+
+    def take_from_db(self, key, cost, rate, burst, now):
+        with self.lock:
+            conn = self.connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute(
+                    'SELECT tokens, updated FROM buckets WHERE key = ?',
+                    (key,)).fetchone()
+                tokens, updated = row if row else (burst, now)
+                tokens = refill(tokens, updated, now, rate, burst)
+                allowed = tokens >= cost
+                if allowed:
+                    tokens -= cost
+                conn.execute('INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)',
+                             (key, tokens, now))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        return (allowed, tokens)
+
+
+class RateLimiter():
+    def __init__(self, store, limits):
+        """
+        Arguments:
+
+        store:   MemoryStore or SQLiteStore
+        limits:  dict of key class name to a (rate, burst) tuple. A class
+                 that is not in the dict is not limited.
+        """
+        self.store = store
+        self.limits = limits
+
+    def check(self, key, key_class, cost=1):
+        """Take tokens for a request, and return the rate limit headers
+
+        Raise RateLimited if the key does not have enough tokens.
+
+        Arguments:
+
+        key:        The API key
+        key_class:  The class of the key; e.g. 'staff' or 'public'
+        cost:       The number of tokens that the request costs. A request
+                    that costs more than the burst is charged the burst, so
+                    that it is allowed when the bucket is full.
+        """
+        if key_class not in self.limits:
+            return {}
+        rate, burst = self.limits[key_class]
+        cost = min(cost, burst)
+        allowed, tokens = self.store.take(key, cost, rate, burst, time.time())
+        headers = {
+            'X-RateLimit-Limit': str(int(burst)),
+            'X-RateLimit-Remaining': str(int(tokens)),
+            'X-RateLimit-Reset': str(math.ceil((burst - tokens) / rate))
+        }
+        if not allowed:
+            log.info('Rate limit exceeded for %s' % key)
+            headers['Retry-After'] = str(math.ceil((cost - tokens) / rate))
+            raise RateLimited(headers)
+        return headers
+
+
+def limits_from_env():
+    """Return a dict of key class limits from environment variables
+
+    RATE_LIMIT_<CLASS> is "<rate>,<burst>"; for example,
+    RATE_LIMIT_PUBLIC=5,100 for 5 requests per second with bursts of up to
+    100 requests.
+    """
+    limits = {}
+    for key_class in ['staff', 'public']:
+        setting = os.getenv('RATE_LIMIT_%s' % key_class.upper())
+        if setting:
+            rate, burst = setting.split(',')
+            limits[key_class] = (float(rate), float(burst))
+    return limits
+
+
+def limiter_from_env():
+    """Return a RateLimiter configured by environment variables"""
+    path = os.getenv('RATE_LIMIT_STORE')
+    store = SQLiteStore(path) if path else MemoryStore()
+    return RateLimiter(store, limits_from_env())
+
+
+limiter = limiter_from_env()
@@ -2,6 +2,7 @@
 from starlette.routing import Router, Route, Mount
 from dplaapi import handlers
 from dplaapi.handlers import v2 as v2_handlers
+from dplaapi.handlers import admin as admin_handlers
 from . import v2 as v2_routes
 
 
@@ -9,6 +10,15 @@ routes = [
     Route('/',
           methods=['GET'],
           endpoint=handlers.redir_to_recent_version),
+    Route('/metrics',
+          methods=['GET'],
+          endpoint=admin_handlers.metrics),
+    Route('/admin/profile',
+          methods=['GET'],
+          endpoint=admin_handlers.profile),
+    Route('/admin/memory',
+          methods=['GET'],
+          endpoint=admin_handlers.memory),
     Mount('/v2', app=Router(v2_routes.routes)),
     # These paths go to the most recent protocol version of the API; in this
     # case, /v2:
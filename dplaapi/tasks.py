@@ -0,0 +1,51 @@
+"""
+tasks.py
+~~~~~~~~
+
+The asyncio task that is handling the current request.
+
+The state that is kept for each request in progress, such as its phase
+timings (see event_hooks.py), trace context (see tracing.py) and memory usage
+(see memory.py), is kept by its task.
+
+Blocking calls, such as backend searches, are made in threads with
+run_in_thread(), so that a worker handles other requests while they wait. In
+such a thread, the current task is that of the request which made the call.
+"""
+
+import asyncio
+import functools
+import threading
+
+
+# The task of the request that a thread is working for
+thread_state = threading.local()
+
+
+def current_task():
+    """Return the asyncio task of the current request, or None"""
+    task = getattr(thread_state, 'task', None)
+    if task is not None:
+        return task
+    try:
+        return asyncio.Task.current_task()
+    except RuntimeError:
+        # There is no event loop in this thread.
+        return None
+
+
+def call_for_task(task, func, *args, **kwargs):
+    thread_state.task = task
+    try:
+        return func(*args, **kwargs)
+    finally:
+        thread_state.task = None
+
+
+async def run_in_thread(func, *args, **kwargs):
+    """Call a blocking function in the event loop's executor, for the
+    current request, and return its result"""
+    loop = asyncio.get_event_loop()
+    call = functools.partial(call_for_task, current_task(), func, *args,
+                             **kwargs)
+    return await loop.run_in_executor(None, call)
@@ -0,0 +1,232 @@
+"""
+tracing.py
+~~~~~~~~~~
+
+Trace spans for requests and the stages of handling them.
+
+A trace is started for each request by TracingMiddleware, continuing the trace
+of the caller if the request has a W3C `traceparent' header. Spans are opened
+with `span()', and the phases timed by event_hooks.phase() are spans too. The
+trace context is passed on to Elasticsearch in a `traceparent' header.
+
+Finished spans are handed to an exporter, chosen with TRACE_EXPORTER:
+
+- "none" (the default): Spans are not recorded.
+- "stdout": Spans are written to standard output, one JSON object per line.
+- "file": Spans are appended to the file named by TRACE_FILE, in the same
+  format.
+- The dotted path of a class, e.g. "mypackage.exporters.MyExporter", which is
+  instantiated without arguments and must have an `export(span)' method.
+
+TRACE_SAMPLE_RATE is the fraction of requests to trace, unless the caller has
+said whether to trace the request. It defaults to 1.
+
+See https://www.w3.org/TR/trace-context/
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import logging
+import functools
+import importlib
+import threading
+import weakref
+from contextlib import contextmanager
+from dplaapi.tasks import current_task
+
+
+log = logging.getLogger(__name__)
+
+traceparent_pat = re.compile(
+    r'^00-(?P<trace_id>[0-9a-f]{32})-(?P<parent_id>[0-9a-f]{16})-'
+    r'(?P<flags>[0-9a-f]{2})$')
+
+# Trace contexts of the requests in progress, by asyncio task
+contexts = weakref.WeakKeyDictionary()
+
+
+def new_id(bits):
+    return '%0*x' % (bits // 4, random.getrandbits(bits))
+
+
+class Span():
+    def __init__(self, name, trace_id, parent_id, attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = new_id(64)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start = time.time()
+        self.duration = None
+        self.started = time.perf_counter()
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.started
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': self.start,
+            'duration_ms': round(self.duration * 1000, 3),
+            'attributes': self.attributes
+        }
+
+
+class TraceContext():
+    """The trace of one request"""
+
+    def __init__(self, trace_id=None, parent_id=None, sampled=True):
+        self.trace_id = trace_id or new_id(128)
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.spans = []   # Stack of open spans
+
+    def current_span_id(self):
+        return self.spans[-1].span_id if self.spans else self.parent_id
+
+    def traceparent(self):
+        """Return the `traceparent' header value for an outbound request"""
+        return '00-%s-%s-%s' % (self.trace_id,
+                                self.current_span_id() or new_id(64),
+                                '01' if self.sampled else '00')
+
+
+def context_from_header(traceparent, sample_rate):
+    """Return a TraceContext that continues the caller's trace, if any"""
+    match = traceparent_pat.match(traceparent or '')
+    if match:
+        return TraceContext(match.group('trace_id'),
+                            match.group('parent_id'),
+                            int(match.group('flags'), 16) & 1 == 1)
+    return TraceContext(sampled=random.random() < sample_rate)
+
+
+class NullExporter():
+    enabled = False
+
+    def export(self, span):
+        pass
+
+
+class StreamExporter():
+    """Exporter that writes spans to a stream as lines of JSON"""
+    enabled = True
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def export(self, span):
+        line = json.dumps(span.to_dict())
+        with self.lock:
+            self.stream.write(line + '\n')
+            self.stream.flush()
+
+
+class FileExporter(StreamExporter):
+    def __init__(self, path):
+        super(FileExporter, self).__init__(open(path, 'a'))
+
+
+def exporter_from_env():
+    name = os.getenv('TRACE_EXPORTER', 'none')
+    if name == 'none':
+        return NullExporter()
+    elif name == 'stdout':
+        return StreamExporter(sys.stdout)
+    elif name == 'file':
+        return FileExporter(os.getenv('TRACE_FILE', 'traces.jsonl'))
+    else:
+        module_name, _, class_name = name.rpartition('.')
+        return getattr(importlib.import_module(module_name), class_name)()
+
+
+exporter = exporter_from_env()
+sample_rate = float(os.getenv('TRACE_SAMPLE_RATE', 1))
+
+
+def current_context():
+    """Return the TraceContext of the current request, or None"""
+    task = current_task()
+    return contexts.get(task) if task else None
+
+
+@contextmanager
+def span(name, **attributes):
+    """Context manager or decorator that records a span
+
+    The context manager's value is the Span, to which attributes may be
+    added, or None outside of a sampled request, where this does nothing.
+    """
+    context = current_context()
+    if context is None or not context.sampled:
+        yield None
+        return
+    this_span = Span(name, context.trace_id, context.current_span_id(),
+                     attributes)
+    context.spans.append(this_span)
+    try:
+        yield this_span
+    except Exception as e:
+        this_span.attributes['error'] = e.__class__.__name__
+        raise
+    finally:
+        context.spans.pop()
+        this_span.finish()
+        exporter.export(this_span)
+
+
+def propagation_headers():
+    """Return headers that pass the trace context on to a backend"""
+    context = current_context()
+    if context is None:
+        return {}
+    return {'traceparent': context.traceparent()}
+
+
+def current_trace_id():
+    context = current_context()
+    return context.trace_id if context else None
+
+
+class TracingMiddleware():
+    """ASGI middleware that traces each request"""
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, scope):
+        if scope['type'] != 'http' or not getattr(exporter, 'enabled', True):
+            return self.app(scope)
+        return functools.partial(self.asgi, scope=scope)
+
+    async def asgi(self, receive, send, scope):
+        headers = dict(scope.get('headers', []))
+        traceparent = headers.get(b'traceparent', b'').decode('latin-1')
+        task = current_task()
+        contexts[task] = context_from_header(traceparent, sample_rate)
+        status = None
+
+        async def sender(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            with span('request', method=scope['method'],
+                      path=scope['path']) as request_span:
+                try:
+                    await self.app(scope)(receive, sender)
+                finally:
+                    if request_span is not None:
+                        request_span.attributes['status'] = status or 500
+        finally:
+            del contexts[task]
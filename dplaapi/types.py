@@ -1,4 +1,5 @@
 
+import re
 import apistar
 
 
@@ -489,6 +490,77 @@ necropolis_params = {
 }
 
 
+def string_check(validator):
+    """Return a function of a value that is True if it passes a String
+    validator, or None if the validator has features that are not
+    compiled"""
+    if validator.format is not None:
+        return None
+    allow_null = validator.allow_null
+    enum = frozenset(validator.enum) if validator.enum is not None else None
+    min_length = validator.min_length
+    max_length = validator.max_length
+    search = re.compile(validator.pattern).search \
+        if validator.pattern is not None else None
+
+    def check(value):
+        if value is None:
+            return allow_null
+        return isinstance(value, str) \
+            and (enum is None or value in enum) \
+            and (min_length is None or len(value) >= min_length) \
+            and (max_length is None or len(value) <= max_length) \
+            and (search is None or search(value) is not None)
+
+    return check
+
+
+def array_check(validator):
+    """Return a function of a value that is True if it passes an Array
+    validator, or None if the validator has features that are not
+    compiled"""
+    if isinstance(validator.items, list) or validator.unique_items:
+        return None
+    item_check = compiled_check(validator.items) \
+        if validator.items is not None else (lambda item: True)
+    if item_check is None:
+        return None
+    allow_null = validator.allow_null
+    min_items = validator.min_items
+    max_items = validator.max_items
+
+    def check(value):
+        if value is None:
+            return allow_null
+        return isinstance(value, list) \
+            and (min_items is None or len(value) >= min_items) \
+            and (max_items is None or len(value) <= max_items) \
+            and all(item_check(item) for item in value)
+
+    return check
+
+
+def compiled_check(validator):
+    """Return a function of a value that is True if it passes an apistar
+    validator, or None if the validator can not be compiled
+
+    The function does what the validator's validate() does for a valid value,
+    with the regular expressions compiled and the enums in frozensets, but
+    does not say what is wrong with an invalid value. validate() is still
+    called for that, so that the error messages are apistar's.
+    """
+    if type(validator) is apistar.validators.String:
+        return string_check(validator)
+    if type(validator) is apistar.validators.Array:
+        return array_check(validator)
+    return None
+
+
+# Compiled checks of items_params, which include those of the other
+# parameter specifications
+param_checks = {k: compiled_check(v) for k, v in items_params.items()}
+
+
 class BaseQueryType(dict):
     params_specification = {}  # To be overridden
 
@@ -497,7 +569,9 @@ class BaseQueryType(dict):
         for k, v in self.items():
             if k in self.params_specification:
                 try:
-                    items_params[k].validate(v)
+                    check = param_checks[k]
+                    if check is None or not check(v):
+                        items_params[k].validate(v)
                     # This is not great, but I have to do this because all
                     # query string parameters come in as strings.  I think that
                     # the types system works better if you use path parameters,
@@ -0,0 +1,48 @@
+"""
+gunicorn configuration
+
+    $ gunicorn -c gunicorn.conf.py dplaapi:app
+
+The application is loaded once in the master process, and the workers are
+forked from it, sharing its memory until they write to it; see
+dplaapi/preload.py. The optional environment variables are:
+
+- WEB_CONCURRENCY: Number of workers. Defaults to the number of CPUs.
+- BIND: Address to listen on. Defaults to 0.0.0.0:8000.
+- PRELOAD_APP: "false" to load the application in each worker instead.
+"""
+
+import os
+import multiprocessing
+
+
+bind = os.getenv('BIND', '0.0.0.0:8000')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'uvicorn.workers.UvicornWorker'
+preload_app = os.getenv('PRELOAD_APP', 'true') != 'false'
+
+
+def when_ready(server):
+    # With preload_app, the application has been loaded by now, before any
+    # worker is forked.
+    if preload_app:
+        from dplaapi import preload
+        preload.before_fork()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        from dplaapi import preload
+        preload.after_fork()
+
+
+def child_exit(server, worker):
+    # Remove the worker's snapshot of its metrics; see METRICS_DIR in
+    # dplaapi/metrics.py. This is called in the master process, which does not
+    # import the application unless it is preloaded.
+    metrics_dir = os.getenv('METRICS_DIR')
+    if metrics_dir:
+        try:
+            os.remove(os.path.join(metrics_dir, '%d.json' % worker.pid))
+        except FileNotFoundError:
+            pass
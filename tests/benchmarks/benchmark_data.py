@@ -0,0 +1,147 @@
+"""
+Realistic DPLA-shaped documents, query parameters and facet aggregations for
+the benchmarks
+
+The data is generated from a fixed seed so that every run measures the same
+work.
+"""
+
+import random
+
+
+rng = random.Random(20181001)
+
+words = ('letter photograph map county river church school farm railroad '
+         'portrait street building family war memorial bridge court house '
+         'minnesota texas california virginia harbor mill store parade '
+         'women history record album diary newspaper survey').split()
+
+providers = ['National Archives and Records Administration',
+             'HathiTrust', 'Smithsonian Institution',
+             'Minnesota Digital Library', 'Digital Commonwealth',
+             'Mountain West Digital Library', 'Empire State Digital Network']
+
+states = ['Minnesota', 'Texas', 'California', 'Virginia', 'New York',
+          'Massachusetts', 'Utah', 'Oregon']
+
+
+def phrase(n):
+    return ' '.join(rng.choice(words) for _ in range(n))
+
+
+def item_id():
+    return '%032x' % rng.getrandbits(128)
+
+
+def document():
+    """Return an item document as it is found in the Elasticsearch index"""
+    year = rng.randint(1850, 2000)
+    doc_id = item_id()
+    provider = rng.choice(providers)
+    return {
+        'id': doc_id,
+        '@id': 'http://dp.la/api/items/%s' % doc_id,
+        'ingestDate': '2018-09-24T19:45:12.144Z',
+        'isShownAt': 'http://example.org/record/%s' % doc_id,
+        'object': 'http://example.org/thumbnail/%s.jpg' % doc_id,
+        'rights': 'http://rightsstatements.org/vocab/NoC-US/1.0/',
+        'provider': {
+            '@id': 'http://dp.la/api/contributor/%s' % provider.lower()[:10],
+            'name': provider
+        },
+        'dataProvider': {'name': '%s Historical Society' % rng.choice(states)},
+        'intermediateProvider': provider,
+        'hasView': {'@id': 'http://example.org/view/%s' % doc_id,
+                    'format': 'image/jpeg'},
+        'admin': {'contributingInstitution': provider},
+        'sourceResource': {
+            'title': [phrase(6)],
+            'description': [phrase(40), phrase(25)],
+            'creator': [phrase(2).title() for _ in range(rng.randint(1, 3))],
+            'subject': [{'name': phrase(2)} for _ in range(rng.randint(2, 8))],
+            'date': {'begin': '%d-01-01' % year, 'end': '%d-12-31' % year,
+                     'displayDate': str(year)},
+            'spatial': [{'name': '%s County, %s' % (rng.choice(words).title(),
+                                                    state),
+                         'state': state,
+                         'country': 'United States',
+                         'coordinates': '%.4f, %.4f' % (
+                             rng.uniform(25, 49), rng.uniform(-124, -67))}
+                        for state in rng.sample(states, rng.randint(1, 3))],
+            'collection': [{'@id': 'http://dp.la/api/collections/%s'
+                                   % item_id(),
+                            'title': phrase(3),
+                            'description': phrase(15)}],
+            'type': rng.choice(['image', 'text', 'physical object']),
+            'format': ['Photographs', 'Prints'],
+            'language': [{'name': 'English', 'iso639_3': 'eng'}],
+            'identifier': ['%d-%d' % (rng.randint(1, 9999), year)],
+            'extent': ['%d x %d cm' % (rng.randint(5, 50), rng.randint(5, 50))]
+        }
+    }
+
+
+# A page of the size that harvesters commonly ask for
+documents = [document() for _ in range(100)]
+
+
+def terms_aggregation(size):
+    return {
+        'doc_count_error_upper_bound': 169613,
+        'sum_other_doc_count': 5893411,
+        'buckets': [{'key': phrase(3), 'doc_count': rng.randint(1, 3781862)}
+                    for _ in range(size)]
+    }
+
+
+def date_aggregation(name, size):
+    return {
+        'doc_count': 14,
+        name: {
+            'buckets': [{'key_as_string': str(2000 - i),
+                         'key': -725846400000 - i,
+                         'doc_count': rng.randint(1, 10000)}
+                        for i in range(size)]
+        }
+    }
+
+
+def geo_aggregation():
+    return {
+        'buckets': [{'key': '%d.0-%d.0' % (i, i + 99), 'from': i,
+                     'to': i + 99, 'doc_count': rng.randint(1, 518784)}
+                    for i in range(0, 2100, 100)]
+    }
+
+
+# Six facets with large buckets, as in an expensive search
+aggregations = {
+    'provider.name': terms_aggregation(50),
+    'dataProvider': terms_aggregation(2000),
+    'sourceResource.subject.name': terms_aggregation(2000),
+    'sourceResource.type': terms_aggregation(10),
+    'sourceResource.date.begin.year': date_aggregation(
+        'sourceResource.date.begin.year', 150),
+    'sourceResource.spatial.coordinates': geo_aggregation()
+}
+
+simple_search_params = {'q': 'railroad bridge'}
+
+complex_search_params = {
+    'q': 'railroad AND (bridge OR depot)',
+    'sourceResource.title': 'minnesota',
+    'sourceResource.date.after': '1900',
+    'sourceResource.date.before': '1950',
+    'facets': ','.join(['provider.name', 'dataProvider',
+                        'sourceResource.subject.name', 'sourceResource.type',
+                        'sourceResource.date.begin.year',
+                        'sourceResource.spatial.coordinates:40.7:-73.9']),
+    'facet_size': '2000',
+    'fields': 'id,sourceResource.title,sourceResource.subject.name,'
+              'sourceResource.spatial.state,provider.name',
+    'page': '3',
+    'page_size': '100',
+    'sort_by': 'sourceResource.title'
+}
+
+ids_params = {'ids': [d['id'] for d in documents[:50]], 'page_size': 50}
@@ -0,0 +1,126 @@
+"""
+A small benchmark harness
+
+Each benchmark is run for long enough to be timed reliably, and its speed is
+reported in operations per second and relative to a fixed calibration
+workload that is timed in the same run. Comparing relative speeds lets a
+baseline recorded on one machine be checked on another. The peak memory
+allocated by one operation is measured with tracemalloc.
+
+Startup is measured in new processes, in which the "operation" is importing
+the application, and the memory is the resident set size after the import.
+"""
+
+import gc
+import os
+import sys
+import timeit
+import subprocess
+import tracemalloc
+
+
+def time_per_op(func, min_time=0.2, repeat=5):
+    """Return the best time per call of func(), in seconds"""
+    timer = timeit.Timer(func)
+    number, elapsed = timer.autorange()
+    number = max(1, int(number * min_time / max(elapsed, 1e-9)))
+    gc.collect()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def peak_allocation(func):
+    """Return the peak bytes allocated by one call of func()"""
+    func()  # Warm up caches, so that they are not counted.
+    gc.collect()
+    tracemalloc.start()
+    try:
+        # clear_traces() also resets the peak, which is what we want on
+        # Python 3.6, where there is no reset_peak().
+        tracemalloc.clear_traces()
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def calibration_workload():
+    """A fixed mix of the dict, list and string work done by the hot paths"""
+    d = {}
+    for i in range(200):
+        d['field%d' % i] = [str(i), {'name': 'x' * (i % 7)}]
+    return sorted(k.partition('d')[2] for k in d if d[k][1]['name'])
+
+
+def calibration_ops():
+    return 1 / time_per_op(calibration_workload)
+
+
+class Result():
+    def __init__(self, name, ops, relative, peak_bytes):
+        self.name = name
+        self.ops = ops
+        self.relative = relative
+        self.peak_bytes = peak_bytes
+
+    def to_dict(self):
+        return {'relative': self.relative, 'peak_bytes': self.peak_bytes}
+
+
+def run(name, func, calibration):
+    ops = 1 / time_per_op(func)
+    return Result(name, ops, ops / calibration, peak_allocation(func))
+
+
+startup_script = '''
+import os
+import time
+start = time.perf_counter()
+import dplaapi
+elapsed = time.perf_counter() - start
+with open('/proc/self/statm') as f:
+    rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+print(elapsed, rss)
+'''
+
+
+def run_startup(name, calibration, repeat=5):
+    """Return a Result for importing the application in a new process
+
+    The time is the best of `repeat' processes, and the memory is the
+    largest resident set size.
+    """
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                        '..')
+    env = dict(os.environ, APP_LOG_LEVEL='error')
+    times = []
+    sizes = []
+    for _ in range(repeat):
+        output = subprocess.check_output(
+            [sys.executable, '-c', startup_script], cwd=root, env=env,
+            stderr=subprocess.DEVNULL)
+        elapsed, rss = output.split()
+        times.append(float(elapsed))
+        sizes.append(int(rss))
+    ops = 1 / min(times)
+    return Result(name, ops, ops / calibration, max(sizes))
+
+
+def regressions(result, baseline, threshold):
+    """Return a list of messages about regressions from the baseline
+
+    Arguments:
+
+    result:     Result
+    baseline:   dict of the baseline's 'relative' and 'peak_bytes'
+    threshold:  Fraction by which speed may drop or memory may grow
+    """
+    rv = []
+    if result.relative < baseline['relative'] * (1 - threshold):
+        rv.append('%s: speed %.4g is more than %d%% below the baseline %.4g'
+                  % (result.name, result.relative, threshold * 100,
+                     baseline['relative']))
+    if result.peak_bytes > baseline['peak_bytes'] * (1 + threshold):
+        rv.append('%s: peak allocation %d bytes is more than %d%% above the '
+                  'baseline %d' % (result.name, result.peak_bytes,
+                                   threshold * 100, baseline['peak_bytes']))
+    return rv
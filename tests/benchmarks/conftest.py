@@ -0,0 +1,73 @@
+import os
+import json
+import pytest
+from benchmark_harness import calibration_ops, run, regressions, run_startup
+
+
+baseline_path = os.path.join(os.path.dirname(__file__), 'baseline.json')
+results = []
+
+
+def load_baseline():
+    try:
+        with open(baseline_path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+@pytest.fixture(scope='session')
+def calibration():
+    return calibration_ops()
+
+
+@pytest.fixture
+def check():
+    """Return a function that records a Result and checks it for regressions
+
+    The check is against the result of the same name in baseline.json, and
+    fails if the speed drops or the peak allocation grows by more than
+    BENCHMARK_THRESHOLD (0.25 by default). With BENCHMARK_SAVE defined, there
+    is no check, and the results are saved as the new baseline.
+    """
+    baseline = load_baseline()
+    threshold = float(os.getenv('BENCHMARK_THRESHOLD', 0.25))
+
+    def check_result(result):
+        results.append(result)
+        if not os.getenv('BENCHMARK_SAVE') and result.name in baseline:
+            problems = regressions(result, baseline[result.name], threshold)
+            assert not problems, '\n'.join(problems)
+        return result
+
+    return check_result
+
+
+@pytest.fixture
+def bench(calibration, check):
+    """Return a function that runs a benchmark and checks its Result"""
+    return lambda name, func: check(run(name, func, calibration))
+
+
+@pytest.fixture
+def bench_startup(calibration, check):
+    """Return a function that measures startup and checks its Result"""
+    return lambda name: check(run_startup(name, calibration))
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not results:
+        return
+    terminalreporter.section('benchmarks')
+    terminalreporter.write_line('%-40s %14s %10s %12s' % (
+        'name', 'ops/sec', 'relative', 'peak bytes'))
+    for r in results:
+        terminalreporter.write_line('%-40s %14.1f %10.4g %12d' % (
+            r.name, r.ops, r.relative, r.peak_bytes))
+    if os.getenv('BENCHMARK_SAVE'):
+        baseline = load_baseline()
+        baseline.update({r.name: r.to_dict() for r in results})
+        with open(baseline_path, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+        terminalreporter.write_line('Saved baseline to %s' % baseline_path)
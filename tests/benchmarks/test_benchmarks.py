@@ -0,0 +1,79 @@
+"""Benchmarks of the hot paths of a search request
+
+These are skipped unless BENCHMARK is defined; see `make benchmark'.
+"""
+
+import os
+import pytest
+import benchmark_data as data
+from dplaapi.types import ItemsQueryType
+from dplaapi.queries.search_query import SearchQuery
+from dplaapi.queries.compiled import compile_search
+from dplaapi.handlers import v2 as v2_handlers
+
+
+pytestmark = pytest.mark.skipif(not os.getenv('BENCHMARK'),
+                                reason='BENCHMARK is not defined')
+
+simple_params = ItemsQueryType(data.simple_search_params)
+complex_params = ItemsQueryType(data.complex_search_params)
+ids_params = ItemsQueryType({})
+ids_params.update(data.ids_params)
+
+
+def test_validate_simple_search(bench):
+    bench('ItemsQueryType simple',
+          lambda: ItemsQueryType(data.simple_search_params))
+
+
+def test_validate_complex_search(bench):
+    bench('ItemsQueryType complex',
+          lambda: ItemsQueryType(data.complex_search_params))
+
+
+def test_build_simple_search(bench):
+    bench('SearchQuery simple', lambda: SearchQuery(simple_params))
+
+
+def test_build_complex_search(bench):
+    bench('SearchQuery complex', lambda: SearchQuery(complex_params))
+
+
+def test_build_ids_search(bench):
+    bench('SearchQuery ids', lambda: SearchQuery(ids_params))
+
+
+def test_compile_complex_search_cached(bench):
+    compile_search(complex_params)
+    bench('compile_search complex cached',
+          lambda: compile_search(complex_params))
+
+
+def test_items_key_complex_search(bench):
+    bench('items_key complex', lambda: v2_handlers.items_key(complex_params))
+
+
+def test_items_key_ids(bench):
+    bench('items_key ids', lambda: v2_handlers.items_key(ids_params))
+
+
+def test_compact_page_with_fields(bench):
+    bench('compact 100 docs with fields',
+          lambda: [v2_handlers.compact(doc, complex_params)
+                   for doc in data.documents])
+
+
+def test_traverse_doc_nested_list(bench):
+    doc = data.documents[0]
+    bench('traverse_doc subject.name',
+          lambda: v2_handlers.traverse_doc('sourceResource.subject.name',
+                                           doc))
+
+
+def test_formatted_facets(bench):
+    bench('formatted_facets 6 facets',
+          lambda: v2_handlers.formatted_facets(data.aggregations))
+
+
+def test_startup(bench_startup):
+    bench_startup('import dplaapi')
@@ -17,3 +17,17 @@ def disable_env_vars(monkeypatch):
     monkeypatch.delenv('POSTGRES_STALE_TIMEOUT', raising=False)
     monkeypatch.delenv('AWS_ACCESS_KEY_ID', raising=False)
     monkeypatch.delenv('AWS_SECRET_ACCESS_KEY', raising=False)
+
+
+@pytest.fixture(scope='function', autouse=True)
+def reset_backend_state():
+    from dplaapi.handlers import v2 as v2_handlers
+    from dplaapi.queries import compiled
+    for breaker in [v2_handlers.es_breaker, v2_handlers.necro_breaker]:
+        breaker.reset()
+    for cache in [v2_handlers.es_stale_cache, v2_handlers.necro_stale_cache,
+                  v2_handlers.facet_cache, compiled.body_cache]:
+        cache.clear()
+    for func in [v2_handlers.es_pool, v2_handlers.necro_pool,
+                 v2_handlers.es_hedger]:
+        func.cache_clear()
@@ -0,0 +1,77 @@
+"""Test dplaapi.handlers.admin"""
+
+import tracemalloc
+from starlette.testclient import TestClient
+from dplaapi import app, models, profiler
+from dplaapi.handlers import v2 as v2_handlers
+
+
+client = TestClient(app,
+                    base_url='http://localhost',
+                    raise_server_exceptions=False)
+
+
+def test_profile_returns_collapsed_stacks(monkeypatch):
+    monkeypatch.setenv('DISABLE_AUTH', 'true')
+    response = client.get('/admin/profile?seconds=0.05&interval=0.001')
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'text/plain; charset=utf-8'
+    assert 'MainThread;' in response.text
+
+
+def test_profile_requires_staff_key(monkeypatch):
+    monkeypatch.setattr(v2_handlers, 'account_from_params',
+                        lambda params: models.Account(key='a1b2c3',
+                                                      staff=False))
+    response = client.get('/admin/profile?seconds=0.05')
+    assert response.status_code == 403
+
+
+def test_profile_validates_seconds(monkeypatch):
+    monkeypatch.setenv('DISABLE_AUTH', 'true')
+    assert client.get('/admin/profile?seconds=x').status_code == 400
+    assert client.get('/admin/profile?seconds=1000').status_code == 400
+
+
+def test_profile_allows_one_at_a_time(monkeypatch):
+    monkeypatch.setenv('DISABLE_AUTH', 'true')
+    profiler.lock.acquire()
+    try:
+        response = client.get('/admin/profile?seconds=0.05')
+    finally:
+        profiler.lock.release()
+    assert response.status_code == 409
+
+
+def test_memory_reports_caches_and_resident_size(monkeypatch):
+    monkeypatch.setenv('DISABLE_AUTH', 'true')
+    monkeypatch.setattr(tracemalloc, 'is_tracing', lambda: False)
+    response = client.get('/admin/memory')
+    assert response.status_code == 200
+    data = response.json()
+    assert data['tracing'] is False
+    assert data['resident_bytes'] > 0
+    assert data['caches']['search']['maxsize'] == 100
+    assert 'top_allocations' not in data
+
+
+def test_memory_reports_top_allocations_if_tracing(monkeypatch):
+    monkeypatch.setenv('DISABLE_AUTH', 'true')
+    was_tracing = tracemalloc.is_tracing()
+    tracemalloc.start()
+    try:
+        data = client.get('/admin/memory?top=3').json()
+        assert len(data['top_allocations']) == 3
+        assert data['allocated_bytes'] > 0
+        data = client.get('/admin/memory?top=3&compare=true').json()
+        assert 'bytes_diff' in data['top_allocations'][0]
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+
+
+def test_memory_requires_staff_key(monkeypatch):
+    monkeypatch.setattr(v2_handlers, 'account_from_params',
+                        lambda params: models.Account(key='a1b2c3',
+                                                      staff=False))
+    assert client.get('/admin/memory').status_code == 403
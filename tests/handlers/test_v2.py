@@ -1,12 +1,17 @@
 
 """Test dplaapi.handlers.v2"""
 
+import time
+import asyncio
 import pytest
 import requests
 import json
 import os
+import sys
+import subprocess
 import boto3
 import secrets
+import threading
 from starlette.testclient import TestClient
 from starlette.exceptions import HTTPException
 from starlette.responses import Response
@@ -15,11 +20,13 @@ from starlette.background import BackgroundTask
 from apistar.exceptions import ValidationError
 from dplaapi.responses import JSONResponse
 from dplaapi import app
-from dplaapi import types, models
+from dplaapi import types, models, admission, rate_limit
 from dplaapi.handlers import v2 as v2_handlers
+from dplaapi.outbox import OutboxFull
 from dplaapi.queries import search_query
 from dplaapi.queries.search_query import SearchQuery
 import dplaapi.analytics
+import dplaapi.hedging
 from peewee import OperationalError, DoesNotExist
 
 
@@ -94,6 +101,9 @@ es6_facets = {
 
 class MockGoodResponse():
     """Mock a good `requests.Response`"""
+    status_code = 200
+    content = json.dumps(minimal_good_response).encode()
+
     def raise_for_status(self):
         pass
 
@@ -125,22 +135,22 @@ class Mock500Response():
         raise requests.exceptions.HTTPError('I have failed you.')
 
 
-def mock_es_post_response_200(url, json):
+def mock_es_post_response_200(url, data, **kwargs):
     """Mock `requests.post()` for a successful request"""
     return MockGoodResponse()
 
 
-def mock_es_post_response_400(url, json):
+def mock_es_post_response_400(url, data, **kwargs):
     """Mock `requests.post()` with a Bad Request response"""
     return Mock400Response()
 
 
-def mock_es_post_response_404(url, json):
+def mock_es_post_response_404(url, data, **kwargs):
     """Mock `requests.post()` with a Not Found response"""
     return Mock404Response()
 
 
-def mock_es_post_response_err(url, json):
+def mock_es_post_response_err(url, data, **kwargs):
     """Mock `requests.post()` with a non-success status code"""
     return Mock500Response()
 
@@ -290,6 +300,36 @@ def test_account_from_params_ServerError_bad_db(monkeypatch, mocker):
         assert e.status_code == 503
 
 
+def test_limit_rate_checks_account_key_and_class(monkeypatch, mocker):
+    mocker.patch.object(rate_limit.limiter, 'check', return_value={'a': 'b'})
+    account = models.Account(key='a1b2c3', email='x@example.org', staff=True)
+    assert v2_handlers.limit_rate(account) == {'a': 'b'}
+    rate_limit.limiter.check.assert_called_once_with('a1b2c3', 'staff', 1)
+
+
+def test_limit_rate_does_nothing_without_account(mocker):
+    mocker.patch.object(rate_limit.limiter, 'check')
+    assert v2_handlers.limit_rate(None) == {}
+    rate_limit.limiter.check.assert_not_called()
+
+
+@pytest.mark.usefixtures('patch_db_connection')
+def test_rate_limit_headers_are_returned(monkeypatch, mocker):
+    mocker.patch('dplaapi.models.db.connect')
+    monkeypatch.setattr(models.Account, 'get', mock_Account_get)
+    monkeypatch.setattr(requests, 'post', mock_es_post_response_200)
+    monkeypatch.setattr(rate_limit, 'limiter', rate_limit.RateLimiter(
+        rate_limit.MemoryStore(), {'public': (1, 1)}))
+    path = '/v2/items?api_key=08e3918eeb8bf4469924f062072459a8'
+    response = client.get(path)
+    assert response.status_code == 200
+    assert response.headers['x-ratelimit-limit'] == '1'
+    assert response.headers['x-ratelimit-remaining'] == '0'
+    response = client.get(path)
+    assert response.status_code == 429
+    assert response.headers['retry-after'] == '1'
+
+
 # end account_from_params() tests
 
 
@@ -315,6 +355,403 @@ def test_items_Exception_for_elasticsearch_errs(monkeypatch):
         v2_handlers.items(sq)
 
 
+@pytest.mark.usefixtures('disable_auth')
+def test_items_fails_fast_when_breaker_is_open(monkeypatch, mocker):
+    """items() does not call Elasticsearch if the circuit breaker is open"""
+    post_stub = mocker.stub()
+    monkeypatch.setattr(requests, 'post', post_stub)
+    v2_handlers.es_breaker.trip()
+    sq = SearchQuery({'q': 'abcd', 'from': 0, 'page': 1, 'page_size': 1})
+    with pytest.raises(HTTPException) as e:
+        v2_handlers.items(sq)
+    assert e.value.status_code == 503
+    post_stub.assert_not_called()
+
+
+@pytest.mark.usefixtures('disable_auth')
+def test_items_serves_stale_result_when_breaker_is_open(monkeypatch):
+    """items() returns the last good result for the query if the circuit
+    breaker is open"""
+    monkeypatch.setattr(requests, 'post', mock_es_post_response_200)
+    sq = SearchQuery({'q': 'abcd', 'from': 0, 'page': 1, 'page_size': 1})
+    v2_handlers.items(sq)
+    monkeypatch.setattr(requests, 'post', mock_es_post_response_err)
+    v2_handlers.es_breaker.trip()
+    assert v2_handlers.items(sq) == minimal_good_response
+
+
+@pytest.mark.usefixtures('disable_auth')
+def test_items_records_failures_with_breaker(monkeypatch, mocker):
+    """items() tells the circuit breaker about failed calls, but not about
+    bad queries, which are the user's fault"""
+    mocker.spy(v2_handlers.es_breaker, 'record_failure')
+    sq = SearchQuery({'q': 'abcd', 'from': 0, 'page': 1, 'page_size': 1})
+    monkeypatch.setattr(requests, 'post', mock_es_post_response_400)
+    with pytest.raises(HTTPException):
+        v2_handlers.items(sq)
+    v2_handlers.es_breaker.record_failure.assert_not_called()
+    monkeypatch.setattr(requests, 'post', mock_es_post_response_err)
+    with pytest.raises(HTTPException):
+        v2_handlers.items(sq)
+    v2_handlers.es_breaker.record_failure.assert_called_once()
+
+
+@pytest.mark.usefixtures('disable_auth')
+def test_items_releases_trial_call_after_unexpected_error(monkeypatch):
+    """items() frees a half-open breaker's trial call when the call ends
+    with an unexpected exception"""
+    def mock_post(*args, **kwargs):
+        raise ValueError('unexpected')
+    monkeypatch.setattr(requests, 'post', mock_post)
+    breaker = v2_handlers.es_breaker
+    breaker.trip()
+    monkeypatch.setattr(breaker, 'opened_at',
+                        breaker.opened_at - breaker.recovery_timeout)
+    sq = SearchQuery({'q': 'abcd', 'from': 0, 'page': 1, 'page_size': 1})
+    for _ in range(breaker.trial_calls + 1):
+        with pytest.raises(ValueError):
+            v2_handlers.items(sq)
+    assert breaker.trials_started == 0
+
+
+@pytest.mark.usefixtures('disable_auth')
+def test_items_503_for_connection_error(monkeypatch):
+    """items() responds with Service Unavailable if it can't connect"""
+    def mock_post(*args, **kwargs):
+        raise requests.exceptions.ConnectionError()
+
+    monkeypatch.setattr(requests, 'post', mock_post)
+    sq = SearchQuery({'q': 'abcd', 'from': 0, 'page': 1, 'page_size': 1})
+    with pytest.raises(HTTPException) as e:
+        v2_handlers.items(sq)
+    assert e.value.status_code == 503
+
+
+@pytest.mark.usefixtures('disable_auth')
+def test_items_passes_timeouts(monkeypatch, mocker):
+    """items() passes the HTTP timeouts, and the search time limit to
+    Elasticsearch"""
+    post_stub = mocker.Mock(return_value=MockGoodResponse())
+    monkeypatch.setattr(requests, 'post', post_stub)
+    monkeypatch.setattr(dplaapi, 'ES_BASES', ['http://es.example.org/i'])
+    monkeypatch.setattr(dplaapi, 'ES_TIMEOUT', (1, 2))
+    monkeypatch.setattr(dplaapi, 'ES_SEARCH_TIMEOUT', '3s')
+    sq = SearchQuery({'q': 'abcd', 'from': 0, 'page': 1, 'page_size': 1})
+    v2_handlers.items(sq)
+    post_stub.assert_called_once_with('http://es.example.org/i/_search',
+                                      data=sq.body,
+                                      headers={'Content-Type':
+                                               'application/json'},
+                                      params={'timeout': '3s'},
+                                      timeout=(1, 2))
+
+
+@pytest.mark.usefixtures('disable_auth')
+def test_items_makes_hedged_request_if_enabled(monkeypatch, mocker):
+    """items() posts through the Hedger if hedging is enabled"""
+    monkeypatch.setenv('ES_HEDGE', 'true')
+    monkeypatch.setattr(dplaapi, 'ES_BASES', ['http://a.example.org/i',
+                                              'http://b.example.org/i'])
+    mocker.spy(dplaapi.hedging.Hedger, 'post')
+    monkeypatch.setattr(requests, 'post', mock_es_post_response_200)
+    sq = SearchQuery({'q': 'abcd', 'from': 0, 'page': 1, 'page_size': 1})
+    v2_handlers.items(sq)
+    dplaapi.hedging.Hedger.post.assert_called_once_with(
+        v2_handlers.es_hedger(),
+        '/_search',
+        data=sq.body,
+        headers={'Content-Type': 'application/json'},
+        params={'timeout': dplaapi.ES_SEARCH_TIMEOUT},
+        timeout=dplaapi.ES_TIMEOUT)
+
+
+@pytest.mark.usefixtures('disable_auth')
+def test_items_balances_over_ES_BASES(monkeypatch, mocker):
+    """items() sends requests to all of the endpoints in ES_BASES"""
+    monkeypatch.setattr(dplaapi, 'ES_BASES', ['http://a.example.org/i',
+                                              'http://b.example.org/i'])
+    urls = []
+
+    def mock_post(url, **kwargs):
+        urls.append(url)
+        return MockGoodResponse()
+
+    monkeypatch.setattr(requests, 'post', mock_post)
+    sq = SearchQuery({'q': 'abcd', 'from': 0, 'page': 1, 'page_size': 1})
+    v2_handlers.items(sq)
+    v2_handlers.items(sq)
+    assert sorted(urls) == ['http://a.example.org/i/_search',
+                            'http://b.example.org/i/_search']
+
+
+@pytest.mark.usefixtures('disable_auth')
+def test_items_does_not_keep_timed_out_results(monkeypatch, mocker):
+    """items() returns partial results but does not save them as stale
+    results"""
+    timed_out_response = dict(minimal_good_response, timed_out=True)
+    mocker.patch.object(MockGoodResponse, 'json',
+                        return_value=timed_out_response)
+    monkeypatch.setattr(requests, 'post', mock_es_post_response_200)
+    sq = SearchQuery({'q': 'abcd', 'from': 0, 'page': 1, 'page_size': 1})
+    assert v2_handlers.items(sq) == timed_out_response
+    assert v2_handlers.es_stale_cache.currsize == 0
+
+
+@pytest.mark.usefixtures('disable_auth')
+def test_items_limits_stale_results_by_size(monkeypatch):
+    """items() counts stale results by the size of their JSON, and does not
+    keep one that is too big to share the cache with others"""
+    monkeypatch.setattr(requests, 'post', mock_es_post_response_200)
+    sq = SearchQuery({'q': 'abcd', 'from': 0, 'page': 1, 'page_size': 1})
+    v2_handlers.items(sq)
+    assert v2_handlers.es_stale_cache.currsize == \
+        len(MockGoodResponse.content)
+    v2_handlers.es_stale_cache.clear()
+    monkeypatch.setattr(MockGoodResponse, 'content',
+                        b' ' * v2_handlers.es_stale_cache.maxsize)
+    assert v2_handlers.items(sq) == minimal_good_response
+    assert v2_handlers.es_stale_cache.currsize == 0
+
+
+@pytest.mark.usefixtures('disable_auth')
+def test_search_items_does_not_keep_timed_out_results(monkeypatch, mocker):
+    """search_items() returns partial results but does not keep them in
+    search_cache"""
+    timed_out_response = dict(minimal_good_response, timed_out=True)
+    items_stub = mocker.stub()
+    items_stub.return_value = timed_out_response
+    monkeypatch.setattr(v2_handlers, 'items', items_stub)
+    params = types.ItemsQueryType({'q': 'search timed out'})
+    assert v2_handlers.search_items(params) == timed_out_response
+    assert v2_handlers.search_items(params) == timed_out_response
+    assert items_stub.call_count == 2
+
+
+@pytest.mark.usefixtures('disable_auth')
+def test_search_items_keeps_complete_results(monkeypatch, mocker):
+    items_stub = mocker.stub()
+    items_stub.return_value = minimal_good_response
+    monkeypatch.setattr(v2_handlers, 'items', items_stub)
+    params = types.ItemsQueryType({'q': 'search completed'})
+    v2_handlers.search_items(params)
+    v2_handlers.search_items(params)
+    assert items_stub.call_count == 1
+
+
+@pytest.mark.usefixtures('disable_auth')
+def test_items_is_subject_to_admission_control(monkeypatch, mocker):
+    """items() is rejected without calling Elasticsearch if too many
+    searches are in flight"""
+    post_stub = mocker.stub()
+    monkeypatch.setattr(requests, 'post', post_stub)
+    monkeypatch.setattr(admission.controller, 'in_flight',
+                        admission.controller.capacity)
+    sq = SearchQuery({'q': 'abcd', 'from': 0, 'page': 1, 'page_size': 1})
+    with pytest.raises(admission.Overloaded):
+        v2_handlers.items(sq)
+    post_stub.assert_not_called()
+
+
+def test_items_admits_search_by_its_cost(monkeypatch, mocker):
+    monkeypatch.setattr(requests, 'post', mock_es_post_response_200)
+    mocker.spy(admission.controller, 'admit')
+    sq = SearchQuery({'q': 'abcd', 'from': 0, 'page': 1, 'page_size': 1})
+    v2_handlers.items(sq)
+    admission.controller.admit.assert_called_once_with(sq.cost)
+
+
+@pytest.mark.usefixtures('patch_db_connection')
+def test_rate_limit_is_weighted_by_query_cost(monkeypatch, mocker):
+    mocker.patch('dplaapi.models.db.connect')
+    monkeypatch.setattr(models.Account, 'get', mock_Account_get)
+    monkeypatch.setattr(requests, 'post', mock_es_post_response_200)
+    mocker.patch.object(v2_handlers, 'limit_rate', return_value={})
+    client.get('/v2/items?api_key=08e3918eeb8bf4469924f062072459a8'
+               '&page_size=60')
+    v2_handlers.limit_rate.assert_called_once_with(mocker.ANY, 2)
+
+
+@pytest.mark.usefixtures('disable_auth')
+def test_query_cost_is_estimated_once(monkeypatch, mocker):
+    """The cost that is charged to the rate limit is used for admission
+    control, without being estimated again"""
+    monkeypatch.setattr(requests, 'post', mock_es_post_response_200)
+    mocker.spy(search_query, 'shape_cost')
+    mocker.spy(admission.controller, 'admit')
+    client.get('/v2/items?sourceResource.title=once&page_size=60')
+    assert search_query.shape_cost.call_count == 1
+    admission.controller.admit.assert_called_once_with(2)
+
+
+async def asgi_get(path, query_string):
+    """Make a GET request of the app on the running event loop, and return
+    the response status"""
+    scope = {'type': 'http', 'http_version': '1.1', 'method': 'GET',
+             'scheme': 'http', 'path': path, 'root_path': '',
+             'query_string': query_string.encode('utf-8'),
+             'headers': [(b'host', b'localhost')],
+             'client': ('127.0.0.1', 1234), 'server': ('localhost', 80)}
+    statuses = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            statuses.append(message['status'])
+
+    await app(scope)(receive, send)
+    return statuses[0]
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures('disable_auth')
+async def test_concurrent_searches_over_capacity_are_rejected(monkeypatch):
+    """Searches are made in threads, so concurrent requests are in flight
+    together, and those over the capacity get a 503"""
+    def slow_post(url, data, **kwargs):
+        time.sleep(0.3)
+        return MockGoodResponse()
+
+    monkeypatch.setattr(requests, 'post', slow_post)
+    monkeypatch.setattr(admission.controller, 'capacity', 2)
+    statuses = await asyncio.gather(
+        *[asgi_get('/v2/items', 'sourceResource.title=concurrent%d' % i)
+          for i in range(4)])
+    assert sorted(statuses) == [200, 200, 503, 503]
+    assert admission.controller.in_flight == 0
+
+
+@pytest.mark.usefixtures('disable_auth')
+def test_cache_hits_are_not_subject_to_admission_control(monkeypatch):
+    """A search that is answered from the cache is always admitted"""
+    monkeypatch.setattr(requests, 'post', mock_es_post_response_200)
+    v2_handlers.search_cache.clear()
+    client.get('/v2/items?q=admitted')
+    monkeypatch.setattr(admission.controller, 'in_flight',
+                        admission.controller.capacity)
+    response = client.get('/v2/items?q=admitted')
+    assert response.status_code == 200
+
+
+def split_facets_backend(monkeypatch, timed_out=False):
+    """Replace items() with a function that returns minimal_good_response
+    for record queries and es6_facets for FacetsQuery queries
+
+    Return the list of queries that it is called with.
+    """
+    queries = []
+
+    def mock_items(query):
+        queries.append(query)
+        if isinstance(query, v2_handlers.FacetsQuery):
+            return {'timed_out': timed_out, 'aggregations': es6_facets}
+        return minimal_good_response
+
+    monkeypatch.setattr(v2_handlers, 'split_facets', True)
+    monkeypatch.setattr(v2_handlers, 'items', mock_items)
+    return queries
+
+
+def test_search_items_requests_facets_separately(monkeypatch):
+    queries = split_facets_backend(monkeypatch)
+    params = types.ItemsQueryType({'q': 'split facets',
+                                   'facets': 'provider.name'})
+    result = v2_handlers.search_items(params, 5)
+    assert result['hits'] == minimal_good_response['hits']
+    assert result['aggregations'] == es6_facets
+    hits_query, = [q for q in queries
+                   if not isinstance(q, v2_handlers.FacetsQuery)]
+    assert 'aggs' not in json.loads(hits_query.body)
+    assert hits_query.cost == 5
+    assert len(queries) == 2
+    assert 'aggregations' not in minimal_good_response
+
+
+def test_search_items_requests_records_and_facets_together(monkeypatch):
+    split_facets_backend(monkeypatch)
+    mock_items = v2_handlers.items
+    # Each call waits for the other.
+    barrier = threading.Barrier(2, timeout=5)
+
+    def items_together(query):
+        barrier.wait()
+        return mock_items(query)
+
+    monkeypatch.setattr(v2_handlers, 'items', items_together)
+    params = types.ItemsQueryType({'q': 'together',
+                                   'facets': 'provider.name'})
+    assert v2_handlers.search_items(params)['aggregations'] == es6_facets
+
+
+def test_search_items_searches_with_records_if_facets_fail(monkeypatch):
+    queries = split_facets_backend(monkeypatch)
+    mock_items = v2_handlers.items
+
+    def failing_facets(query):
+        if isinstance(query, v2_handlers.FacetsQuery):
+            raise HTTPException(503, 'Backend search operation failed')
+        return mock_items(query)
+
+    monkeypatch.setattr(v2_handlers, 'items', failing_facets)
+    params = types.ItemsQueryType({'q': 'facets fail',
+                                   'facets': 'provider.name'})
+    assert v2_handlers.search_items(params) == minimal_good_response
+    assert len(queries) == 2
+    assert 'aggs' in json.loads(queries[1].body)
+
+
+def test_search_items_keeps_facets_for_other_pages(monkeypatch):
+    queries = split_facets_backend(monkeypatch)
+    for page in ['1', '2', '3']:
+        params = types.ItemsQueryType({'q': 'facets for pages',
+                                       'facets': 'provider.name',
+                                       'page': page})
+        result = v2_handlers.search_items(params)
+        assert result['aggregations'] == es6_facets
+    facet_queries = [q for q in queries
+                     if isinstance(q, v2_handlers.FacetsQuery)]
+    assert len(queries) == 4
+    assert len(facet_queries) == 1
+
+
+def test_search_items_does_not_keep_facets_that_timed_out(monkeypatch):
+    queries = split_facets_backend(monkeypatch, timed_out=True)
+    for page in ['1', '2']:
+        params = types.ItemsQueryType({'q': 'facets timed out',
+                                       'facets': 'provider.name',
+                                       'page': page})
+        v2_handlers.search_items(params)
+    facet_queries = [q for q in queries
+                     if isinstance(q, v2_handlers.FacetsQuery)]
+    assert len(facet_queries) == 2
+    assert len(v2_handlers.facet_cache) == 0
+
+
+def test_search_items_does_not_split_facets_by_default(monkeypatch):
+    queries = split_facets_backend(monkeypatch)
+    monkeypatch.setattr(v2_handlers, 'split_facets', False)
+    params = types.ItemsQueryType({'q': 'facets not split',
+                                   'facets': 'provider.name'})
+    v2_handlers.search_items(params)
+    assert len(queries) == 1
+    assert 'aggs' in json.loads(queries[0].body)
+
+
+@pytest.mark.usefixtures('disable_auth')
+def test_necropolis_items_uses_necropolis_breaker(monkeypatch, mocker):
+    """necropolis_items() fails fast when the necropolis breaker is open"""
+    post_stub = mocker.stub()
+    monkeypatch.setattr(requests, 'post', post_stub)
+    v2_handlers.necro_breaker.trip()
+    nq = v2_handlers.NecropolisQuery(
+        {'id': '13283cd2bd45ef385aae962b144c7e6a'})
+    with pytest.raises(HTTPException) as e:
+        v2_handlers.necropolis_items(nq)
+    assert e.value.status_code == 503
+    post_stub.assert_not_called()
+
+
 # multiple_items() tests ...
 
 
@@ -413,7 +850,7 @@ async def test_multiple_items_strips_lone_star_vals(monkeypatch, mocker):
 
     await v2_handlers.multiple_items(request)
     v2_handlers.search_items.assert_called_once_with(
-        {'page': 1, 'page_size': 10, 'sort_order': 'asc'})
+        {'page': 1, 'page_size': 10, 'sort_order': 'asc'}, 1)
 
 
 # end multiple_items tests.
@@ -500,9 +937,60 @@ def test_mlt_rejects_invalid_params(monkeypatch, mocker):
         assert response.status_code == 400
         assert 'is not a valid parameter' in response.json()
 
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures('disable_api_key_check')
+async def test_mlt_passes_ids_without_duplicates(monkeypatch, mocker):
+    """mlt() passes each ID to mlt_items() once"""
+    mlt_items_stub = mocker.stub()
+    mlt_items_stub.return_value = minimal_good_response
+    monkeypatch.setattr(v2_handlers, 'mlt_items', mlt_items_stub)
+    ids = '13283cd2bd45ef385aae962b144c7e6a,13283cd2bd45ef385aae962b144c7e6a'
+    path_params = {'id_or_ids': ids}
+    request = get_request('/v2/items/%s/mlt' % ids, path_params=path_params)
+
+    await v2_handlers.mlt(request)
+
+    assert mlt_items_stub.call_args[0][0]['ids'] == \
+        ['13283cd2bd45ef385aae962b144c7e6a']
+
 # end mlt tests.
 
 
+# parse_ids tests ...
+
+
+def test_parse_ids_removes_duplicates_keeping_order():
+    a = '13283cd2bd45ef385aae962b144c7e6a'
+    b = '00000062461c867a39cac531e13a48c1'
+    assert v2_handlers.parse_ids('%s,%s,%s,%s' % (b, a, b, a)) == [b, a]
+
+
+def test_parse_ids_rejects_bad_ids():
+    with pytest.raises(HTTPException) as e:
+        v2_handlers.parse_ids('13283cd2bd45ef385aae962b144c7e6a,'
+                              '13283CD2BD45EF385AAE962B144C7E6A')
+    assert e.value.status_code == 400
+    assert e.value.detail == 'Bad ID: 13283CD2BD45EF385AAE962B144C7E6A'
+
+
+def test_parse_ids_rejects_too_many_ids(monkeypatch):
+    monkeypatch.setattr(v2_handlers, 'max_ids', 2)
+    ids = ['%032x' % i for i in range(3)]
+    with pytest.raises(HTTPException) as e:
+        v2_handlers.parse_ids(','.join(ids))
+    assert e.value.status_code == 400
+    assert e.value.detail == 'Too many IDs; the maximum is 2'
+
+
+def test_parse_ids_counts_duplicates_once(monkeypatch):
+    monkeypatch.setattr(v2_handlers, 'max_ids', 2)
+    ids = ['%032x' % i for i in (0, 1, 0, 1)]
+    assert v2_handlers.parse_ids(','.join(ids)) == ids[:2]
+
+# end parse_ids tests.
+
+
 # specific_items tests ...
 
 
@@ -524,7 +1012,7 @@ async def test_specific_item_passes_ids(monkeypatch, mocker):
 
     v2_handlers.search_items.assert_called_once_with(
         {'page': 1, 'page_size': 1, 'sort_order': 'asc',
-         'ids': ['13283cd2bd45ef385aae962b144c7e6a']})
+         'ids': ['13283cd2bd45ef385aae962b144c7e6a']}, 1)
 
 
 @pytest.mark.asyncio
@@ -533,7 +1021,7 @@ async def test_specific_item_handles_multiple_ids(monkeypatch, mocker):
     """It splits ids on commas and calls search_items() with a list of those
     IDs
     """
-    def mock_search_items(arg):
+    def mock_search_items(arg, cost):
         assert len(arg['ids']) == 2
         return minimal_good_response
 
@@ -545,6 +1033,61 @@ async def test_specific_item_handles_multiple_ids(monkeypatch, mocker):
     await v2_handlers.specific_item(request)
 
 
+@pytest.mark.asyncio
+@pytest.mark.usefixtures('disable_api_key_check')
+async def test_specific_item_removes_duplicate_ids(monkeypatch, mocker):
+    """It calls search_items() with each ID once, and a page of that size"""
+    search_items_stub = mocker.stub()
+    search_items_stub.return_value = minimal_good_response
+    monkeypatch.setattr(v2_handlers, 'search_items', search_items_stub)
+    ids = '13283cd2bd45ef385aae962b144c7e6a,' \
+          '00000062461c867a39cac531e13a48c1,' \
+          '13283cd2bd45ef385aae962b144c7e6a'
+    path_params = {'id_or_ids': ids}
+    request = get_request("/v2/items/%s" % ids, path_params=path_params)
+
+    await v2_handlers.specific_item(request)
+
+    params = search_items_stub.call_args[0][0]
+    assert params['ids'] == ['13283cd2bd45ef385aae962b144c7e6a',
+                             '00000062461c867a39cac531e13a48c1']
+    assert params['page_size'] == 2
+
+
+@pytest.mark.usefixtures('disable_auth')
+def test_specific_item_asks_for_all_of_more_than_50_ids(monkeypatch):
+    """The search for more IDs than the default page size asks for all of
+    them"""
+    bodies = []
+
+    def mock_post(url, data, **kwargs):
+        bodies.append(json.loads(data))
+        return MockGoodResponse()
+
+    monkeypatch.setattr(requests, 'post', mock_post)
+    ids = ['%032x' % i for i in range(120)]
+    response = client.get('/v2/items/%s' % ','.join(ids))
+    assert response.status_code == 200
+    assert bodies[0]['size'] == 120
+    assert bodies[0]['query']['terms']['id'] == ids
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures('disable_api_key_check')
+async def test_specific_item_rejects_too_many_ids(monkeypatch, mocker):
+    """It does not search for more than max_ids IDs"""
+    monkeypatch.setattr(v2_handlers, 'max_ids', 1)
+    search_items_stub = mocker.stub()
+    monkeypatch.setattr(v2_handlers, 'search_items', search_items_stub)
+    ids = '13283cd2bd45ef385aae962b144c7e6a,00000062461c867a39cac531e13a48c1'
+    path_params = {'id_or_ids': ids}
+    request = get_request("/v2/items/%s" % ids, path_params=path_params)
+    with pytest.raises(HTTPException) as e:
+        await v2_handlers.specific_item(request)
+    assert e.value.status_code == 400
+    search_items_stub.assert_not_called()
+
+
 @pytest.mark.asyncio
 @pytest.mark.usefixtures('disable_api_key_check')
 async def test_specific_item_rejects_bad_ids_1(mocker):
@@ -693,6 +1236,19 @@ async def test_specific_necro_item_rejects_multiple_ids(monkeypatch, mocker):
         assert e.status_code == 400
 
 
+@pytest.mark.asyncio
+@pytest.mark.usefixtures('disable_api_key_check')
+async def test_specific_necro_item_does_not_charge_for_bad_ids(mocker):
+    """specific_necropolis_item() rejects a bad ID before counting the
+    request against the rate limit"""
+    mocker.patch.object(v2_handlers, 'limit_rate', return_value={})
+    path_params = {'single_id': 'x'}
+    request = get_request('/v2/necropolis/x', path_params=path_params)
+    with pytest.raises(HTTPException):
+        await v2_handlers.specific_necropolis_item(request)
+    v2_handlers.limit_rate.assert_not_called()
+
+
 @pytest.mark.asyncio
 @pytest.mark.usefixtures('disable_api_key_check')
 async def test_specific_necro_item_rejects_bad_ids_1(mocker):
@@ -824,7 +1380,11 @@ def test_send_email_uses_correct_source_and_destination(monkeypatch, mocker):
     send_email_stub = mocker.stub()
     monkeypatch.setattr(MockBoto3Client, 'send_email', send_email_stub)
 
-    v2_handlers.send_email('x', to_email)
+    v2_handlers.ses_client.cache_clear()
+    try:
+        v2_handlers.send_email('x', to_email)
+    finally:
+        v2_handlers.ses_client.cache_clear()
     send_email_stub.assert_called_once_with(
         Destination={'ToAddresses': ['testto@example.org']},
         Message='x',
@@ -839,13 +1399,48 @@ def test_send_email_raises_ServerError_for_no_EMAIL_FROM(monkeypatch, mocker):
         assert e.status_code == 500
 
 
-def test_send_api_key_email_calls_send_email_w_correct_params(monkeypatch,
-                                                              mocker):
-    """It calls send_email() with the correct parameters"""
-    send_email_stub = mocker.stub()
-    monkeypatch.setattr(v2_handlers, 'send_email', send_email_stub)
+def test_ses_client_is_shared(monkeypatch, mocker):
+    """It creates one boto3 client and returns it each time"""
+    factory = mocker.Mock(side_effect=mock_boto3_client_factory)
+    monkeypatch.setattr(boto3, 'client', factory)
+    v2_handlers.ses_client.cache_clear()
+    try:
+        assert v2_handlers.ses_client() is v2_handlers.ses_client()
+    finally:
+        v2_handlers.ses_client.cache_clear()
+    factory.assert_called_once_with('ses')
+
+
+def test_queue_email_sends_through_outbox(monkeypatch, mocker):
+    """It queues the message instead of sending it"""
+    send_stub = mocker.stub()
+    box_send_stub = mocker.stub()
+    monkeypatch.setattr(v2_handlers, 'send_email', send_stub)
+    monkeypatch.setattr(v2_handlers.outbox, 'send', box_send_stub)
+    v2_handlers.queue_email('x', 'x@example.org')
+    box_send_stub.assert_called_once_with('x', 'x@example.org')
+    send_stub.assert_not_called()
+
+
+def test_queue_email_sends_now_when_outbox_is_full(monkeypatch, mocker):
+    """It sends the message itself if the outbox is full"""
+    def full_send(*args):
+        raise OutboxFull()
+
+    send_stub = mocker.stub()
+    monkeypatch.setattr(v2_handlers, 'send_email', send_stub)
+    monkeypatch.setattr(v2_handlers.outbox, 'send', full_send)
+    v2_handlers.queue_email('x', 'x@example.org')
+    send_stub.assert_called_once_with('x', 'x@example.org')
+
+
+def test_send_api_key_email_calls_queue_email_w_correct_params(
+        monkeypatch, mocker):
+    """It calls queue_email() with the correct parameters"""
+    queue_email_stub = mocker.stub()
+    monkeypatch.setattr(v2_handlers, 'queue_email', queue_email_stub)
     v2_handlers.send_api_key_email('x@example.org', 'a1b2c3')
-    send_email_stub.assert_called_once_with(
+    queue_email_stub.assert_called_once_with(
         {
             'Body': {
                 'Text': {
@@ -859,32 +1454,32 @@ def test_send_api_key_email_calls_send_email_w_correct_params(monkeypatch,
 
 
 def test_send_api_key_email_raises_ServerError_for_Exception(monkeypatch):
-    def buggy_send_email(*args):
+    def buggy_queue_email(*args):
         1/0
 
-    monkeypatch.setattr(v2_handlers, 'send_email', buggy_send_email)
+    monkeypatch.setattr(v2_handlers, 'queue_email', buggy_queue_email)
     with pytest.raises(HTTPException) as e:
         v2_handlers.send_api_key_email('x@example.org', 'a1b2c3')
         assert e.status_code == 500
 
 
 def test_send_api_key_email_reraises_HTTPException(monkeypatch):
-    def buggy_send_email(*args):
+    def buggy_queue_email(*args):
         raise HTTPException(404)
 
-    monkeypatch.setattr(v2_handlers, 'send_email', buggy_send_email)
+    monkeypatch.setattr(v2_handlers, 'queue_email', buggy_queue_email)
     with pytest.raises(HTTPException) as e:
         v2_handlers.send_api_key_email('x@example.org', 'a1b2c3')
         assert e.status_code == 404
 
 
-def test_send_reminder_email_calls_send_email_w_correct_params(monkeypatch,
-                                                               mocker):
-    """It calls send_email with the correct parameters."""
-    send_email_stub = mocker.stub()
-    monkeypatch.setattr(v2_handlers, 'send_email', send_email_stub)
+def test_send_reminder_email_calls_queue_email_w_correct_params(
+        monkeypatch, mocker):
+    """It calls queue_email with the correct parameters."""
+    queue_email_stub = mocker.stub()
+    monkeypatch.setattr(v2_handlers, 'queue_email', queue_email_stub)
     v2_handlers.send_reminder_email('x@example.org', 'a1b2c3')
-    send_email_stub.assert_called_once_with(
+    queue_email_stub.assert_called_once_with(
         {
             'Body': {
                 'Text': {
@@ -899,20 +1494,20 @@ def test_send_reminder_email_calls_send_email_w_correct_params(monkeypatch,
 
 
 def test_send_reminder_email_raises_Server_Error_for_Exception(monkeypatch):
-    def buggy_send_email(*args):
+    def buggy_queue_email(*args):
         1/0
 
-    monkeypatch.setattr(v2_handlers, 'send_email', buggy_send_email)
+    monkeypatch.setattr(v2_handlers, 'queue_email', buggy_queue_email)
     with pytest.raises(HTTPException) as e:
         v2_handlers.send_reminder_email('x@example.org', 'a1b2c3')
         assert e.status_code == 500
 
 
 def test_send_reminder_email_reraises_HTTPException(monkeypatch):
-    def buggy_send_email(*args):
+    def buggy_queue_email(*args):
         raise HTTPException(404)
 
-    monkeypatch.setattr(v2_handlers, 'send_email', buggy_send_email)
+    monkeypatch.setattr(v2_handlers, 'queue_email', buggy_queue_email)
     with pytest.raises(HTTPException) as e:
         v2_handlers.send_reminder_email('x@example.org', 'a1b2c3')
         assert e.status_code == 404
@@ -937,6 +1532,8 @@ async def test_api_key_flunks_bad_email():
 async def test_api_key_bails_if_account_exists_for_email(monkeypatch, mocker):
     """api_key() quits and sends a reminder email if there's already an Account
     for the given email"""
+    monkeypatch.setenv('EMAIL_FROM', 'testfrom@example.org')
+
     def mock_get(*args, **kwargs):
         return models.Account(email='x@example.org',
                               key='08e3918eeb8bf4469924f062072459a8')
@@ -959,6 +1556,7 @@ async def test_api_key_bails_if_account_exists_for_email(monkeypatch, mocker):
 async def test_api_key_raises_503_for_bad_db_connection(monkeypatch,
                                                         mocker):
     """api_key() raises ServerError if it can't connect to the database"""
+    monkeypatch.setenv('EMAIL_FROM', 'testfrom@example.org')
     with pytest.raises(HTTPException) as e:
         request = post_request("/v2/api_key/x@example.org",
                                path_params={'email': 'x@example.org'})
@@ -966,7 +1564,21 @@ async def test_api_key_raises_503_for_bad_db_connection(monkeypatch,
         assert e.status_code == 503
 
 
-# Fixture for the following two tests
+@pytest.mark.asyncio
+async def test_api_key_raises_500_for_no_EMAIL_FROM(monkeypatch, mocker):
+    """api_key() does not create an account if it can not send email"""
+    monkeypatch.delenv('EMAIL_FROM', raising=False)
+    connect_stub = mocker.stub()
+    monkeypatch.setattr(models.db, 'connect', connect_stub)
+    request = post_request("/v2/api_key/x@example.org",
+                           path_params={'email': 'x@example.org'})
+    with pytest.raises(HTTPException) as e:
+        await v2_handlers.api_key(request)
+    assert e.value.status_code == 500
+    connect_stub.assert_not_called()
+
+
+# Fixture for the following tests
 @pytest.fixture(scope='function')
 def good_api_key_invocation(monkeypatch, mocker):
 
@@ -983,6 +1595,7 @@ def good_api_key_invocation(monkeypatch, mocker):
         def __exit__(self, *args, **kwargs):
             pass
 
+    monkeypatch.setenv('EMAIL_FROM', 'testfrom@example.org')
     monkeypatch.setattr(secrets, 'token_hex', mock_token_hex)
     monkeypatch.setattr(models.Account, 'get', mock_get)
     send_email_stub = mocker.stub()
@@ -1012,6 +1625,22 @@ async def test_api_key_creates_account(monkeypatch, mocker):
         enabled=True)
 
 
+@pytest.mark.asyncio
+@pytest.mark.usefixtures('good_api_key_invocation')
+async def test_api_key_sends_email_after_releasing_connection(monkeypatch,
+                                                              mocker):
+    """api_key() returns the database connection before sending email"""
+    events = []
+    monkeypatch.setattr(models.db, 'connect', lambda: events.append('connect'))
+    monkeypatch.setattr(models.db, 'close', lambda: events.append('close'))
+    monkeypatch.setattr(v2_handlers, 'send_api_key_email',
+                        lambda *args: events.append('email'))
+    request = post_request("/v2/api_key/x@example.org",
+                           path_params={'email': 'x@example.org'})
+    await v2_handlers.api_key(request)
+    assert events == ['connect', 'close', 'email']
+
+
 # end api_key tests
 
 
@@ -1358,3 +1987,29 @@ def test_flatten():
 
     rv = [x for x in v2_handlers.flatten(None)]
     assert rv == []
+
+
+def test_cache_from_env_reads_size_and_ttl(monkeypatch):
+    monkeypatch.setenv('SEARCH_CACHE_SIZE', '1000')
+    monkeypatch.setenv('SEARCH_CACHE_TTL', '60')
+    cache = v2_handlers.cache_from_env('search', 'SEARCH', 100, 20)
+    assert cache.maxsize == 1000
+    assert cache.ttl == 60
+    assert cache.name == 'search'
+
+
+def test_cache_from_env_has_defaults(monkeypatch):
+    monkeypatch.delenv('MLT_CACHE_SIZE', raising=False)
+    monkeypatch.delenv('MLT_CACHE_TTL', raising=False)
+    cache = v2_handlers.cache_from_env('mlt', 'MLT', 50, 20)
+    assert cache.maxsize == 50
+    assert cache.ttl == 20
+
+
+def test_boto3_is_not_imported_at_startup():
+    """boto3 is slow to import, and only needed to send email"""
+    script = 'import sys, dplaapi; print("boto3" in sys.modules)'
+    root = os.path.dirname(os.path.dirname(dplaapi.__file__))
+    output = subprocess.check_output([sys.executable, '-c', script],
+                                     cwd=root, stderr=subprocess.DEVNULL)
+    assert output.strip() == b'False'
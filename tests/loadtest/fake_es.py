@@ -0,0 +1,221 @@
+"""
+A stand-in for Elasticsearch, for load tests
+
+It answers POSTs to `/_search' and `/_msearch' (at any index path) with
+canned, DPLA-shaped responses: as many hits as the query asks for, with the
+IDs asked for if it is a search by ID, and an aggregation for each one in the
+query. Each response is delayed by a configurable latency.
+
+Run it on its own with
+
+    $ python tests/loadtest/fake_es.py --port 9200 --es-latency 0.02
+
+or start it in a thread with `start()'.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'benchmarks'))
+import benchmark_data  # noqa: E402
+
+
+class Settings():
+    def __init__(self, latency=0.0, jitter=0.0, hits=None, buckets=None):
+        """
+        Arguments:
+
+        latency:  Seconds to wait before responding
+        jitter:   Up to this many seconds are added to or taken from the
+                  latency, at random
+        hits:     Number of hits in each response; by default, the `size' of
+                  the query
+        buckets:  Maximum number of buckets in a terms aggregation; by
+                  default, the `size' of the aggregation
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.hits = hits
+        self.buckets = buckets
+
+    def delay(self):
+        return max(0, self.latency + random.uniform(-self.jitter,
+                                                    self.jitter))
+
+
+# A pool of documents to take hits from
+documents = benchmark_data.documents
+
+
+def ids_in_query(body):
+    terms = body.get('query', {}).get('terms', {})
+    return terms.get('id')
+
+
+def geo_bucket(distance_range):
+    key = '%s-%s' % (distance_range['from'], distance_range.get('to', '*'))
+    return dict(distance_range, key=key, doc_count=random.randint(1, 518784))
+
+
+def aggregation(agg, settings):
+    """Return a canned result for one aggregation of a query"""
+    if 'terms' in agg:
+        size = agg['terms'].get('size', 10)
+        if settings.buckets is not None:
+            size = min(size, settings.buckets)
+        return benchmark_data.terms_aggregation(size)
+    if 'geo_distance' in agg:
+        return {'buckets': [geo_bucket(r)
+                            for r in agg['geo_distance']['ranges']]}
+    if 'aggs' in agg:
+        name = next(iter(agg['aggs']))
+        return benchmark_data.date_aggregation(name, 150)
+    return {'buckets': []}
+
+
+def search_response(body, settings):
+    """Return a canned response for the _search request body `body'"""
+    ids = ids_in_query(body)
+    if ids is not None:
+        hits = [dict(documents[i % len(documents)], id=the_id)
+                for i, the_id in enumerate(ids)]
+    else:
+        size = settings.hits if settings.hits is not None \
+               else body.get('size', 10)
+        start = body.get('from', 0)
+        hits = [documents[(start + i) % len(documents)] for i in range(size)]
+    rv = {
+        'took': int(settings.latency * 1000),
+        'timed_out': False,
+        '_shards': {'total': 5, 'successful': 5, 'skipped': 0, 'failed': 0},
+        'hits': {
+            'total': len(hits) if ids is not None else 3781862,
+            'max_score': 1.0,
+            'hits': [{'_index': 'dpla_alias', '_type': 'item',
+                      '_id': hit['id'], '_score': 1.0, '_source': hit}
+                     for hit in hits]
+        }
+    }
+    if 'aggs' in body:
+        rv['aggregations'] = {name: aggregation(agg, settings)
+                              for name, agg in body['aggs'].items()}
+    return rv
+
+
+def msearch_response(ndjson, settings):
+    """Return a canned response for the _msearch request body `ndjson'"""
+    lines = [line for line in ndjson.splitlines() if line.strip()]
+    # The lines are pairs of a header and a search body.
+    bodies = [json.loads(line) for line in lines[1::2]]
+    return {'took': int(settings.latency * 1000),
+            'responses': [dict(search_response(b, settings), status=200)
+                          for b in bodies]}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length).decode('utf-8')
+        path = self.path.partition('?')[0]
+        settings = self.server.settings
+        try:
+            if path.endswith('/_search'):
+                rv = search_response(json.loads(body or '{}'), settings)
+            elif path.endswith('/_msearch'):
+                rv = msearch_response(body, settings)
+            else:
+                self.respond(404, {'error': 'Not found: %s' % path})
+                return
+        except ValueError as e:
+            self.respond(400, {'error': str(e)})
+            return
+        time.sleep(settings.delay())
+        self.respond(200, rv)
+
+    # Answers `curl localhost:9200', to check that the server is up.
+    def do_GET(self):
+        self.respond(200, {'tagline': 'You Know, for Search'})
+
+    def respond(self, status, obj):
+        data = json.dumps(obj).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, settings):
+        super(Server, self).__init__(address, Handler)
+        self.settings = settings
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://%s:%d' % (host, port)
+
+
+def start(settings=None, host='127.0.0.1', port=0):
+    """Start a server in a daemon thread and return it
+
+    Port 0 picks a free port; see the server's `url'. Stop the server with
+    its `shutdown()' method.
+    """
+    server = Server((host, port), settings or Settings())
+    thread = threading.Thread(target=server.serve_forever, name='fake-es',
+                              daemon=True)
+    thread.start()
+    return server
+
+
+def add_arguments(parser):
+    parser.add_argument('--es-latency', type=float, default=0.02,
+                        help='Seconds that the fake Elasticsearch takes to '
+                             'respond (default 0.02)')
+    parser.add_argument('--es-jitter', type=float, default=0.005,
+                        help='Seconds of random variation in the latency '
+                             '(default 0.005)')
+    parser.add_argument('--es-hits', type=int, default=None,
+                        help='Hits per response (default: the page size)')
+    parser.add_argument('--es-buckets', type=int, default=None,
+                        help='Maximum buckets per terms aggregation '
+                             '(default: the facet size)')
+
+
+def settings_from_args(args):
+    return Settings(args.es_latency, args.es_jitter, args.es_hits,
+                    args.es_buckets)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9200)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = Server((args.host, args.port), settings_from_args(args))
+    print('Fake Elasticsearch listening at %s' % server.url, file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
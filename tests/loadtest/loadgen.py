@@ -0,0 +1,288 @@
+"""
+Load test of the whole request path
+
+This starts a fake Elasticsearch (see fake_es.py) and the application, under
+gunicorn with uvicorn workers as in production, and then sends requests to a
+mix of endpoints from a number of concurrent clients for a while. It reports
+the throughput and latency percentiles of each endpoint.
+
+    $ python tests/loadtest/loadgen.py --workers 2 --concurrency 16 \\
+        --duration 30 --save results.json
+
+A later run can be compared with the saved results with `--baseline
+results.json'; the exit status is 1 if the throughput or the 99th percentile
+latency of any endpoint is worse by more than `--threshold'.
+
+The clients are threads in this process. If this process uses a whole CPU,
+the results measure the load generator more than the application; use fewer
+workers or clients, or `--url' to test a server on another machine.
+
+Authentication is disabled in the application, so that it does not need
+PostgreSQL.
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import threading
+import subprocess
+import requests
+from collections import defaultdict
+
+import fake_es
+
+
+repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..',
+                                         '..'))
+
+
+def item_id(rng):
+    return '%032x' % rng.getrandbits(128)
+
+
+def words(rng, n):
+    return '+'.join(rng.choice(fake_es.benchmark_data.words)
+                    for _ in range(n))
+
+
+# Endpoint name: (weight, function of a Random that returns a path)
+endpoints = {
+    'search': (50, lambda rng: '/v2/items?q=%s' % words(rng, 2)),
+    'search_facets': (20, lambda rng: (
+        '/v2/items?q=%s&facet_size=50&facets=provider.name,'
+        'sourceResource.type,sourceResource.date.begin.year'
+        % words(rng, 1))),
+    'fetch_ids': (15, lambda rng: '/v2/items/%s,%s' % (item_id(rng),
+                                                       item_id(rng))),
+    'mlt': (5, lambda rng: '/v2/items/%s/mlt' % item_id(rng)),
+    'random': (5, lambda rng: '/v2/random'),
+    'necropolis': (5, lambda rng: '/v2/necropolis/%s' % item_id(rng))
+}
+
+
+def request_paths(names, distinct, seed):
+    """Return a dict of endpoint name to a list of `distinct' paths
+
+    The number of distinct paths determines how often the application's
+    caches are hit.
+    """
+    rng = random.Random(seed)
+    return {name: [endpoints[name][1](rng) for _ in range(distinct)]
+            for name in names}
+
+
+def percentile(sorted_values, p):
+    """Return the p-th percentile (0-100) of a sorted list, by nearest rank"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summary(latencies, errors, duration):
+    """Return a dict of statistics for one endpoint
+
+    Arguments:
+
+    latencies:  list of seconds taken by successful requests
+    errors:     number of failed requests
+    duration:   seconds over which the requests were measured
+    """
+    latencies = sorted(latencies)
+
+    def ms(seconds):
+        return round(seconds * 1000, 2) if seconds is not None else None
+
+    return {
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'rps': round(len(latencies) / duration, 2),
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p90_ms': ms(percentile(latencies, 90)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'max_ms': ms(latencies[-1] if latencies else None)
+    }
+
+
+def regressions(results, baseline, threshold):
+    """Return a list of descriptions of results worse than the baseline"""
+    problems = []
+    for name, base in sorted(baseline.items()):
+        result = results.get(name)
+        if result is None:
+            continue
+        if result['rps'] < base['rps'] * (1 - threshold):
+            problems.append('%s: %.1f requests/sec, down from %.1f'
+                            % (name, result['rps'], base['rps']))
+        if result['p99_ms'] is not None and base['p99_ms'] is not None \
+                and result['p99_ms'] > base['p99_ms'] * (1 + threshold):
+            problems.append('%s: p99 %.1f ms, up from %.1f ms'
+                            % (name, result['p99_ms'], base['p99_ms']))
+    return problems
+
+
+class Client(threading.Thread):
+    """A thread that sends requests one after another until a deadline"""
+
+    def __init__(self, base_url, paths, weights, seed, measure_from,
+                 deadline):
+        super(Client, self).__init__(daemon=True)
+        self.base_url = base_url
+        self.paths = paths
+        self.names = sorted(paths)
+        self.weights = [weights[n] for n in self.names]
+        self.rng = random.Random(seed)
+        self.measure_from = measure_from
+        self.deadline = deadline
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def run(self):
+        session = requests.Session()
+        while time.monotonic() < self.deadline:
+            name = self.rng.choices(self.names, self.weights)[0]
+            path = self.rng.choice(self.paths[name])
+            start = time.monotonic()
+            try:
+                resp = session.get(self.base_url + path, timeout=30)
+                ok = resp.status_code < 400
+            except requests.exceptions.RequestException:
+                ok = False
+            if start < self.measure_from:
+                continue
+            if ok:
+                self.latencies[name].append(time.monotonic() - start)
+            else:
+                self.errors[name] += 1
+
+
+def run_load(base_url, names, concurrency, duration, warmup, distinct,
+             seed=0):
+    """Send requests and return a dict of endpoint name to summary()"""
+    paths = request_paths(names, distinct, seed)
+    weights = {name: endpoints[name][0] for name in names}
+    measure_from = time.monotonic() + warmup
+    deadline = measure_from + duration
+    clients = [Client(base_url, paths, weights, seed + i + 1, measure_from,
+                      deadline)
+               for i in range(concurrency)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    return {name: summary([x for c in clients for x in c.latencies[name]],
+                          sum(c.errors[name] for c in clients),
+                          duration)
+            for name in names}
+
+
+def start_app(port, workers, es_url, extra_env=None):
+    """Start the application with gunicorn and return the Popen
+
+    Arguments:
+
+    extra_env:  dict of additional environment variables for the application
+    """
+    env = dict(os.environ, ES_BASE=es_url, NECRO_BASE=es_url,
+               DISABLE_AUTH='true')
+    env.update(extra_env or {})
+    cmd = [sys.executable, '-m', 'gunicorn', '-w', str(workers),
+           '-b', '127.0.0.1:%d' % port, '-k', 'uvicorn.workers.UvicornWorker',
+           '--log-level', 'warning', 'dplaapi:app']
+    return subprocess.Popen(cmd, env=env, cwd=repo_root)
+
+
+def wait_until_up(base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(base_url + '/metrics', timeout=1)
+            return
+        except requests.exceptions.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError('The application did not start at %s' % base_url)
+
+
+def report(results, stream=sys.stdout):
+    columns = ('requests', 'errors', 'rps', 'p50_ms', 'p90_ms', 'p99_ms',
+               'max_ms')
+    print('%-14s' % 'endpoint' + ''.join('%10s' % c for c in columns),
+          file=stream)
+    for name, result in sorted(results.items()):
+        print('%-14s' % name
+              + ''.join('%10s' % ('-' if result[c] is None else result[c])
+                        for c in columns),
+              file=stream)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Load test of the whole request path')
+    parser.add_argument('--url',
+                        help='URL of a running application to test, instead '
+                             'of starting one with a fake Elasticsearch')
+    parser.add_argument('--port', type=int, default=8008,
+                        help='Port for the application (default 8008)')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='Application worker processes (default 2)')
+    parser.add_argument('--concurrency', type=int, default=16,
+                        help='Concurrent clients (default 16)')
+    parser.add_argument('--duration', type=float, default=30,
+                        help='Seconds to measure for (default 30)')
+    parser.add_argument('--warmup', type=float, default=5,
+                        help='Seconds of load before measuring (default 5)')
+    parser.add_argument('--distinct', type=int, default=1000,
+                        help='Distinct requests per endpoint (default 1000)')
+    parser.add_argument('--endpoints', default=','.join(sorted(endpoints)),
+                        help='Comma-separated endpoints to request '
+                             '(default: all)')
+    parser.add_argument('--save', help='Write the results to this JSON file')
+    parser.add_argument('--baseline',
+                        help='Compare the results with this JSON file')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Fraction by which a result may be worse than '
+                             'the baseline (default 0.2)')
+    fake_es.add_arguments(parser)
+    args = parser.parse_args()
+
+    names = args.endpoints.split(',')
+    for name in names:
+        if name not in endpoints:
+            parser.error('Unknown endpoint %s' % name)
+
+    es_server = app = None
+    base_url = args.url
+    try:
+        if not base_url:
+            es_server = fake_es.start(fake_es.settings_from_args(args))
+            app = start_app(args.port, args.workers, es_server.url)
+            base_url = 'http://127.0.0.1:%d' % args.port
+        wait_until_up(base_url)
+        results = run_load(base_url, names, args.concurrency, args.duration,
+                           args.warmup, args.distinct)
+    finally:
+        if app:
+            app.terminate()
+            app.wait()
+        if es_server:
+            es_server.shutdown()
+
+    report(results)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = regressions(results, json.load(f), args.threshold)
+        for problem in problems:
+            print('REGRESSION %s' % problem, file=sys.stderr)
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
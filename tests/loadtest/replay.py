@@ -0,0 +1,308 @@
+"""
+Replay of recorded requests
+
+This reads access logs, and replays the item requests in them (searches,
+fetches by ID, "more like this", random and necropolis requests) against the
+application with a fake Elasticsearch, as loadgen.py does. It reports the
+latency percentiles of each endpoint and the hit ratio of each of the
+application's caches, so that cache sizes and TTLs can be tuned with the real
+mix of facets, filters and page sizes:
+
+    $ python tests/loadtest/replay.py access.log --speed 10 \\
+        -e SEARCH_CACHE_SIZE=1000 -e SEARCH_CACHE_TTL=60
+
+The logs may be the JSON lines of the `dplaapi.access' logger, or lines in the
+Common or Combined Log Format, as written by nginx or a load balancer. Other
+lines are ignored.
+
+Requests are sent at their recorded times, sped up by `--speed', or one after
+another as fast as the clients can send them with `--speed 0'. API keys are
+removed from the requests.
+"""
+
+import re
+import sys
+import json
+import time
+import queue
+import argparse
+import tempfile
+import threading
+import requests
+from datetime import datetime
+from collections import defaultdict, namedtuple
+from urllib.parse import parse_qsl, urlencode
+
+import fake_es
+import loadgen
+
+
+Request = namedtuple('Request', ['time', 'endpoint', 'path'])
+
+dplaapi_time_pat = re.compile(
+    r'^\[(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d [+-]\d{4})\]')
+clf_pat = re.compile(
+    r'\[(?P<time>[^\]]+)\] "(?P<method>[A-Z]+) (?P<target>\S+)[^"]*"')
+
+# Endpoint name, path pattern; as in routes.v2
+routes = [
+    ('search', re.compile(r'^(/v2)?/items$')),
+    ('fetch_ids', re.compile(r'^(/v2)?/items/[^/]+$')),
+    ('mlt', re.compile(r'^/v2/items/[^/]+/mlt$')),
+    ('random', re.compile(r'^/v2/random$')),
+    ('necropolis', re.compile(r'^/v2/necropolis/[^/]+$'))
+]
+
+cache_metric_pat = re.compile(
+    r'^dplaapi_cache_(?P<kind>hits|misses|evictions)_total'
+    r'\{cache="(?P<cache>[^"]*)"\} (?P<value>\S+)$')
+
+
+def endpoint_name(path):
+    for name, pat in routes:
+        if pat.match(path):
+            return name
+    return None
+
+
+def without_api_key(query):
+    return urlencode([(k, v) for k, v in parse_qsl(query,
+                                                   keep_blank_values=True)
+                      if k != 'api_key'])
+
+
+def parse_line(line):
+    """Return a Request for a log line, or None if it is not replayable"""
+    timestamp = None
+    brace = line.find('{')
+    if brace != -1 and line.rstrip().endswith('}'):
+        try:
+            entry = json.loads(line[brace:])
+        except ValueError:
+            return None
+        method = entry.get('method')
+        path = entry.get('path', '')
+        query = entry.get('query', '')
+        match = dplaapi_time_pat.match(line)
+        if match:
+            timestamp = datetime.strptime(match.group(1),
+                                          '%Y-%m-%d %H:%M:%S %z')
+    else:
+        match = clf_pat.search(line)
+        if not match:
+            return None
+        method = match.group('method')
+        path, _, query = match.group('target').partition('?')
+        try:
+            timestamp = datetime.strptime(match.group('time'),
+                                          '%d/%b/%Y:%H:%M:%S %z')
+        except ValueError:
+            pass
+    name = endpoint_name(path)
+    if method != 'GET' or name is None:
+        return None
+    query = without_api_key(query)
+    return Request(timestamp.timestamp() if timestamp else None, name,
+                   '%s?%s' % (path, query) if query else path)
+
+
+def read_requests(lines):
+    return [r for r in map(parse_line, lines) if r is not None]
+
+
+def schedule(recorded, speed):
+    """Return a list of (seconds from the start, Request) tuples
+
+    Requests without a time, or all requests if `speed' is 0, are sent as
+    soon as possible.
+    """
+    times = [r.time for r in recorded if r.time is not None]
+    start = min(times) if times else 0
+    return [((r.time - start) / speed
+             if speed and r.time is not None else 0, r)
+            for r in recorded]
+
+
+def cache_counts(exposition):
+    """Return {cache: {'hits': n, 'misses': n, 'evictions': n}} from the
+    Prometheus text of /metrics"""
+    counts = defaultdict(lambda: {'hits': 0, 'misses': 0, 'evictions': 0})
+    for line in exposition.splitlines():
+        match = cache_metric_pat.match(line)
+        if match:
+            counts[match.group('cache')][match.group('kind')] = \
+                float(match.group('value'))
+    return dict(counts)
+
+
+def cache_report(before, after):
+    """Return the cache activity between two cache_counts() results"""
+    rv = {}
+    for cache, counts in after.items():
+        earlier = before.get(cache, {})
+        diff = {k: int(v - earlier.get(k, 0)) for k, v in counts.items()}
+        lookups = diff['hits'] + diff['misses']
+        diff['hit_ratio'] = round(diff['hits'] / lookups, 4) \
+            if lookups else None
+        rv[cache] = diff
+    return rv
+
+
+def scrape_caches(base_url):
+    return cache_counts(requests.get(base_url + '/metrics', timeout=10).text)
+
+
+class Replayer():
+    """Sends scheduled requests from a number of client threads"""
+
+    def __init__(self, base_url, concurrency):
+        self.base_url = base_url
+        self.concurrency = concurrency
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def run(self, scheduled):
+        work = queue.Queue()
+        for item in sorted(scheduled, key=lambda x: x[0]):
+            work.put(item)
+        start = time.monotonic()
+        clients = [threading.Thread(target=self.client, args=(work, start),
+                                    daemon=True)
+                   for _ in range(self.concurrency)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        return time.monotonic() - start
+
+    def client(self, work, start):
+        session = requests.Session()
+        while True:
+            try:
+                offset, request = work.get_nowait()
+            except queue.Empty:
+                return
+            delay = start + offset - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            sent = time.monotonic()
+            try:
+                resp = session.get(self.base_url + request.path, timeout=30)
+                # Recorded requests may be bad requests, or for items that
+                # are not found, which are answered correctly.
+                ok = resp.status_code < 500
+            except requests.exceptions.RequestException:
+                ok = False
+            with self.lock:
+                if ok:
+                    self.latencies[request.endpoint].append(
+                        time.monotonic() - sent)
+                else:
+                    self.errors[request.endpoint] += 1
+
+    def results(self, duration):
+        names = set(self.latencies) | set(self.errors)
+        return {name: loadgen.summary(self.latencies[name],
+                                      self.errors[name], duration)
+                for name in names}
+
+
+def report_caches(caches, stream=sys.stdout):
+    columns = ('hits', 'misses', 'evictions', 'hit_ratio')
+    print('%-18s' % 'cache' + ''.join('%11s' % c for c in columns),
+          file=stream)
+    for cache, result in sorted(caches.items()):
+        print('%-18s' % cache
+              + ''.join('%11s' % ('-' if result[c] is None else result[c])
+                        for c in columns),
+              file=stream)
+
+
+def env_setting(value):
+    name, sep, setting = value.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError('%s is not NAME=VALUE' % value)
+    return (name, setting)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Replay of recorded requests')
+    parser.add_argument('logs', nargs='*', default=['-'],
+                        help='Access log files (default: standard input)')
+    parser.add_argument('--speed', type=float, default=1,
+                        help='Speed-up of the recorded times, or 0 to send '
+                             'requests as fast as possible (default 1)')
+    parser.add_argument('--concurrency', type=int, default=32,
+                        help='Maximum concurrent requests (default 32)')
+    parser.add_argument('--limit', type=int,
+                        help='Replay at most this many requests')
+    parser.add_argument('--url',
+                        help='URL of a running application to replay '
+                             'against, instead of starting one with a fake '
+                             'Elasticsearch')
+    parser.add_argument('--port', type=int, default=8008,
+                        help='Port for the application (default 8008)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Application worker processes (default 1)')
+    parser.add_argument('-e', '--env', type=env_setting, action='append',
+                        default=[], metavar='NAME=VALUE',
+                        help='Environment variable for the application, '
+                             'e.g. SEARCH_CACHE_SIZE=1000; may be repeated. '
+                             'Not used with --url.')
+    parser.add_argument('--save', help='Write the results to this JSON file')
+    fake_es.add_arguments(parser)
+    args = parser.parse_args()
+
+    recorded = []
+    for path in args.logs:
+        f = sys.stdin if path == '-' else open(path)
+        with f:
+            recorded.extend(read_requests(f))
+    recorded = recorded[:args.limit]
+    if not recorded:
+        parser.error('There are no replayable requests in the logs')
+    print('Replaying %d requests' % len(recorded), file=sys.stderr)
+
+    es_server = app = None
+    base_url = args.url
+    metrics_dir = tempfile.TemporaryDirectory()
+    try:
+        if not base_url:
+            # The workers share their metrics through METRICS_DIR.
+            extra_env = {'METRICS_DIR': metrics_dir.name,
+                         'METRICS_WRITE_INTERVAL': '1'}
+            extra_env.update(args.env)
+            es_server = fake_es.start(fake_es.settings_from_args(args))
+            app = loadgen.start_app(args.port, args.workers, es_server.url,
+                                    extra_env)
+            base_url = 'http://127.0.0.1:%d' % args.port
+        loadgen.wait_until_up(base_url)
+        before = scrape_caches(base_url)
+        replayer = Replayer(base_url, args.concurrency)
+        duration = replayer.run(schedule(recorded, args.speed))
+        if app:
+            # Wait for the other workers to write their metrics.
+            time.sleep(1.5)
+        caches = cache_report(before, scrape_caches(base_url))
+    finally:
+        if app:
+            app.terminate()
+            app.wait()
+        if es_server:
+            es_server.shutdown()
+        metrics_dir.cleanup()
+
+    results = replayer.results(duration)
+    loadgen.report(results)
+    print()
+    report_caches(caches)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'endpoints': results, 'caches': caches}, f, indent=2,
+                      sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
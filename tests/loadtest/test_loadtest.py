@@ -0,0 +1,117 @@
+import pytest
+import requests
+import fake_es
+import loadgen
+from dplaapi.types import ItemsQueryType
+from dplaapi.queries.search_query import SearchQuery
+from dplaapi.handlers import v2 as v2_handlers
+
+
+@pytest.fixture
+def es_server():
+    server = fake_es.start()
+    yield server
+    server.shutdown()
+
+
+def test_fake_es_answers_search_with_page_of_hits(es_server):
+    query = SearchQuery(ItemsQueryType({'q': 'bridge', 'page_size': '25'}))
+    resp = requests.post(es_server.url + '/dpla_alias/_search',
+                         json=query.query)
+    assert resp.status_code == 200
+    result = resp.json()
+    assert len(result['hits']['hits']) == 25
+    assert 'aggregations' not in result
+
+
+def test_fake_es_aggregations_can_be_formatted(es_server):
+    params = ItemsQueryType({
+        'facets': 'provider.name,sourceResource.date.begin.year,'
+                  'sourceResource.spatial.coordinates:40.7:-73.9',
+        'facet_size': '20'})
+    query = SearchQuery(params)
+    result = requests.post(es_server.url + '/_search',
+                           json=query.query).json()
+    facets = v2_handlers.formatted_facets(result['aggregations'])
+    assert len(facets['provider.name']['terms']) == 20
+    assert facets['sourceResource.date.begin.year']['entries']
+    assert facets['sourceResource.spatial.coordinates']['ranges']
+
+
+def test_fake_es_limits_hits_and_buckets(es_server):
+    es_server.settings = fake_es.Settings(hits=3, buckets=5)
+    query = SearchQuery(ItemsQueryType({'facets': 'provider.name',
+                                        'facet_size': '50'}))
+    result = requests.post(es_server.url + '/_search',
+                           json=query.query).json()
+    assert len(result['hits']['hits']) == 3
+    assert len(result['aggregations']['provider.name']['buckets']) == 5
+
+
+def test_fake_es_answers_search_by_ids(es_server):
+    ids = ['13283cd2bd45ef385aae962b144c7e6a',
+           '00000062461c867a39cac531e13a48c1']
+    params = ItemsQueryType({})
+    params.update({'ids': ids, 'page_size': 2})
+    result = requests.post(es_server.url + '/_search',
+                           json=SearchQuery(params).query).json()
+    assert v2_handlers.hit_count(result) == 2
+    assert [h['_source']['id'] for h in result['hits']['hits']] == ids
+
+
+def test_fake_es_answers_msearch(es_server):
+    ndjson = '{}\n{"size": 1}\n{}\n{"size": 2}\n'
+    result = requests.post(es_server.url + '/_msearch', data=ndjson).json()
+    assert [len(r['hits']['hits']) for r in result['responses']] == [1, 2]
+
+
+def test_fake_es_returns_404_for_other_posts(es_server):
+    resp = requests.post(es_server.url + '/_bulk', data='{}')
+    assert resp.status_code == 404
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert loadgen.percentile(values, 50) == 50
+    assert loadgen.percentile(values, 99) == 99
+    assert loadgen.percentile(values, 100) == 100
+    assert loadgen.percentile([7], 99) == 7
+    assert loadgen.percentile([], 50) is None
+
+
+def test_summary():
+    result = loadgen.summary([0.002, 0.001, 0.003, 0.004], 1, 2)
+    assert result == {'requests': 5, 'errors': 1, 'rps': 2.0,
+                      'p50_ms': 2.0, 'p90_ms': 4.0, 'p99_ms': 4.0,
+                      'max_ms': 4.0}
+
+
+def test_regressions():
+    baseline = {'search': {'rps': 100, 'p99_ms': 50},
+                'mlt': {'rps': 10, 'p99_ms': 100},
+                'random': {'rps': 10, 'p99_ms': 100}}
+    results = {'search': {'rps': 70, 'p99_ms': 50},
+               'mlt': {'rps': 10, 'p99_ms': 150}}
+    assert loadgen.regressions(results, baseline, 0.2) == [
+        'mlt: p99 150.0 ms, up from 100.0 ms',
+        'search: 70.0 requests/sec, down from 100.0']
+    assert loadgen.regressions(results, baseline, 0.6) == []
+
+
+def test_request_paths_are_repeatable():
+    paths = loadgen.request_paths(['search', 'mlt'], 3, seed=1)
+    assert len(paths['search']) == 3
+    assert all(p.startswith('/v2/items/') for p in paths['mlt'])
+    assert paths == loadgen.request_paths(['search', 'mlt'], 3, seed=1)
+
+
+def test_run_load_reports_each_endpoint(es_server):
+    # The fake Elasticsearch answers any GET, so it can stand in for the
+    # application here.
+    results = loadgen.run_load(es_server.url, ['search', 'random'],
+                               concurrency=2, duration=0.3, warmup=0,
+                               distinct=5)
+    assert set(results) == {'search', 'random'}
+    assert results['search']['requests'] > 0
+    assert results['search']['errors'] == 0
+    assert results['search']['p50_ms'] is not None
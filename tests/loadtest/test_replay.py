@@ -0,0 +1,89 @@
+import replay
+import fake_es
+
+
+dplaapi_line = (
+    '[2018-10-01 13:59:26 +0000] [6919] [INFO] [event_hooks]: '
+    '{"method": "GET", "path": "/v2/items", "query": "q=war&page_size=5", '
+    '"route": "multiple_items", "trace_id": null, "status": 200, '
+    '"duration_ms": 10.68, "phases_ms": {}}\n')
+
+clf_line = (
+    '10.0.0.1 - - [01/Oct/2018:13:59:28 +0000] '
+    '"GET /v2/items/13283cd2bd45ef385aae962b144c7e6a/mlt?api_key=abc'
+    '&page_size=3 HTTP/1.1" 200 5123 "-" "curl/7.58.0"\n')
+
+
+def test_parse_line_reads_dplaapi_access_log():
+    request = replay.parse_line(dplaapi_line)
+    assert request.endpoint == 'search'
+    assert request.path == '/v2/items?q=war&page_size=5'
+    assert request.time == 1538402366
+
+
+def test_parse_line_reads_common_log_format_and_drops_api_key():
+    request = replay.parse_line(clf_line)
+    assert request.endpoint == 'mlt'
+    assert request.path == \
+        '/v2/items/13283cd2bd45ef385aae962b144c7e6a/mlt?page_size=3'
+    assert request.time == 1538402368
+
+
+def test_parse_line_ignores_other_requests_and_lines():
+    assert replay.parse_line(
+        '1.2.3.4 - - [01/Oct/2018:13:59:28 +0000] '
+        '"POST /v2/api_key/a@example.org HTTP/1.1" 200 10\n') is None
+    assert replay.parse_line(
+        '1.2.3.4 - - [01/Oct/2018:13:59:28 +0000] '
+        '"GET /metrics HTTP/1.1" 200 10\n') is None
+    assert replay.parse_line('Starting gunicorn 19.9.0\n') is None
+    assert replay.parse_line('{"not": "an access log line"}\n') is None
+
+
+def test_endpoint_name():
+    assert replay.endpoint_name('/items') == 'search'
+    assert replay.endpoint_name('/items/a,b') == 'fetch_ids'
+    assert replay.endpoint_name('/v2/items/a') == 'fetch_ids'
+    assert replay.endpoint_name('/v2/random') == 'random'
+    assert replay.endpoint_name('/v2/necropolis/a') == 'necropolis'
+    assert replay.endpoint_name('/v2/api_key/a') is None
+
+
+def test_schedule_speeds_up_recorded_times():
+    recorded = replay.read_requests([dplaapi_line, clf_line])
+    assert [t for t, _ in replay.schedule(recorded, 1)] == [0, 2]
+    assert [t for t, _ in replay.schedule(recorded, 4)] == [0, 0.5]
+    assert [t for t, _ in replay.schedule(recorded, 0)] == [0, 0]
+
+
+def test_cache_report():
+    before = replay.cache_counts(
+        'dplaapi_cache_hits_total{cache="search"} 2.0\n'
+        'dplaapi_cache_misses_total{cache="search"} 3.0\n')
+    after = replay.cache_counts(
+        '# TYPE dplaapi_cache_hits_total counter\n'
+        'dplaapi_cache_hits_total{cache="search"} 8.0\n'
+        'dplaapi_cache_misses_total{cache="search"} 5.0\n'
+        'dplaapi_cache_evictions_total{cache="search"} 1.0\n'
+        'dplaapi_cache_misses_total{cache="mlt"} 1.0\n')
+    assert replay.cache_report(before, after) == {
+        'search': {'hits': 6, 'misses': 2, 'evictions': 1,
+                   'hit_ratio': 0.75},
+        'mlt': {'hits': 0, 'misses': 1, 'evictions': 0, 'hit_ratio': 0.0}
+    }
+
+
+def test_replayer_sends_each_request():
+    # The fake Elasticsearch answers any GET, so it can stand in for the
+    # application here.
+    server = fake_es.start()
+    try:
+        recorded = replay.read_requests([dplaapi_line, clf_line] * 3)
+        replayer = replay.Replayer(server.url, concurrency=2)
+        duration = replayer.run(replay.schedule(recorded, 0))
+    finally:
+        server.shutdown()
+    results = replayer.results(duration)
+    assert results['search']['requests'] == 3
+    assert results['mlt']['requests'] == 3
+    assert results['mlt']['errors'] == 0
@@ -0,0 +1,66 @@
+"""Test dplaapi.queries.compiled"""
+
+import json
+from dplaapi.types import ItemsQueryType
+from dplaapi.queries import compiled
+from dplaapi.queries.search_query import SearchQuery, query_cost
+
+
+def test_compile_search_has_same_query_as_SearchQuery():
+    params = ItemsQueryType({'q': 'railroad', 'facets': 'provider.name',
+                             'page': '3', 'page_size': '20'})
+    cq = compiled.compile_search(params)
+    assert json.loads(cq.body) == SearchQuery(params).query
+    assert cq.cost == query_cost(params)
+
+
+def test_compile_search_reuses_body_for_other_pages(mocker):
+    mocker.spy(compiled, 'SearchQuery')
+    first = compiled.compile_search(ItemsQueryType({'q': 'railroad'}))
+    params = ItemsQueryType({'q': 'railroad', 'page': '2', 'page_size': '5'})
+    second = compiled.compile_search(params)
+    assert compiled.SearchQuery.call_count == 1
+    assert json.loads(second.body) == SearchQuery(params).query
+    assert json.loads(first.body)['from'] == 0
+    assert json.loads(second.body)['from'] == 5
+    assert second.cost == query_cost(params)
+
+
+def test_compile_search_does_not_page_search_by_ids():
+    params = ItemsQueryType({})
+    params.update({'ids': ['a', 'b'], 'page': 2})
+    body = json.loads(compiled.compile_search(params).body)
+    assert body == SearchQuery(params).query
+    assert body['from'] == 0
+    assert body['size'] == 2
+
+
+def test_shape_key_ignores_page_and_order():
+    assert compiled.shape_key({'q': 'x', 'page': 1, 'ids': ['a']}) \
+        == compiled.shape_key({'ids': ['a'], 'page_size': 5, 'q': 'x'})
+
+
+def test_shape_key_ignores_params_that_do_not_change_query():
+    assert compiled.shape_key({'q': 'x', 'api_key': 'a', 'callback': 'f'}) \
+        == compiled.shape_key({'q': 'x'})
+
+
+def test_compile_search_does_not_keep_search_by_ids():
+    params = ItemsQueryType({})
+    params.update({'ids': ['a', 'b']})
+    compiled.compile_search(params)
+    assert compiled.body_cache.currsize == 0
+
+
+def test_with_page_puts_page_in_front():
+    params = {'page': 2, 'page_size': 10}
+    assert json.loads(compiled.with_page('{"a": 1}', params)) \
+        == {'from': 10, 'size': 10, 'a': 1}
+    assert json.loads(compiled.with_page('{}', params)) \
+        == {'from': 10, 'size': 10}
+
+
+def test_compile_search_uses_cost_that_is_given():
+    params = ItemsQueryType({'q': 'railroad', 'page_size': '60'})
+    assert compiled.compile_search(params, 5).cost == 5
+    assert compiled.compile_search(params).cost == query_cost(params)
@@ -1,6 +1,6 @@
 """Test dplaapi.mlt_query"""
 
-from dplaapi.queries.mlt_query import MLTQuery
+from dplaapi.queries.mlt_query import MLTQuery, query_skel
 from dplaapi.types import MLTQueryType
 
 
@@ -64,3 +64,18 @@ def test_MLTQuery_has_source_clause_for_fields_parameter():
     params.update({'ids': ['id1']})
     q = MLTQuery(params)
     assert q.query['_source'] == ['id']
+
+
+def test_MLTQuery_does_not_change_shared_skeleton():
+    """Each MLTQuery has its own "like" clause, and the skeleton that queries
+    share is left as it was"""
+    params = MLTQueryType()
+    params.update({'ids': ['id1']})
+    q1 = MLTQuery(params)
+    params.update({'ids': ['id2']})
+    q2 = MLTQuery(params)
+    assert q1.query['query']['more_like_this']['like'] == [
+        {'_type': 'item', '_id': 'id1'}]
+    assert q2.query['query']['more_like_this']['like'] == [
+        {'_type': 'item', '_id': 'id2'}]
+    assert 'like' not in query_skel['query']['more_like_this']
@@ -320,6 +320,30 @@ def test_facets_for_histogram_for_month_or_year(mocker):
         field, field, 'year', 50)
 
 
+def test_SearchQuery_shares_frozen_fields_clauses():
+    """Queries share the 'fields' of 'query_string' clauses, which can not be
+    changed"""
+    params = types.ItemsQueryType({'q': 'xx',
+                                  'sourceResource.title': 'yy'})
+    clauses = [[c['query_string']['fields']
+                for c in search_query.SearchQuery(params)
+                .query['query']['bool']['must']]
+               for _ in range(2)]
+    assert clauses[0][0] is clauses[1][0]
+    assert clauses[0][1] is clauses[1][1]
+    assert 'sourceResource.title^2' in clauses[0][0]
+    with pytest.raises(TypeError):
+        clauses[0][0].append('x')
+
+
+def test_facets_for_shares_frozen_geo_distance_ranges():
+    f = 'sourceResource.spatial.coordinates:40.941258:-73.864468'
+    ranges = search_query.facets_for(f, 50)['geo_distance']['ranges']
+    assert ranges is search_query.facets_for(f, 50)['geo_distance']['ranges']
+    with pytest.raises(TypeError):
+        ranges[0]['to'] = 1
+
+
 def test_SearchQuery_facets_for_handles_coordinates_field():
     f = 'sourceResource.spatial.coordinates:40.941258:-73.864468'
     ranges = [
@@ -414,3 +438,89 @@ def test_face_size_truncates_facet_size_if_too_large():
     This is not ideal, but it is how the old API has operated.
     """
     assert search_query.facet_size({'facet_size': '2001'}) == 2000
+
+
+def cost_of(params):
+    return search_query.query_cost(types.ItemsQueryType(params))
+
+
+def test_query_cost_of_simple_search_is_1():
+    assert cost_of({}) == 1
+
+
+def test_query_cost_increases_with_page_size_and_depth():
+    assert cost_of({'page_size': '60'}) == 2
+    assert cost_of({'page': '11', 'page_size': '100'}) == 3.8
+
+
+def test_query_cost_increases_with_facets():
+    assert cost_of({'facets': 'provider.name,sourceResource.type',
+                    'facet_size': '500'}) == 4
+    # facet_size is truncated to 2000
+    assert cost_of({'facets': 'provider.name', 'facet_size': '5000'}) == 5.5
+
+
+def test_query_cost_increases_with_geo_sort():
+    assert cost_of({'sort_by': 'sourceResource.spatial.coordinates',
+                    'sort_by_pin': '40,-73'}) == 3
+
+
+def test_query_cost_increases_with_query_string_complexity():
+    assert cost_of({'q': 'cats'}) == 1.5
+    assert cost_of({'sourceResource.title': 'ca*s OR dog~'}) == 3.25
+
+
+def test_SearchQuery_has_cost():
+    params = types.ItemsQueryType({'q': 'cats'})
+    assert search_query.SearchQuery(params).cost == 1.5
+
+
+def test_split_facet_params_separates_records_and_facets():
+    params = types.ItemsQueryType({'q': 'cats', 'page': '2',
+                                   'facets': 'provider.name',
+                                   'facet_size': '5',
+                                   'sort_by': 'id', 'fields': 'id'})
+    hits_params, facets_params = search_query.split_facet_params(params)
+    assert 'facets' not in hits_params
+    assert 'facet_size' not in hits_params
+    assert hits_params['page'] == 2
+    assert facets_params == {'q': 'cats', 'facets': 'provider.name',
+                             'facet_size': '5'}
+
+
+def test_split_facet_params_is_the_same_for_every_page():
+    page_1 = types.ItemsQueryType({'q': 'cats', 'facets': 'provider.name'})
+    page_2 = types.ItemsQueryType({'q': 'cats', 'facets': 'provider.name',
+                                   'page': '2', 'page_size': '50'})
+    assert search_query.split_facet_params(page_1)[1] == \
+        search_query.split_facet_params(page_2)[1]
+
+
+def test_FacetsQuery_has_only_query_and_aggs():
+    params = types.ItemsQueryType({'q': 'cats',
+                                   'filter': ['provider.@id:x'],
+                                   'facets': 'provider.name'})
+    sq = search_query.SearchQuery(params)
+    fq = search_query.FacetsQuery(
+        search_query.split_facet_params(params)[1])
+    assert fq.query == {'query': sq.query['query'], 'size': 0,
+                        'aggs': sq.query['aggs']}
+    assert not fq.paged
+
+
+def test_FacetsQuery_cost_does_not_depend_on_page():
+    params = types.ItemsQueryType({'facets': 'provider.name',
+                                   'facet_size': '500'})
+    fq = search_query.FacetsQuery(
+        search_query.split_facet_params(params)[1])
+    assert fq.cost == 2.5
+
+
+def test_SearchQuery_asks_for_every_ID():
+    """A search by IDs has a 'size' of the number of IDs, which may be more
+    than the default page size"""
+    params = types.ItemsQueryType({})
+    params.update({'ids': ['%032x' % i for i in range(120)]})
+    query = search_query.SearchQuery(params).query
+    assert query['size'] == 120
+    assert len(query['query']['terms']['id']) == 120
@@ -0,0 +1,54 @@
+"""Test dplaapi.admission"""
+
+import pytest
+from dplaapi.admission import AdmissionController, Overloaded
+
+
+def test_AdmissionController_admits_up_to_capacity():
+    controller = AdmissionController(2, retry_after=3)
+    with controller.admit():
+        with controller.admit():
+            assert controller.in_flight == 2
+            with pytest.raises(Overloaded) as e:
+                with controller.admit():
+                    pass
+            assert e.value.retry_after == 3
+    assert controller.in_flight == 0
+
+
+def test_AdmissionController_releases_after_exception():
+    controller = AdmissionController(1)
+    with pytest.raises(ValueError):
+        with controller.admit():
+            raise ValueError()
+    assert controller.in_flight == 0
+
+
+def test_AdmissionController_weighs_searches_by_cost():
+    controller = AdmissionController(4)
+    with controller.admit(3):
+        with pytest.raises(Overloaded):
+            with controller.admit(1.5):
+                pass
+        with controller.admit(1):
+            assert controller.in_flight == 4
+    assert controller.in_flight == 0
+
+
+def test_AdmissionController_admits_costly_search_when_idle():
+    controller = AdmissionController(4)
+    with controller.admit(10):
+        assert controller.in_flight == 4
+        with pytest.raises(Overloaded):
+            with controller.admit(1):
+                pass
+    assert controller.in_flight == 0
+
+
+def test_AdmissionController_rejects_costly_search_when_busy():
+    controller = AdmissionController(4)
+    with controller.admit(0.5):
+        with pytest.raises(Overloaded):
+            with controller.admit(10):
+                pass
+    assert controller.in_flight == 0
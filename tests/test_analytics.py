@@ -126,3 +126,11 @@ async def test_track(monkeypatch, mocker):
     await analytics.track(req, mock_search_results, 'x', 'title')
     analytics.GATracker.__init__.assert_called_once_with(
         mocker.ANY, 'the_tid', req, mock_search_results, 'x', 'title')
+
+
+def test_post_uses_timeout(monkeypatch, mocker):
+    post_stub = mocker.stub()
+    monkeypatch.setattr(requests, 'post', post_stub)
+    analytics.post('https://example.org', 'x')
+    post_stub.assert_called_once_with('https://example.org', data='x',
+                                      timeout=analytics.timeout)
@@ -0,0 +1,143 @@
+"""Test dplaapi.circuit_breaker"""
+
+import time
+from dplaapi import circuit_breaker
+from dplaapi.circuit_breaker import CircuitBreaker
+
+
+def breaker():
+    return CircuitBreaker('test', error_threshold=0.5, slow_call_seconds=1,
+                          min_calls=4, window=30, recovery_timeout=10,
+                          trial_calls=2)
+
+
+def test_CircuitBreaker_starts_closed():
+    b = breaker()
+    assert b.state == circuit_breaker.CLOSED
+    assert b.allow_request()
+
+
+def test_CircuitBreaker_trips_on_error_rate():
+    b = breaker()
+    b.record_success(b.allow_request())
+    b.record_success(b.allow_request())
+    b.record_failure(b.allow_request())
+    assert b.state == circuit_breaker.CLOSED
+    b.record_failure(b.allow_request())
+    assert b.state == circuit_breaker.OPEN
+    assert not b.allow_request()
+
+
+def test_CircuitBreaker_does_not_trip_before_min_calls():
+    b = breaker()
+    b.record_failure(b.allow_request())
+    b.record_failure(b.allow_request())
+    b.record_failure(b.allow_request())
+    assert b.state == circuit_breaker.CLOSED
+
+
+def test_CircuitBreaker_counts_slow_calls_as_failures():
+    b = breaker()
+    for _ in range(4):
+        b.record_success(b.allow_request(), duration=2)
+    assert b.state == circuit_breaker.OPEN
+
+
+def test_CircuitBreaker_forgets_calls_outside_window(monkeypatch):
+    b = breaker()
+    now = time.monotonic()
+    monkeypatch.setattr(time, 'monotonic', lambda: now)
+    b.record_failure(b.allow_request())
+    b.record_failure(b.allow_request())
+    b.record_failure(b.allow_request())
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 31)
+    b.record_failure(b.allow_request())
+    assert b.state == circuit_breaker.CLOSED
+    assert len(b.calls) == 1
+
+
+def test_CircuitBreaker_allows_limited_trial_calls(monkeypatch):
+    b = breaker()
+    b.trip()
+    now = time.monotonic()
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 11)
+    assert b.allow_request()
+    assert b.state == circuit_breaker.HALF_OPEN
+    assert b.allow_request()
+    assert not b.allow_request()
+
+
+def test_CircuitBreaker_closes_after_successful_trials(monkeypatch):
+    b = breaker()
+    b.trip()
+    now = time.monotonic()
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 11)
+    b.record_success(b.allow_request())
+    assert b.state == circuit_breaker.HALF_OPEN
+    b.record_success(b.allow_request())
+    assert b.state == circuit_breaker.CLOSED
+
+
+def test_CircuitBreaker_reopens_after_failed_trial(monkeypatch):
+    b = breaker()
+    b.trip()
+    now = time.monotonic()
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 11)
+    b.record_failure(b.allow_request())
+    assert b.state == circuit_breaker.OPEN
+    assert not b.allow_request()
+
+
+def test_CircuitBreaker_release_frees_trial_without_outcome(monkeypatch):
+    b = breaker()
+    b.trip()
+    now = time.monotonic()
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 11)
+    first = b.allow_request()
+    second = b.allow_request()
+    assert not b.allow_request()
+    # The trial ends with an unexpected exception.
+    b.release(first)
+    b.record_success(second)
+    b.release(second)
+    b.record_success(b.allow_request())
+    assert b.state == circuit_breaker.CLOSED
+
+
+def test_CircuitBreaker_release_after_outcome_does_nothing(monkeypatch):
+    b = breaker()
+    b.trip()
+    now = time.monotonic()
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 11)
+    permit = b.allow_request()
+    b.record_success(permit)
+    b.release(permit)
+    assert b.trials_started == 1
+
+
+def test_CircuitBreaker_ignores_calls_made_before_it_opened(monkeypatch):
+    b = breaker()
+    earlier = [b.allow_request() for _ in range(3)]
+    b.trip()
+    opened_at = b.opened_at
+    # A late failure does not keep the breaker open for longer.
+    b.record_failure(earlier[0])
+    assert b.opened_at == opened_at
+    now = time.monotonic()
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 11)
+    assert b.allow_request().trial_period == b.period
+    # Nor does it count as a trial.
+    b.record_success(earlier[1])
+    b.record_failure(earlier[2])
+    assert b.state == circuit_breaker.HALF_OPEN
+    assert b.trials_succeeded == 0
+
+
+def test_breaker_from_env_reads_settings(monkeypatch):
+    monkeypatch.setenv('ES_BREAKER_ERROR_THRESHOLD', '0.25')
+    monkeypatch.setenv('ES_BREAKER_TRIAL_CALLS', '5')
+    b = circuit_breaker.breaker_from_env('ES_BASE', 'ES')
+    assert b.name == 'ES_BASE'
+    assert b.error_threshold == 0.25
+    assert b.trial_calls == 5
+    assert b.min_calls == 10
@@ -0,0 +1,165 @@
+"""Test dplaapi.db_pool"""
+
+import pytest
+import threading
+from playhouse.postgres_ext import PostgresqlExtDatabase
+from dplaapi import db_pool, metrics, models
+
+
+class MockCursor():
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, sql):
+        if self.conn.broken:
+            raise Exception('server closed the connection unexpectedly')
+
+
+class MockConnection():
+    def __init__(self):
+        self.closed = 0
+        self.broken = False
+
+    def cursor(self):
+        return MockCursor(self)
+
+    def rollback(self):
+        pass
+
+    def get_transaction_status(self):
+        return 0
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture(scope='function')
+def opened(monkeypatch):
+    """Replace the opening of PostgreSQL connections, and the pool metrics
+
+    Yield the list of connections opened.
+    """
+    registry = metrics.Registry()
+    monkeypatch.setattr(metrics, 'db_connections_opened',
+                        metrics.Counter('o_total', 'Opened', ['reason'],
+                                        registry))
+    monkeypatch.setattr(metrics, 'db_checks',
+                        metrics.Counter('c_total', 'Checks', ['outcome'],
+                                        registry))
+    monkeypatch.setattr(metrics, 'db_connections',
+                        metrics.Gauge('d', 'Connections', ['state'],
+                                      registry))
+    conns = []
+
+    def mock_connect(self):
+        conns.append(MockConnection())
+        return conns[-1]
+
+    monkeypatch.setattr(PostgresqlExtDatabase, '_connect', mock_connect)
+    yield conns
+
+
+def test_warm_up_opens_min_connections(opened):
+    pool = db_pool.ManagedPool('x', min_connections=3)
+    pool.warm_up()
+    assert len(opened) == 3
+    assert pool.stats() == {'idle': 3, 'in_use': 0, 'min': 3, 'max': 20}
+    assert metrics.db_connections_opened.values == {('warm_up',): 3}
+
+
+def test_warm_up_counts_connections_in_use(opened):
+    pool = db_pool.ManagedPool('x', min_connections=2)
+    pool.connect()
+    pool.warm_up()
+    assert pool.stats()['idle'] == 1
+    assert pool.stats()['in_use'] == 1
+
+
+def test_warm_up_gives_up_when_connecting_fails(opened, monkeypatch):
+    def failing_connect(self):
+        raise Exception('could not connect to server')
+
+    monkeypatch.setattr(PostgresqlExtDatabase, '_connect', failing_connect)
+    pool = db_pool.ManagedPool('x', min_connections=2)
+    pool.warm_up()
+    assert pool.stats()['idle'] == 0
+
+
+def test_connect_uses_warmed_up_connection(opened):
+    pool = db_pool.ManagedPool('x', min_connections=1)
+    pool.warm_up()
+    pool.connect()
+    assert pool.connection() is opened[0]
+    pool.close()
+    assert metrics.db_connections_opened.values == {('warm_up',): 1}
+
+
+def test_connect_counts_connections_opened_on_demand(opened):
+    pool = db_pool.ManagedPool('x')
+    pool.connect()
+    pool.close()
+    assert metrics.db_connections_opened.values == {('demand',): 1}
+
+
+def test_check_idle_closes_failed_connections(opened):
+    pool = db_pool.ManagedPool('x', min_connections=2)
+    pool.warm_up()
+    opened[0].broken = True
+    pool.check_idle()
+    assert opened[0].closed
+    assert not opened[1].closed
+    assert [c for _, c in pool._connections] == [opened[1]]
+    assert metrics.db_checks.values == {('ok',): 1, ('failed',): 1}
+
+
+def test_check_idle_closes_stale_connections(opened, monkeypatch):
+    pool = db_pool.ManagedPool('x', min_connections=1, stale_timeout=60)
+    pool.warm_up()
+    monkeypatch.setattr(pool, '_is_stale', lambda ts: True)
+    pool.check_idle()
+    assert opened[0].closed
+    assert pool.stats()['idle'] == 0
+    assert metrics.db_checks.values == {}
+
+
+def test_check_idle_skips_connections_in_use(opened):
+    pool = db_pool.ManagedPool('x', min_connections=1)
+    pool.warm_up()
+    pool.connect()
+    opened[0].broken = True
+    pool.check_idle()
+    assert not opened[0].closed
+    assert pool.stats()['in_use'] == 1
+
+
+def test_collect_sets_connection_gauges(opened):
+    pool = db_pool.ManagedPool('x', min_connections=2)
+    pool.warm_up()
+    pool.connect()
+    pool.collect()
+    assert metrics.db_connections.values == {('idle',): 1, ('in_use',): 1}
+
+
+def test_start_starts_one_checker_per_process(opened, monkeypatch):
+    started = []
+    monkeypatch.setattr(threading.Thread, 'start',
+                        lambda self: started.append(self))
+    pool = db_pool.ManagedPool('x', min_connections=1, check_seconds=30)
+    pool.start()
+    pool.start()
+    assert len(opened) == 1
+    assert len(started) == 1
+
+
+def test_start_pool_does_nothing_without_auth(monkeypatch, mocker):
+    monkeypatch.setenv('DISABLE_AUTH', 'true')
+    stub = mocker.stub()
+    monkeypatch.setattr(models.db, 'start', stub)
+    models.start_pool()
+    stub.assert_not_called()
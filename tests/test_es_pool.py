@@ -0,0 +1,108 @@
+"""Test dplaapi.es_pool"""
+
+import time
+import pytest
+import requests
+from dplaapi import es_pool
+from dplaapi.es_pool import EndpointPool
+
+
+class MockResponse():
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+def mock_post_status(status_code):
+    def mock_post(url, **kwargs):
+        return MockResponse(status_code)
+    return mock_post
+
+
+def mock_failing_post(url, **kwargs):
+    raise requests.exceptions.ConnectionError()
+
+
+def test_EndpointPool_rejects_unknown_strategy():
+    with pytest.raises(ValueError):
+        EndpointPool(['a'], strategy='random')
+
+
+def test_EndpointPool_chooses_round_robin():
+    pool = EndpointPool(['a', 'b', 'c'])
+    chosen = [pool.choose().url for _ in range(6)]
+    assert sorted(chosen) == ['a', 'a', 'b', 'b', 'c', 'c']
+
+
+def test_EndpointPool_chooses_least_outstanding():
+    pool = EndpointPool(['a', 'b', 'c'],
+                        strategy=es_pool.LEAST_OUTSTANDING)
+    pool.endpoints[0].outstanding = 2
+    pool.endpoints[1].outstanding = 1
+    pool.endpoints[2].outstanding = 3
+    assert pool.choose().url == 'b'
+
+
+def test_EndpointPool_ejects_after_consecutive_failures(monkeypatch):
+    pool = EndpointPool(['a', 'b'], max_failures=2, ejection_seconds=30)
+    a = pool.endpoints[0]
+    pool.record(a, False)
+    pool.record(a, True)
+    pool.record(a, False)
+    assert not a.is_ejected(time.monotonic())
+    pool.record(a, False)
+    assert a.is_ejected(time.monotonic())
+    assert {pool.choose().url for _ in range(4)} == {'b'}
+    now = time.monotonic()
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 31)
+    assert {pool.choose().url for _ in range(4)} == {'a', 'b'}
+
+
+def test_EndpointPool_chooses_ejected_endpoint_if_all_are_ejected():
+    pool = EndpointPool(['a', 'b'])
+    pool.endpoints[0].ejected_until = time.monotonic() + 20
+    pool.endpoints[1].ejected_until = time.monotonic() + 10
+    assert pool.choose().url == 'b'
+    assert pool.choose(exclude=pool.endpoints[0]) is None
+
+
+def test_EndpointPool_choose_excludes_endpoint():
+    pool = EndpointPool(['a', 'b'])
+    a = pool.endpoints[0]
+    assert {pool.choose(exclude=a).url for _ in range(4)} == {'b'}
+
+
+def test_EndpointPool_post_records_server_errors(monkeypatch):
+    pool = EndpointPool(['a'])
+    monkeypatch.setattr(requests, 'post', mock_post_status(503))
+    pool.post('/_search')
+    assert pool.endpoints[0].failures == 1
+    monkeypatch.setattr(requests, 'post', mock_post_status(400))
+    pool.post('/_search')
+    assert pool.endpoints[0].failures == 0
+    assert pool.endpoints[0].outstanding == 0
+
+
+def test_EndpointPool_post_records_connection_errors(monkeypatch):
+    pool = EndpointPool(['a'])
+    monkeypatch.setattr(requests, 'post', mock_failing_post)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        pool.post('/_search')
+    assert pool.endpoints[0].failures == 1
+    assert pool.endpoints[0].outstanding == 0
+
+
+def test_EndpointPool_post_uses_given_endpoint(monkeypatch, mocker):
+    pool = EndpointPool(['a', 'b'])
+    post_stub = mocker.Mock(return_value=MockResponse(200))
+    monkeypatch.setattr(requests, 'post', post_stub)
+    pool.post('/_search', endpoint=pool.endpoints[1], json={})
+    post_stub.assert_called_once_with('b/_search', json={})
+
+
+def test_pool_from_env_reads_settings(monkeypatch):
+    monkeypatch.setenv('ES_BALANCE', 'least_outstanding')
+    monkeypatch.setenv('ES_EJECT_SECONDS', '5')
+    pool = es_pool.pool_from_env(['a', 'b'])
+    assert pool.strategy == es_pool.LEAST_OUTSTANDING
+    assert pool.ejection_seconds == 5
+    assert len(pool) == 2
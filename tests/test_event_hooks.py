@@ -0,0 +1,90 @@
+"""Test dplaapi.event_hooks"""
+
+import json
+import asyncio
+import logging
+import pytest
+import requests
+from collections import OrderedDict
+from starlette.testclient import TestClient
+from dplaapi import app, event_hooks
+from dplaapi.event_hooks import phase
+
+
+client = TestClient(app,
+                    base_url='http://localhost',
+                    raise_server_exceptions=False)
+
+
+def test_phase_does_nothing_outside_of_a_request():
+    with phase('x'):
+        pass
+    assert len(event_hooks.timings) == 0
+
+
+@pytest.mark.asyncio
+async def test_phase_adds_up_time_for_the_current_task():
+    request_timings = OrderedDict()
+    event_hooks.timings[asyncio.Task.current_task()] = request_timings
+
+    @phase('b')
+    def decorated():
+        pass
+
+    with phase('a'):
+        pass
+    decorated()
+    decorated()
+    assert list(request_timings.keys()) == ['a', 'b']
+    assert request_timings['b'] >= 0
+
+
+def test_server_timing():
+    header = event_hooks.server_timing(
+        OrderedDict([('auth', 0.0012), ('backend', 0.1)]), 0.2)
+    assert header == 'auth;dur=1.20, backend;dur=100.00, total;dur=200.00'
+
+
+def test_loggable_query_removes_api_key():
+    assert event_hooks.loggable_query(b'q=cats&api_key=abc&page=2') \
+        == 'q=cats&page=2'
+
+
+def test_TimingMiddleware_adds_header_and_logs(monkeypatch, caplog):
+    monkeypatch.setenv('DISABLE_AUTH', 'true')
+    caplog.set_level(logging.INFO, logger='dplaapi.access')
+    response = client.get('/v2/items/not-an-id?api_key=x')
+    timing = response.headers['server-timing']
+    assert timing.startswith('auth;dur=')
+    assert 'validation;dur=' in timing
+    assert 'total;dur=' in timing
+    entry = json.loads(caplog.records[-1].getMessage())
+    assert entry['path'] == '/v2/items/not-an-id'
+    assert entry['query'] == ''
+    assert entry['route'] == 'specific_item'
+    assert entry['status'] == 400
+    assert list(entry['phases_ms'].keys()) == ['auth', 'validation']
+
+
+class MockESResponse():
+    status_code = 200
+    content = b'{}'
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {'timed_out': False,
+                'hits': {'total': {'value': 1},
+                         'hits': [{'_source': {'id': 'x'}}]}}
+
+
+def test_TimingMiddleware_times_phases_of_random(monkeypatch):
+    monkeypatch.setenv('DISABLE_AUTH', 'true')
+    monkeypatch.setattr(requests, 'post',
+                        lambda url, **kwargs: MockESResponse())
+    response = client.get('/v2/random')
+    assert response.status_code == 200
+    timing = response.headers['server-timing']
+    assert 'query;dur=' in timing
+    assert 'backend;dur=' in timing
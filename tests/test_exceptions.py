@@ -3,6 +3,8 @@ import pytest
 from dplaapi import app
 import dplaapi.handlers.v2 as v2_handlers
 from dplaapi.types import ItemsQueryType
+from dplaapi.admission import Overloaded
+from dplaapi.rate_limit import RateLimited
 from apistar.exceptions import ValidationError
 from starlette.testclient import TestClient
 
@@ -60,3 +62,32 @@ def test_thrown_http_errors_are_handled_correctly(monkeypatch):
     assert response.status_code == 404
     assert response.headers['content-type'] == ok_content_type
     assert response.json() == 'Not Found'
+
+
+def mock_overloaded(*args, **kwargs):
+    raise Overloaded(2)
+
+
+@pytest.mark.usefixtures('disable_auth')
+def test_overloaded_errors_are_handled_correctly(monkeypatch):
+    monkeypatch.setattr(v2_handlers, 'search_items', mock_overloaded)
+    response = client.get('/v2/items')
+    assert response.status_code == 503
+    assert response.headers['content-type'] == ok_content_type
+    assert response.headers['retry-after'] == '2'
+    assert response.json() == 'Service overloaded'
+
+
+def mock_rate_limited(*args, **kwargs):
+    raise RateLimited({'X-RateLimit-Remaining': '0', 'Retry-After': '3'})
+
+
+@pytest.mark.usefixtures('disable_auth')
+def test_rate_limited_errors_are_handled_correctly(monkeypatch):
+    monkeypatch.setattr(v2_handlers, 'search_items', mock_rate_limited)
+    response = client.get('/v2/items')
+    assert response.status_code == 429
+    assert response.headers['content-type'] == ok_content_type
+    assert response.headers['x-ratelimit-remaining'] == '0'
+    assert response.headers['retry-after'] == '3'
+    assert response.json() == 'Rate limit exceeded'
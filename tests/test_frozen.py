@@ -0,0 +1,97 @@
+"""Test dplaapi.frozen"""
+
+import copy
+import json
+import pickle
+import pytest
+from dplaapi.frozen import freeze, set_in, FrozenDict, FrozenList
+
+
+def test_freeze_freezes_nested_dicts_and_lists():
+    frozen = freeze({'a': [{'b': 1}], 'c': (2, 3)})
+    assert isinstance(frozen, FrozenDict)
+    assert isinstance(frozen['a'], FrozenList)
+    assert isinstance(frozen['a'][0], FrozenDict)
+    assert isinstance(frozen['c'], FrozenList)
+    assert frozen == {'a': [{'b': 1}], 'c': [2, 3]}
+
+
+@pytest.mark.parametrize('change', [
+    lambda d: d.__setitem__('a', 1),
+    lambda d: d.__delitem__('a'),
+    lambda d: d.update(b=2),
+    lambda d: d.setdefault('b', 2),
+    lambda d: d.pop('a'),
+    lambda d: d.popitem(),
+    lambda d: d.clear()
+])
+def test_FrozenDict_can_not_be_changed(change):
+    d = freeze({'a': 0})
+    with pytest.raises(TypeError):
+        change(d)
+    assert d == {'a': 0}
+
+
+@pytest.mark.parametrize('change', [
+    lambda x: x.__setitem__(0, 1),
+    lambda x: x.__delitem__(0),
+    lambda x: x.append(1),
+    lambda x: x.extend([1]),
+    lambda x: x.insert(0, 1),
+    lambda x: x.pop(),
+    lambda x: x.remove(0),
+    lambda x: x.reverse(),
+    lambda x: x.sort(),
+    lambda x: x.clear()
+])
+def test_FrozenList_can_not_be_changed(change):
+    x = freeze([0, 2])
+    with pytest.raises(TypeError):
+        change(x)
+    assert x == [0, 2]
+
+
+def test_FrozenList_can_not_be_changed_in_place():
+    x = freeze([0])
+    with pytest.raises(TypeError):
+        x += [1]
+    assert x == [0]
+
+
+def test_frozen_values_are_serialized_as_json():
+    frozen = freeze({'a': [1, {'b': None}]})
+    assert json.dumps(frozen) == '{"a": [1, {"b": null}]}'
+
+
+def test_frozen_values_are_copied_as_themselves():
+    frozen = freeze({'a': [1]})
+    assert copy.copy(frozen) is frozen
+    assert copy.deepcopy({'x': frozen})['x'] is frozen
+
+
+def test_dict_copy_of_FrozenDict_is_mutable():
+    d = freeze({'a': [1]}).copy()
+    d['b'] = 2
+    assert type(d) is dict
+
+
+def test_frozen_values_can_be_pickled():
+    frozen = freeze({'a': [1]})
+    unpickled = pickle.loads(pickle.dumps(frozen))
+    assert unpickled == frozen
+    assert isinstance(unpickled['a'], FrozenList)
+
+
+def test_set_in_copies_only_the_path():
+    template = freeze({'a': {'b': {'c': 1}, 'd': [1]}, 'e': [2]})
+    result = set_in(template, ('a', 'b', 'f'), [3])
+    assert result == {'a': {'b': {'c': 1, 'f': [3]}, 'd': [1]}, 'e': [2]}
+    assert type(result) is dict
+    assert type(result['a']['b']) is dict
+    assert result['e'] is template['e']
+    assert result['a']['d'] is template['a']['d']
+    assert template == {'a': {'b': {'c': 1}, 'd': [1]}, 'e': [2]}
+
+
+def test_set_in_adds_missing_dicts():
+    assert set_in(freeze({}), ('a', 'b'), 1) == {'a': {'b': 1}}
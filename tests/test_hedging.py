@@ -0,0 +1,172 @@
+"""Test dplaapi.hedging"""
+
+import time
+from concurrent import futures
+import pytest
+import requests
+from dplaapi import hedging
+from dplaapi.es_pool import EndpointPool
+
+
+class MockResponse():
+    def __init__(self, url):
+        self.url = url
+        self.closed = False
+        self.status_code = 200
+
+    def close(self):
+        self.closed = True
+
+
+def slow_post_to(slow_url, seconds):
+    """Return a mock `requests.post()' that is slow for one URL"""
+    def mock_post(url, **kwargs):
+        if url == slow_url:
+            time.sleep(seconds)
+        return MockResponse(url)
+    return mock_post
+
+
+def test_LatencyTracker_uses_initial_delay_without_enough_samples():
+    tracker = hedging.LatencyTracker(min_samples=3, initial_delay=0.5)
+    tracker.record(0.1)
+    assert tracker.delay() == 0.5
+
+
+def test_LatencyTracker_uses_percentile_of_samples():
+    tracker = hedging.LatencyTracker(percentile=90, min_samples=10,
+                                     min_delay=0)
+    for i in range(1, 101):
+        tracker.record(i / 100)
+    assert tracker.delay() == 0.91
+
+
+def test_LatencyTracker_observes_min_delay():
+    tracker = hedging.LatencyTracker(min_samples=1, min_delay=0.05)
+    tracker.record(0.001)
+    assert tracker.delay() == 0.05
+
+
+def slow_call(url, seconds):
+    def call():
+        time.sleep(seconds)
+        return MockResponse(url)
+    return call
+
+
+def hedge_with(call):
+    return lambda: hedging.executor.submit(call)
+
+
+def test_hedged_call_does_not_hedge_fast_request(mocker):
+    second = mocker.stub()
+    resp = hedging.hedged_call(slow_call('a', 0), second, 0.5)
+    assert resp.url == 'a'
+    second.assert_not_called()
+
+
+def test_hedged_call_returns_first_response():
+    resp = hedging.hedged_call(slow_call('a', 0.5),
+                               hedge_with(slow_call('b', 0)),
+                               0.01)
+    assert resp.url == 'b'
+
+
+def test_hedged_call_waits_if_there_is_no_hedge():
+    resp = hedging.hedged_call(slow_call('a', 0.05), lambda: None, 0.01)
+    assert resp.url == 'a'
+
+
+def test_hedged_call_uses_other_response_if_first_fails():
+    def failing_call():
+        raise requests.exceptions.ConnectionError()
+
+    resp = hedging.hedged_call(slow_call('a', 0.1), hedge_with(failing_call),
+                               0.01)
+    assert resp.url == 'a'
+
+
+def test_hedged_call_raises_if_both_fail():
+    def failing_call():
+        time.sleep(0.05)
+        raise requests.exceptions.ConnectionError()
+
+    with pytest.raises(requests.exceptions.ConnectionError):
+        hedging.hedged_call(failing_call, hedge_with(failing_call), 0.01)
+
+
+def test_hedged_call_uses_response_that_completes_with_a_failure(
+        monkeypatch):
+    """If both calls are done when they are waited for, and one failed, the
+    other's response is returned"""
+    def failing_call():
+        time.sleep(0.05)
+        raise requests.exceptions.ConnectionError()
+
+    # Wait for both, so that they are done together.
+    monkeypatch.setattr(hedging, 'wait',
+                        lambda fs, return_when: futures.wait(fs))
+    for first, second in [(failing_call, slow_call('b', 0.05)),
+                          (slow_call('a', 0.05), failing_call)]:
+        resp = hedging.hedged_call(first, hedge_with(second), 0.01)
+        assert resp.url in ('a', 'b')
+
+
+def test_abandon_closes_late_response():
+    future = hedging.executor.submit(slow_call('a', 0.1))
+    time.sleep(0.01)
+    hedging.abandon(future)
+    resp = future.result()
+    # The callback that closes the response may run just after the result
+    # is set.
+    for _ in range(100):
+        if resp.closed:
+            break
+        time.sleep(0.01)
+    assert resp.closed
+
+
+def test_Hedger_post_hedges_with_another_endpoint(monkeypatch):
+    monkeypatch.setattr(requests, 'post', slow_post_to('a/_search', 0.5))
+    tracker = hedging.LatencyTracker(initial_delay=0.01)
+    pool = EndpointPool(['a', 'b'])
+    monkeypatch.setattr(pool, 'choose', lambda exclude=None:
+                        pool.endpoints[1 if exclude else 0])
+    resp = hedging.Hedger(pool, tracker).post('/_search', json={})
+    assert resp.url == 'b/_search'
+    # The first request's own response time is recorded when it arrives.
+    for _ in range(100):
+        if tracker.samples:
+            break
+        time.sleep(0.01)
+    assert tracker.samples[0] >= 0.5
+
+
+def test_Hedger_post_caps_fraction_of_requests_hedged(monkeypatch):
+    monkeypatch.setattr(requests, 'post', slow_post_to('a/_search', 0.05))
+    tracker = hedging.LatencyTracker(initial_delay=0.01)
+    pool = EndpointPool(['a', 'b'])
+    monkeypatch.setattr(pool, 'choose', lambda exclude=None:
+                        pool.endpoints[1 if exclude else 0])
+    hedger = hedging.Hedger(pool, tracker, max_fraction=0.25)
+    urls = [hedger.post('/_search', json={}).url for _ in range(8)]
+    assert urls.count('b/_search') == 2
+    assert hedger.hedged == 2
+
+
+def test_Hedger_post_makes_request_in_calling_thread_if_it_can_not_hedge(
+        monkeypatch, mocker):
+    monkeypatch.setattr(requests, 'post', slow_post_to('a/_search', 0))
+    mocker.spy(hedging.executor, 'submit')
+    pool = EndpointPool(['a', 'b'])
+    hedger = hedging.Hedger(pool, hedging.LatencyTracker(), max_fraction=0)
+    hedger.post('/_search', json={})
+    hedging.executor.submit.assert_not_called()
+
+
+def test_hedger_from_env_requires_ES_HEDGE(monkeypatch):
+    assert hedging.hedger_from_env(EndpointPool(['a', 'b'])) is None
+    monkeypatch.setenv('ES_HEDGE', 'true')
+    assert hedging.hedger_from_env(EndpointPool(['a'])) is None
+    assert isinstance(hedging.hedger_from_env(EndpointPool(['a', 'b'])),
+                      hedging.Hedger)
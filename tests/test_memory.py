@@ -0,0 +1,112 @@
+"""Test dplaapi.memory"""
+
+import sys
+import asyncio
+import tracemalloc
+import pytest
+from starlette.testclient import TestClient
+from dplaapi import app, memory, metrics
+
+
+client = TestClient(app,
+                    base_url='http://localhost',
+                    raise_server_exceptions=False)
+
+
+@pytest.fixture
+def tracing(monkeypatch):
+    monkeypatch.setattr(memory, 'enabled', True)
+    monkeypatch.setattr(memory, 'cache_peaks', {})
+    was_tracing = tracemalloc.is_tracing()
+    tracemalloc.start()
+    yield
+    if not was_tracing:
+        tracemalloc.stop()
+
+
+def test_deep_size_counts_contents_once():
+    s = 'x' * 1000
+    assert memory.deep_size([s, s]) == sys.getsizeof([s, s]) \
+        + sys.getsizeof(s)
+    d = {'a': [1]}
+    assert memory.deep_size(d) == sys.getsizeof(d) + sys.getsizeof('a') \
+        + sys.getsizeof([1]) + sys.getsizeof(1)
+
+
+def test_cache_size_does_not_count_lookups(monkeypatch):
+    registry = metrics.Registry()
+    monkeypatch.setattr(metrics, 'cache_hits',
+                        metrics.Counter('h', 'h', ['cache'], registry))
+    cache = metrics.MeteredTTLCache('test', maxsize=10, ttl=60)
+    cache['a'] = 'x' * 1000
+    assert memory.cache_size(cache) == sys.getsizeof('x' * 1000)
+    assert metrics.cache_hits.values == {}
+
+
+def test_cache_stats_estimates_size_and_peak(tracing):
+    cache = metrics.MeteredTTLCache('test_stats', maxsize=10, ttl=60)
+    cache['a'] = 'x' * 10000
+    stats = memory.cache_stats()['test_stats']
+    assert stats['entries'] == 1
+    assert stats['maxsize'] == 10
+    assert stats['bytes'] > 10000
+    del cache['a']
+    stats = memory.cache_stats()['test_stats']
+    assert stats['bytes'] == 0
+    assert stats['peak_bytes'] > 10000
+
+
+def test_cache_stats_has_no_sizes_unless_enabled(monkeypatch):
+    monkeypatch.setattr(memory, 'enabled', False)
+    cache = metrics.MeteredTTLCache('test_disabled', maxsize=10, ttl=60)
+    cache['a'] = 1
+    assert memory.cache_stats()['test_disabled'] == \
+        {'entries': 1, 'maxsize': 10, 'ttl': 60}
+
+
+def test_collect_sets_gauges(tracing):
+    cache = metrics.MeteredTTLCache('test_collect', maxsize=10, ttl=60)
+    cache['a'] = 'x' * 100
+    memory.collect()
+    assert metrics.cache_entries.values[('test_collect',)] == 1
+    assert metrics.cache_bytes.values[('test_collect',)] > 100
+    assert metrics.resident_bytes.values[()] > 0
+
+
+def test_checkpoint_records_peak_of_current_request(tracing):
+    async def request():
+        task = asyncio.Task.current_task()
+        allocated = tracemalloc.get_traced_memory()[0]
+        memory.usage[task] = [allocated, allocated]
+        big = [0] * 1000000
+        memory.checkpoint()
+        del big
+        memory.checkpoint()
+        start, peak = memory.usage.pop(task)
+        return peak - start
+
+    loop = asyncio.new_event_loop()
+    try:
+        assert loop.run_until_complete(request()) >= 8000000
+    finally:
+        loop.close()
+
+
+def test_MemoryMiddleware_observes_request_peak(monkeypatch, tracing):
+    monkeypatch.setenv('DISABLE_AUTH', 'true')
+    registry = metrics.Registry()
+    hist = metrics.Histogram('h', 'A histogram', ['route'], registry)
+    monkeypatch.setattr(metrics, 'request_peak_bytes', hist)
+    client.get('/v2/items/not-an-id')
+    assert hist.values[('specific_item',)]['count'] == 1
+    assert memory.usage == {}
+
+
+def test_top_allocations(tracing):
+    allocations, snapshot = memory.top_allocations(5)
+    assert len(allocations) == 5
+    assert set(allocations[0]) == {'location', 'bytes', 'count'}
+    data = ['y' * 100 for _ in range(10000)]  # noqa: F841
+    allocations, _ = memory.top_allocations(1, snapshot)
+    assert 'test_memory.py:' in allocations[0]['location']
+    assert allocations[0]['bytes_diff'] > 1000000
@@ -0,0 +1,138 @@
+"""Test dplaapi.metrics"""
+
+import os
+import json
+import pytest
+from starlette.testclient import TestClient
+from dplaapi import app, metrics, models
+from dplaapi.handlers import v2 as v2_handlers
+
+
+client = TestClient(app,
+                    base_url='http://localhost',
+                    raise_server_exceptions=False)
+
+
+def test_Counter_exposition():
+    registry = metrics.Registry()
+    counter = metrics.Counter('c_total', 'A counter', ['x'], registry)
+    counter.inc(x='a')
+    counter.inc(2, x='a')
+    counter.inc(x='b"')
+    assert registry.exposition() == (
+        '# HELP c_total A counter\n'
+        '# TYPE c_total counter\n'
+        'c_total{x="a"} 3.0\n'
+        'c_total{x="b\\""} 1.0\n')
+
+
+def test_Gauge_inc_dec_and_set():
+    registry = metrics.Registry()
+    gauge = metrics.Gauge('g', 'A gauge', registry=registry)
+    gauge.inc()
+    gauge.inc()
+    gauge.dec()
+    assert gauge.values[()] == 1
+    gauge.set(5)
+    assert gauge.values[()] == 5
+
+
+def test_Histogram_exposition_is_cumulative():
+    registry = metrics.Registry()
+    hist = metrics.Histogram('h', 'A histogram', registry=registry,
+                             buckets=(1, 2))
+    for value in [0.5, 1.5, 1.7, 3]:
+        hist.observe(value)
+    assert registry.exposition().splitlines()[2:] == [
+        'h_bucket{le="1.0"} 1.0',
+        'h_bucket{le="2.0"} 3.0',
+        'h_bucket{le="+Inf"} 4.0',
+        'h_sum 6.7',
+        'h_count 4.0']
+
+
+def test_Histogram_time_observes_duration():
+    registry = metrics.Registry()
+    hist = metrics.Histogram('h', 'A histogram', ['x'], registry)
+    with hist.time(x='a'):
+        pass
+    assert hist.values[('a',)]['count'] == 1
+
+
+def test_Registry_adds_up_snapshots_of_workers(tmpdir):
+    registry = metrics.Registry(str(tmpdir))
+    counter = metrics.Counter('c_total', 'A counter', registry=registry)
+    gauge = metrics.Gauge('g', 'A gauge', registry=registry)
+    counter.inc()
+    gauge.set(1)
+    # A worker that is running, as the parent process is
+    other = {'c_total': [[[], 2]], 'g': [[[], 7]]}
+    tmpdir.join('%d.json' % os.getppid()).write(json.dumps(other))
+    # A worker that has exited; there is no process 4194305 on Linux.
+    exited = {'c_total': [[[], 100]], 'g': [[[], 100]]}
+    tmpdir.join('4194305.json').write(json.dumps(exited))
+    lines = registry.exposition().splitlines()
+    assert 'c_total 3.0' in lines
+    assert 'g 8.0' in lines
+    assert tmpdir.join('%d.json' % os.getpid()).check()
+
+
+def test_MeteredTTLCache_counts_hits_misses_and_evictions(monkeypatch):
+    registry = metrics.Registry()
+    for name in ['cache_hits', 'cache_misses', 'cache_evictions']:
+        monkeypatch.setattr(metrics, name,
+                            metrics.Counter(name, name, ['cache'], registry))
+    cache = metrics.MeteredTTLCache('test', maxsize=1, ttl=60)
+    cache['a'] = 1
+    assert cache['a'] == 1
+    with pytest.raises(KeyError):
+        cache['b']
+    cache['b'] = 2
+    assert metrics.cache_hits.values == {('test',): 1}
+    assert metrics.cache_misses.values == {('test',): 1}
+    assert metrics.cache_evictions.values == {('test',): 1}
+
+
+def test_MeteredLRUCache_counts_hits_misses_and_evictions(monkeypatch):
+    registry = metrics.Registry()
+    for name in ['cache_hits', 'cache_misses', 'cache_evictions']:
+        monkeypatch.setattr(metrics, name,
+                            metrics.Counter(name, name, ['cache'], registry))
+    cache = metrics.MeteredLRUCache('test', maxsize=1)
+    cache['a'] = 1
+    assert cache['a'] == 1
+    with pytest.raises(KeyError):
+        cache['b']
+    cache['b'] = 2
+    assert metrics.cache_hits.values == {('test',): 1}
+    assert metrics.cache_misses.values == {('test',): 1}
+    assert metrics.cache_evictions.values == {('test',): 1}
+    assert cache.unmetered_values() == [2]
+
+
+def test_MetricsMiddleware_records_route_and_status(monkeypatch):
+    monkeypatch.setenv('DISABLE_AUTH', 'true')
+    registry = metrics.Registry()
+    hist = metrics.Histogram('h', 'A histogram', ['route', 'method', 'status'],
+                             registry)
+    monkeypatch.setattr(metrics, 'request_seconds', hist)
+    client.get('/v2/items/not-an-id')
+    assert hist.values[('specific_item', 'GET', '400')]['count'] == 1
+    assert metrics.requests_in_flight.values[()] == 0
+
+
+def test_metrics_route_returns_exposition(monkeypatch):
+    monkeypatch.setenv('DISABLE_AUTH', 'true')
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.headers['content-type'] \
+        == 'text/plain; version=0.0.4; charset=utf-8'
+    assert '# TYPE dplaapi_request_seconds histogram' in response.text
+
+
+def test_metrics_route_requires_staff_key(monkeypatch):
+    monkeypatch.setattr(v2_handlers, 'account_from_params',
+                        lambda params: models.Account(key='a1b2c3',
+                                                      staff=False))
+    response = client.get('/metrics')
+    assert response.status_code == 403
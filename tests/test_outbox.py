@@ -0,0 +1,113 @@
+"""Test dplaapi.outbox"""
+
+import os
+import pytest
+import threading
+from dplaapi import metrics, outbox
+
+
+@pytest.fixture(scope='function')
+def emails(monkeypatch):
+    registry = metrics.Registry()
+    counter = metrics.Counter('e_total', 'Emails', ['outcome'], registry)
+    monkeypatch.setattr(metrics, 'emails', counter)
+    monkeypatch.setattr(metrics, 'outbox_pending',
+                        metrics.Gauge('p', 'Pending', registry=registry))
+    yield counter
+
+
+def failing_deliver(failures):
+    """Return a deliver function that fails `failures' times, and a list of
+    the messages that it has sent"""
+    sent = []
+    calls = []
+
+    def deliver(message, destination):
+        calls.append(message)
+        if len(calls) <= failures:
+            raise Exception('Could not send')
+        sent.append((message, destination))
+
+    return deliver, sent
+
+
+def test_Outbox_sends_messages_in_the_background(emails):
+    deliver, sent = failing_deliver(0)
+    box = outbox.Outbox(deliver)
+    box.send('hello', 'x@example.com')
+    assert box.flush(5)
+    assert sent == [('hello', 'x@example.com')]
+    assert emails.values == {('sent',): 1}
+    assert metrics.outbox_pending.values[()] == 0
+
+
+def test_Outbox_retries_failed_messages(emails):
+    deliver, sent = failing_deliver(2)
+    box = outbox.Outbox(deliver, retry_seconds=0.01)
+    box.send('hello', 'x@example.com')
+    assert box.flush(5)
+    assert sent == [('hello', 'x@example.com')]
+    assert emails.values == {('retried',): 2, ('sent',): 1}
+
+
+def test_Outbox_gives_up_after_max_attempts(emails):
+    deliver, sent = failing_deliver(10)
+    box = outbox.Outbox(deliver, max_attempts=3, retry_seconds=0.01)
+    box.send('hello', 'x@example.com')
+    assert box.flush(5)
+    assert sent == []
+    assert emails.values == {('retried',): 2, ('failed',): 1}
+
+
+def test_Outbox_raises_OutboxFull_when_full(emails):
+    release = threading.Event()
+
+    def deliver(message, destination):
+        release.wait(5)
+
+    box = outbox.Outbox(deliver, maxsize=2)
+    box.send('one', 'x@example.com')
+    box.send('two', 'x@example.com')
+    with pytest.raises(outbox.OutboxFull):
+        box.send('three', 'x@example.com')
+    release.set()
+    assert box.flush(5)
+
+
+def test_Outbox_flush_returns_False_on_timeout(emails):
+    release = threading.Event()
+
+    def deliver(message, destination):
+        release.wait(5)
+
+    box = outbox.Outbox(deliver)
+    box.send('hello', 'x@example.com')
+    assert not box.flush(0.05)
+    release.set()
+    assert box.flush(5)
+
+
+def test_Outbox_starts_a_worker_in_a_new_process(emails, monkeypatch):
+    deliver, sent = failing_deliver(0)
+    box = outbox.Outbox(deliver)
+    box.send('one', 'x@example.com')
+    assert box.flush(5)
+    # As in a forked worker, where the parent's thread does not exist
+    monkeypatch.setattr(os, 'getpid', lambda: -1)
+    box.send('two', 'x@example.com')
+    assert box.worker_pid == -1
+    assert box.flush(5)
+    assert [m for m, d in sent] == ['one', 'two']
+
+
+def test_outbox_from_env_reads_settings(monkeypatch):
+    monkeypatch.setenv('OUTBOX_SIZE', '10')
+    monkeypatch.setenv('OUTBOX_MAX_ATTEMPTS', '2')
+    monkeypatch.setenv('OUTBOX_RETRY_SECONDS', '0.5')
+    monkeypatch.setenv('OUTBOX_SHUTDOWN_SECONDS', '3')
+    box = outbox.outbox_from_env(print)
+    assert box.deliver is print
+    assert box.maxsize == 10
+    assert box.max_attempts == 2
+    assert box.retry_seconds == 0.5
+    assert box.shutdown_seconds == 3
@@ -0,0 +1,88 @@
+"""Test dplaapi.preload"""
+
+import gc
+import os
+import random
+import runpy
+import pytest
+from dplaapi import preload, metrics, models
+from dplaapi.handlers import v2 as v2_handlers
+
+
+def test_warm_up_does_not_call_backends(monkeypatch, mocker):
+    monkeypatch.setattr(v2_handlers, 'items', mocker.stub())
+    preload.warm_up()
+    v2_handlers.items.assert_not_called()
+
+
+def test_freeze_uses_gc_freeze_if_available(monkeypatch, mocker):
+    monkeypatch.setattr(gc, 'freeze', mocker.stub(), raising=False)
+    monkeypatch.setattr(gc, 'get_freeze_count', lambda: 1, raising=False)
+    preload.freeze()
+    gc.freeze.assert_called_once_with()
+
+
+def test_freeze_collects_without_gc_freeze(monkeypatch, mocker):
+    monkeypatch.delattr(gc, 'freeze', raising=False)
+    collect = mocker.patch('gc.collect')
+    preload.freeze()
+    collect.assert_called_once_with()
+
+
+def test_after_fork_resets_per_process_state(monkeypatch, mocker):
+    monkeypatch.setattr(models.db, 'close_all', mocker.stub())
+    registry = metrics.Registry()
+    counter = metrics.Counter('c', 'A counter', registry=registry)
+    counter.inc()
+    monkeypatch.setattr(metrics, 'registry', registry)
+    v2_handlers.es_pool()
+    random.seed(1)
+
+    preload.after_fork()
+
+    assert random.random() != random.Random(1).random()
+    models.db.close_all.assert_called_with()
+    assert counter.values == {}
+    assert v2_handlers.es_pool.cache_info().currsize == 0
+
+
+@pytest.fixture
+def gunicorn_conf(monkeypatch):
+    monkeypatch.setenv('WEB_CONCURRENCY', '3')
+    path = os.path.join(os.path.dirname(__file__), '..', 'gunicorn.conf.py')
+    return lambda: runpy.run_path(path)
+
+
+def test_gunicorn_conf_preloads_app(gunicorn_conf, monkeypatch, mocker):
+    monkeypatch.delenv('PRELOAD_APP', raising=False)
+    conf = gunicorn_conf()
+    assert conf['workers'] == 3
+    assert conf['preload_app'] is True
+    monkeypatch.setattr(preload, 'before_fork', mocker.stub())
+    monkeypatch.setattr(preload, 'after_fork', mocker.stub())
+    conf['when_ready'](None)
+    conf['post_fork'](None, None)
+    preload.before_fork.assert_called_once_with()
+    preload.after_fork.assert_called_once_with()
+
+
+def test_gunicorn_conf_can_disable_preloading(gunicorn_conf, monkeypatch,
+                                              mocker):
+    monkeypatch.setenv('PRELOAD_APP', 'false')
+    conf = gunicorn_conf()
+    assert conf['preload_app'] is False
+    monkeypatch.setattr(preload, 'after_fork', mocker.stub())
+    conf['post_fork'](None, None)
+    preload.after_fork.assert_not_called()
+
+
+def test_gunicorn_conf_removes_metrics_of_exited_worker(gunicorn_conf,
+                                                        monkeypatch, mocker,
+                                                        tmpdir):
+    monkeypatch.setenv('METRICS_DIR', str(tmpdir))
+    registry = metrics.Registry(str(tmpdir))
+    registry.write_snapshot()
+    conf = gunicorn_conf()
+    conf['child_exit'](None, mocker.Mock(pid=os.getpid()))
+    assert not tmpdir.join('%d.json' % os.getpid()).check()
+    conf['child_exit'](None, mocker.Mock(pid=os.getpid()))
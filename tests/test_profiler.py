@@ -0,0 +1,42 @@
+"""Test dplaapi.profiler"""
+
+import time
+import threading
+from dplaapi import profiler
+
+
+def busy_function(stopping):
+    while not stopping.is_set():
+        time.sleep(0.001)
+
+
+def test_SamplingProfiler_collects_collapsed_stacks():
+    stopping = threading.Event()
+    thread = threading.Thread(target=busy_function, args=(stopping,),
+                              name='busy')
+    thread.start()
+    sampler = profiler.SamplingProfiler(interval=0.001)
+    sampler.start()
+    time.sleep(0.05)
+    sampler.stop()
+    stopping.set()
+    thread.join()
+
+    lines = sampler.collapsed().splitlines()
+    busy = [line for line in lines if line.startswith('busy;')]
+    assert busy
+    stack, count = busy[0].rsplit(' ', 1)
+    assert stack.endswith('test_profiler:busy_function')
+    assert int(count) > 0
+    assert not any(line.startswith('profiler;') for line in lines)
+
+
+def test_collapsed_stack_is_outermost_first():
+    def inner():
+        import sys
+        return profiler.collapsed_stack('main', sys._getframe())
+    stack = inner().split(';')
+    assert stack[0] == 'main'
+    assert stack[-1] == 'test_profiler:inner'
+    assert stack[-2] == \
+        'test_profiler:test_collapsed_stack_is_outermost_first'
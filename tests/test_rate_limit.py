@@ -0,0 +1,100 @@
+"""Test dplaapi.rate_limit"""
+
+import sqlite3
+import pytest
+from dplaapi import rate_limit
+from dplaapi.rate_limit import (RateLimiter, RateLimited, MemoryStore,
+                                SQLiteStore)
+
+
+def test_MemoryStore_take_allows_burst_then_refuses():
+    store = MemoryStore()
+    assert store.take('k', 1, 1, 2, 100) == (True, 1)
+    assert store.take('k', 1, 1, 2, 100) == (True, 0)
+    assert store.take('k', 1, 1, 2, 100) == (False, 0)
+
+
+def test_MemoryStore_take_refills_at_rate():
+    store = MemoryStore()
+    store.take('k', 2, 2, 2, 100)
+    assert store.take('k', 1, 2, 2, 100.5) == (True, 0)
+    # Never more than the burst size
+    assert store.take('k', 1, 2, 2, 200) == (True, 1)
+
+
+def test_MemoryStore_keeps_keys_apart():
+    store = MemoryStore()
+    store.take('a', 1, 1, 1, 100)
+    assert store.take('b', 1, 1, 1, 100) == (True, 0)
+
+
+def test_SQLiteStore_is_shared_between_instances(tmpdir):
+    path = str(tmpdir.join('buckets.db'))
+    assert SQLiteStore(path).take('k', 1, 1, 2, 100) == (True, 1)
+    assert SQLiteStore(path).take('k', 1, 1, 2, 100) == (True, 0)
+    assert SQLiteStore(path).take('k', 1, 1, 2, 100) == (False, 0)
+
+
+def test_SQLiteStore_uses_WAL(tmpdir):
+    store = SQLiteStore(str(tmpdir.join('buckets.db')))
+    store.take('k', 1, 1, 2, 100)
+    mode = store.connection().execute('PRAGMA journal_mode').fetchone()
+    assert mode == ('wal',)
+
+
+def test_SQLiteStore_allows_request_if_database_fails(tmpdir):
+    path = str(tmpdir.join('buckets.db'))
+    locker = sqlite3.connect(path, isolation_level=None)
+    SQLiteStore(path).take('k', 1, 1, 2, 100)
+    locker.execute('BEGIN EXCLUSIVE')
+    store = SQLiteStore(path)
+    store.connection().execute('PRAGMA busy_timeout=10')
+    assert store.take('k', 1, 1, 2, 100) == (True, 2)
+    locker.execute('ROLLBACK')
+    assert store.take('k', 1, 1, 2, 100) == (True, 0)
+
+
+def test_RateLimiter_check_returns_headers():
+    limiter = RateLimiter(MemoryStore(), {'public': (1, 10)})
+    headers = limiter.check('k', 'public')
+    assert headers == {
+        'X-RateLimit-Limit': '10',
+        'X-RateLimit-Remaining': '9',
+        'X-RateLimit-Reset': '1'
+    }
+
+
+def test_RateLimiter_check_raises_RateLimited():
+    limiter = RateLimiter(MemoryStore(), {'public': (0.5, 1)})
+    limiter.check('k', 'public')
+    with pytest.raises(RateLimited) as e:
+        limiter.check('k', 'public')
+    assert e.value.headers['X-RateLimit-Remaining'] == '0'
+    assert e.value.headers['Retry-After'] == '2'
+
+
+def test_RateLimiter_check_charges_at_most_the_burst():
+    limiter = RateLimiter(MemoryStore(), {'public': (1, 10)})
+    headers = limiter.check('k', 'public', 90.8)
+    assert headers['X-RateLimit-Remaining'] == '0'
+    with pytest.raises(RateLimited) as e:
+        limiter.check('k', 'public', 90.8)
+    assert e.value.headers['Retry-After'] == '10'
+
+
+def test_RateLimiter_check_does_not_limit_unconfigured_class():
+    limiter = RateLimiter(MemoryStore(), {'public': (1, 1)})
+    for _ in range(5):
+        assert limiter.check('k', 'staff') == {}
+
+
+def test_limits_from_env(monkeypatch):
+    monkeypatch.setenv('RATE_LIMIT_PUBLIC', '5,100')
+    monkeypatch.delenv('RATE_LIMIT_STAFF', raising=False)
+    assert rate_limit.limits_from_env() == {'public': (5.0, 100.0)}
+
+
+def test_limiter_from_env_uses_RATE_LIMIT_STORE(monkeypatch, tmpdir):
+    assert isinstance(rate_limit.limiter_from_env().store, MemoryStore)
+    monkeypatch.setenv('RATE_LIMIT_STORE', str(tmpdir.join('buckets.db')))
+    assert isinstance(rate_limit.limiter_from_env().store, SQLiteStore)
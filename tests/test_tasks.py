@@ -0,0 +1,31 @@
+"""Test dplaapi.tasks"""
+
+import asyncio
+import threading
+import pytest
+from dplaapi import tasks
+
+
+def test_current_task_is_None_outside_of_a_task():
+    assert tasks.current_task() is None
+
+
+@pytest.mark.asyncio
+async def test_run_in_thread_calls_function_for_the_current_task():
+    def call(x, y=0):
+        return threading.current_thread(), tasks.current_task(), x + y
+
+    thread, task, result = await tasks.run_in_thread(call, 1, y=2)
+    assert thread is not threading.current_thread()
+    assert task is asyncio.Task.current_task()
+    assert result == 3
+
+
+@pytest.mark.asyncio
+async def test_run_in_thread_forgets_the_task_afterwards():
+    await tasks.run_in_thread(lambda: None)
+    rv = await tasks.run_in_thread(tasks.current_task)
+    assert rv is asyncio.Task.current_task()
+    task = await asyncio.get_event_loop().run_in_executor(
+        None, tasks.current_task)
+    assert task is None
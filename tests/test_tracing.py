@@ -0,0 +1,127 @@
+"""Test dplaapi.tracing"""
+
+import io
+import json
+import asyncio
+import pytest
+import requests
+from starlette.testclient import TestClient
+from dplaapi import app, tracing
+
+
+client = TestClient(app,
+                    base_url='http://localhost',
+                    raise_server_exceptions=False)
+
+trace_id = '4bf92f3577b34da6a3ce929d0e0e4736'
+caller_span_id = '00f067aa0ba902b7'
+
+
+class ListExporter():
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span)
+
+
+class MockResponse():
+    status_code = 200
+    content = b'{}'
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {'hits': {'total': {'value': 0}, 'hits': []}}
+
+
+def test_context_from_header_continues_callers_trace():
+    context = tracing.context_from_header(
+        '00-%s-%s-01' % (trace_id, caller_span_id), 0)
+    assert context.trace_id == trace_id
+    assert context.parent_id == caller_span_id
+    assert context.sampled
+
+
+def test_context_from_header_starts_trace_without_valid_header():
+    context = tracing.context_from_header('garbage', 1)
+    assert len(context.trace_id) == 32
+    assert context.parent_id is None
+    assert context.sampled
+    assert not tracing.context_from_header(None, 0).sampled
+
+
+def test_TraceContext_traceparent():
+    context = tracing.TraceContext(trace_id, caller_span_id, False)
+    assert context.traceparent() == '00-%s-%s-00' % (trace_id, caller_span_id)
+
+
+def test_span_does_nothing_outside_of_a_request():
+    with tracing.span('x') as span:
+        assert span is None
+    assert tracing.propagation_headers() == {}
+
+
+def test_StreamExporter_writes_json_lines():
+    stream = io.StringIO()
+    span = tracing.Span('x', trace_id, None, {'a': 1})
+    span.finish()
+    tracing.StreamExporter(stream).export(span)
+    assert json.loads(stream.getvalue())['attributes'] == {'a': 1}
+
+
+def test_exporter_from_env(monkeypatch, tmpdir):
+    assert isinstance(tracing.exporter_from_env(), tracing.NullExporter)
+    monkeypatch.setenv('TRACE_EXPORTER', 'file')
+    monkeypatch.setenv('TRACE_FILE', str(tmpdir.join('traces.jsonl')))
+    assert isinstance(tracing.exporter_from_env(), tracing.FileExporter)
+    monkeypatch.setenv('TRACE_EXPORTER', 'test_tracing.ListExporter')
+    assert isinstance(tracing.exporter_from_env(), ListExporter)
+
+
+def test_request_is_traced_and_context_propagated(monkeypatch, mocker):
+    monkeypatch.setenv('DISABLE_AUTH', 'true')
+    exporter = ListExporter()
+    monkeypatch.setattr(tracing, 'exporter', exporter)
+    post = mocker.Mock(return_value=MockResponse())
+    monkeypatch.setattr(requests, 'post', post)
+
+    client.get('/v2/items?q=tracing',
+               headers={'traceparent': '00-%s-%s-01' % (trace_id,
+                                                        caller_span_id)})
+
+    spans = {span.name: span for span in exporter.spans}
+    assert set(spans.keys()) >= {'request', 'auth', 'validation', 'query',
+                                 'backend', 'elasticsearch', 'shaping',
+                                 'serialization'}
+    assert all(span.trace_id == trace_id for span in exporter.spans)
+    assert spans['request'].parent_id == caller_span_id
+    assert spans['request'].attributes['status'] == 200
+    assert spans['auth'].parent_id == spans['request'].span_id
+    assert spans['elasticsearch'].parent_id == spans['backend'].span_id
+    es_headers = post.call_args[1]['headers']
+    assert es_headers['traceparent'] == \
+        '00-%s-%s-01' % (trace_id, spans['elasticsearch'].span_id)
+
+
+def test_unsampled_request_is_not_recorded(monkeypatch):
+    monkeypatch.setenv('DISABLE_AUTH', 'true')
+    exporter = ListExporter()
+    monkeypatch.setattr(tracing, 'exporter', exporter)
+    client.get('/v2/items/not-an-id',
+               headers={'traceparent': '00-%s-%s-00' % (trace_id,
+                                                        caller_span_id)})
+    assert exporter.spans == []
+
+
+@pytest.mark.asyncio
+async def test_span_records_error(monkeypatch):
+    exporter = ListExporter()
+    monkeypatch.setattr(tracing, 'exporter', exporter)
+    monkeypatch.setitem(tracing.contexts, asyncio.Task.current_task(),
+                        tracing.TraceContext())
+    with pytest.raises(ValueError):
+        with tracing.span('x'):
+            raise ValueError()
+    assert exporter.spans[0].attributes['error'] == 'ValueError'
@@ -83,3 +83,31 @@ def test_ItemsQueryType_flunks_sort_on_coordinates_without_pin():
     without a sort_by_pin value"""
     with pytest.raises(ValidationError):
         types.ItemsQueryType({'sort_by': 'sourceResource.spatial.coordinates'})
+
+
+# Values for each kind of parameter, valid and not, for comparing the compiled
+# checks with apistar's validators
+sample_values = [
+    None, '', 'x', 'xx', 'OR', 'or', 'asc', 'true', '12', '-1', '1.5',
+    'a' * 201, 'a' * 301, 'sourceResource.title', 'provider.name:xx', 'x:',
+    '40.7, -73.9', '40.7;-73.9', 'http://rightsstatements.org/x/',
+    '"https://dp.la/x"', "I'm free!", '13283cd2bd45ef385aae962b144c7e6a',
+    '13283CD2BD45EF385AAE962B144C7E6A', 12, [], ['dataProvider:xx'],
+    ['x'], ['dataProvider:xx', None], 'dataProvider:xx'
+]
+
+
+@pytest.mark.parametrize('name', sorted(types.items_params))
+def test_param_checks_agree_with_validators(name):
+    validator = types.items_params[name]
+    check = types.param_checks[name]
+    for value in sample_values:
+        assert check(value) == validator.is_valid(value), value
+
+
+def test_ItemsQueryType_error_messages_are_apistar_messages():
+    with pytest.raises(ValidationError) as compiled_e:
+        types.ItemsQueryType({'sort_order': 'up'})
+    with pytest.raises(ValidationError) as apistar_e:
+        types.items_params['sort_order'].validate('up')
+    assert str(compiled_e.value) == 'sort_order: %s' % str(apistar_e.value)